@@ -1,6 +1,9 @@
 """ Main App Module """
 
 import logging
+import os
+
+import tornado.ioloop
 import tornado.web
 
 app = None
@@ -23,6 +26,21 @@ def init():
     # init mongodb
     from app.model import model
     model.init('tornado-test-dev')
+    tornado.ioloop.IOLoop.current().run_sync(model.ensure_indexes)
+    model.start_invalidation_bus()
+
+    # revoked signed tokens, stored by other workers and before restarts
+    from app.rest import tools
+    tools.start_token_denylist()
+
+    # continuation tokens of one worker must verify in the others
+    if not os.environ.get('PAGE_TOKEN_KEY'):
+        raise RuntimeError('PAGE_TOKEN_KEY is not set')
+    tools.init_page_key(os.environ['PAGE_TOKEN_KEY'])
+
+    # delete ended tokens
+    from app.model import reaper
+    reaper.start()
 
     # init rest
     from app.rest import rest
@@ -33,7 +51,6 @@ def init():
 
 if __name__ == "__main__":
     import sys
-    import os
     sys.path.append(os.getcwd())
 
     app = init()
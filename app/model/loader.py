@@ -0,0 +1,94 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+Batched document loader
+
+Ids requested in the same IOLoop iteration are resolved by one
+{'_id': {'$in': ids}} query, so resolving the phrases of a page of links
+costs one query instead of one per link. A loader lives as long as
+a request (see Handler.loader()) and caches what it loaded.
+"""
+
+from logging import getLogger
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+logger = getLogger()
+
+LOADER_MAX_BATCH = 1000
+
+
+class DataLoader(object):
+    """
+    loads documents of a collection by _id in batches
+    """
+    def __init__(self, collection, fields=None, max_batch=LOADER_MAX_BATCH):
+        self.collection = collection
+        # _id is needed to match results, even if the projection excludes it
+        self.hide_id = bool(fields) and not fields.get('_id', 1)
+        self.fields = dict(fields, _id=1) if fields else fields
+        self.max_batch = max_batch
+        # _id -> future of the document, None if missing
+        self.cache = {}
+        self.queue = []
+        self.stats = {
+            'loads': 0,
+            'cached': 0,
+            'queries': 0
+        }
+
+    def _future(self, doc_id):
+        self.stats['loads'] += 1
+        future = self.cache.get(doc_id)
+        if future is not None:
+            self.stats['cached'] += 1
+            return future
+
+        future = self.cache[doc_id] = Future()
+        self.queue.append(doc_id)
+        if len(self.queue) == 1:
+            # after everything else requested in this iteration
+            IOLoop.current().add_callback(self._dispatch)
+        return future
+
+    def load(self, doc_id):
+        """
+        awaitable of a copy of the document, None if it's missing.
+        the id is queued at once, so loads started together share a query
+        """
+        return self._copy(self._future(doc_id), self.hide_id)
+
+    def load_many(self, ids):
+        """ awaitable of documents (or None) of ids in the same order """
+        return gen.multi([self.load(doc_id) for doc_id in ids])
+
+    @staticmethod
+    async def _copy(future, hide_id):
+        doc = await future
+        if not doc:
+            return doc
+        doc = dict(doc)
+        if hide_id:
+            del doc['_id']
+        return doc
+
+    def _dispatch(self):
+        queue, self.queue = self.queue, []
+        for start in range(0, len(queue), self.max_batch):
+            IOLoop.current().spawn_callback(self._fetch, queue[start:start + self.max_batch])
+
+    async def _fetch(self, ids):
+        self.stats['queries'] += 1
+        try:
+            docs = await self.collection.find({'_id': {'$in': ids}},
+                                              self.fields).to_list(len(ids))
+        except Exception as ex:  # pylint: disable=locally-disabled, broad-except
+            for doc_id in ids:
+                # not cached, next load retries
+                self.cache.pop(doc_id).set_exception(ex)
+            return
+
+        docs = {doc['_id']: doc for doc in docs}
+        for doc_id in ids:
+            self.cache[doc_id].set_result(docs.get(doc_id))
@@ -0,0 +1,839 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+In-memory mongo backend
+
+Pure python stand-in for the part of the Motor (0.6) API the model uses:
+find_one, find, insert, update, remove, find_and_modify, aggregate
+($match, $sort, $lookup, $unwind, $project, $limit, $skip), cursors
+(sort, limit, skip, to_list, async for, fetch_next), projections and
+unique indexes. explain() plans by declared indexes, like mongo's
+planner does for the simple queries we issue.
+
+model.init(db_name, 'memory://') selects it. latency is a number of
+seconds or a callable returning one, awaited by every operation to
+simulate a remote database; by default operations cost one IOLoop
+iteration.
+"""
+
+import re
+
+from collections import deque
+from datetime import datetime
+from logging import getLogger
+
+from bson.objectid import ObjectId
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, OperationFailure
+from tornado import gen
+
+logger = getLogger()
+
+MEMORY_URI_SCHEME = 'memory://'
+# documents in the first batch of a cursor, as mongod returns
+FIRST_BATCH_SIZE = 101
+
+
+def _rank(value):
+    """ bson comparison order of types """
+    if value is None:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, (list, tuple)):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def sort_key(value):
+    """ key ordering values of any types as mongo does """
+    if isinstance(value, dict):
+        return (_rank(value), [(k, sort_key(v)) for k, v in value.items()])
+    if isinstance(value, (list, tuple)):
+        return (_rank(value), [sort_key(v) for v in value])
+    return (_rank(value), value)
+
+
+_MISSING = object()
+
+
+def get_path(doc, path):
+    """ value of a dotted path, _MISSING if absent """
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+
+def set_path(doc, path, value):
+    """ sets a dotted path, creating embedded documents """
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def unset_path(doc, path):
+    """ removes a dotted path """
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+
+def copy_doc(value):
+    """
+    deep copy of a document. faster than copy.deepcopy: documents are
+    dicts and lists of immutable values, as decoded from bson
+    """
+    if isinstance(value, dict):
+        return {key: copy_doc(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_doc(item) for item in value]
+    return value
+
+
+def hashable(value):
+    """ value usable as a dict key, missing is null as in indexes """
+    if value is _MISSING:
+        return None
+    if isinstance(value, dict):
+        return ('$doc',) + tuple((key, hashable(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return ('$array',) + tuple(hashable(item) for item in value)
+    return value
+
+
+def _id_lookup(spec):
+    """ hashable _ids a query is limited to by {'_id': id} or {'_id': {'$in': ids}} """
+    if not spec or '_id' not in spec:
+        return None
+    value = spec['_id']
+    if not isinstance(value, dict):
+        return [hashable(value)]
+    if set(value) == {'$in'}:
+        return [hashable(item) for item in value['$in']]
+    if set(value) == {'$eq'}:
+        return [hashable(value['$eq'])]
+    return None
+
+
+def _compare(value, operand, test):
+    # comparisons only match values of the same type bracket
+    return (value is not _MISSING and _rank(value) == _rank(operand) and
+            test(sort_key(value), sort_key(operand)))
+
+
+_OPERATORS = {
+    '$eq': lambda value, operand: _equals(value, operand),
+    '$ne': lambda value, operand: not _equals(value, operand),
+    '$gt': lambda value, operand: _compare(value, operand, lambda a, b: a > b),
+    '$gte': lambda value, operand: _compare(value, operand, lambda a, b: a >= b),
+    '$lt': lambda value, operand: _compare(value, operand, lambda a, b: a < b),
+    '$lte': lambda value, operand: _compare(value, operand, lambda a, b: a <= b),
+    '$in': lambda value, operand: any(_equals(value, item) for item in operand),
+    '$nin': lambda value, operand: not any(_equals(value, item) for item in operand),
+    '$exists': lambda value, operand: (value is not _MISSING) == bool(operand),
+    '$regex': lambda value, operand: isinstance(value, str) and bool(re.search(operand, value))
+}
+
+
+def _equals(value, operand):
+    if value is _MISSING:
+        return operand is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return any(_equals(item, operand) for item in value)
+    return value == operand
+
+
+def _is_operator_dict(value):
+    return isinstance(value, dict) and value and all(key.startswith('$') for key in value)
+
+
+def match(doc, spec):
+    """ True if doc matches query spec """
+    for key, condition in (spec or {}).items():
+        if key == '$and':
+            if not all(match(doc, item) for item in condition):
+                return False
+        elif key == '$or':
+            if not any(match(doc, item) for item in condition):
+                return False
+        elif key == '$nor':
+            if any(match(doc, item) for item in condition):
+                return False
+        elif _is_operator_dict(condition):
+            value = get_path(doc, key)
+            for operator, operand in condition.items():
+                if operator not in _OPERATORS:
+                    raise OperationFailure('unknown operator: %s' % operator)
+                if not _OPERATORS[operator](value, operand):
+                    return False
+        elif not _equals(get_path(doc, key), condition):
+            return False
+    return True
+
+
+def project(doc, fields):
+    """ copy of doc with projection applied """
+    if not fields:
+        return copy_doc(doc)
+    if isinstance(fields, (list, tuple)):
+        fields = {field: 1 for field in fields}
+    include = [key for key, value in fields.items() if value and key != '_id']
+    if include:
+        result = {}
+        for path in include:
+            value = get_path(doc, path)
+            if value is not _MISSING:
+                set_path(result, path, copy_doc(value))
+        if fields.get('_id', 1) and '_id' in doc:
+            result['_id'] = doc['_id']
+        return result
+    result = copy_doc(doc)
+    for path, value in fields.items():
+        if not value:
+            unset_path(result, path)
+    return result
+
+
+def _update_document(doc, update, inserting=False):
+    """ applies update operators (or replacement) to doc in place """
+    if not any(key.startswith('$') for key in update):
+        doc_id = doc.get('_id')
+        doc.clear()
+        doc.update(copy_doc(update))
+        if doc_id is not None:
+            doc['_id'] = doc_id
+        return
+    for operator, changes in update.items():
+        for path, value in changes.items():
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                set_path(doc, path, copy_doc(value))
+            elif operator == '$setOnInsert':
+                pass
+            elif operator == '$unset':
+                unset_path(doc, path)
+            elif operator == '$inc':
+                current = get_path(doc, path)
+                set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif operator == '$push':
+                current = get_path(doc, path)
+                set_path(doc, path, ([] if current is _MISSING else current) + [value])
+            elif operator == '$pull':
+                current = get_path(doc, path)
+                if isinstance(current, list):
+                    set_path(doc, path, [item for item in current if item != value])
+            else:
+                raise OperationFailure('unknown update operator: %s' % operator)
+
+
+def _upsert_document(spec, update):
+    """ new document of an upsert: equality fields of spec, then update """
+    doc = {}
+    for item in spec.get('$and', []) + [spec]:
+        for key, value in item.items():
+            if not key.startswith('$') and not _is_operator_dict(value):
+                set_path(doc, key, copy_doc(value))
+    _update_document(doc, update, inserting=True)
+    return doc
+
+
+def sort_documents(docs, keys):
+    """ sorts docs by [(field, direction)], stable """
+    for field, direction in reversed(keys):
+        if field == '$natural':
+            # docs are in insertion order
+            if direction == -1:
+                docs.reverse()
+            continue
+        docs.sort(key=lambda doc, field=field: sort_key(
+            None if get_path(doc, field) is _MISSING else get_path(doc, field)),
+                  reverse=direction == -1)
+    return docs
+
+
+def _sort_keys(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [tuple(item) for item in key_or_list]
+
+
+class MemoryClient(object):
+    """
+    MotorClient of in-memory databases
+    """
+    def __init__(self, latency=0, **options):
+        # pylint: disable=locally-disabled, unused-argument
+        self.latency = latency
+        self.databases = {}
+
+    def __getitem__(self, name):
+        if name not in self.databases:
+            self.databases[name] = MemoryDatabase(self, name)
+        return self.databases[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    async def wait(self):
+        """ awaits simulated latency of one operation """
+        latency = self.latency() if callable(self.latency) else self.latency
+        await gen.sleep(latency or 0)
+
+    def run(self, operation):
+        """ future of operation (a coroutine) after latency, like motor's """
+        async def delayed():
+            await self.wait()
+            return await operation
+        return gen.convert_yielded(delayed())
+
+    def drop_database(self, name):
+        """ drops database """
+        async def drop():
+            self.databases.pop(getattr(name, 'name', name), None)
+        return self.run(drop())
+
+    def close(self):
+        """ nothing to close """
+
+
+class MemoryDatabase(object):
+    """
+    MotorDatabase of in-memory collections
+    """
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(self, name)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def create_collection(self, name, **options):
+        """ creates collection, fails if it exists """
+        async def create():
+            if name in self.collections:
+                raise CollectionInvalid('collection %s already exists' % name)
+            collection = self[name]
+            collection.options = options
+            return collection
+        return self.client.run(create())
+
+    def collection_names(self):
+        """ names of collections """
+        async def names():
+            return sorted(self.collections)
+        return self.client.run(names())
+
+
+class MemoryCollection(object):
+    """
+    MotorCollection keeping documents by _id, in insertion order.
+    unique indexes are hash maps, so writes don't scan the collection
+    """
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.options = {}
+        # hashable _id -> document
+        self.docs = {}
+        self.indexes = {'_id_': {'key': [('_id', 1)], 'unique': True}}
+        # unique index name -> {key values: hashable _id}
+        self.unique = {'_id_': {}}
+
+    def _run(self, operation):
+        return self.database.client.run(operation)
+
+    def _matching(self, spec):
+        ids = _id_lookup(spec)
+        if ids is None:
+            return [doc for doc in self.docs.values() if match(doc, spec)]
+        # the lookup satisfies _id, the rest of spec is matched
+        docs = [self.docs[doc_id] for doc_id in dict.fromkeys(ids) if doc_id in self.docs]
+        spec = {key: value for key, value in spec.items() if key != '_id'}
+        return [doc for doc in docs if match(doc, spec)]
+
+    def _unique_key(self, name, doc):
+        """ key values of doc in unique index name, None if the index doesn't cover it """
+        info = self.indexes[name]
+        partial = info.get('partialFilterExpression')
+        if partial and not match(doc, partial):
+            return None
+        return tuple(hashable(get_path(doc, field)) for field, _ in info['key'])
+
+    def _unique_keys(self, doc):
+        keys = [(name, self._unique_key(name, doc)) for name in self.unique]
+        return [(name, key) for name, key in keys if key is not None]
+
+    def _duplicate(self, name, key):
+        return DuplicateKeyError('E11000 duplicate key error collection: %s index: %s dup key: %s'
+                                 % (self.name, name, key), 11000)
+
+    def _index(self, doc):
+        keys = self._unique_keys(doc)
+        for name, key in keys:
+            if key in self.unique[name]:
+                raise self._duplicate(name, key)
+        doc_id = hashable(doc['_id'])
+        for name, key in keys:
+            self.unique[name][key] = doc_id
+        self.docs[doc_id] = doc
+
+    def _unindex(self, doc):
+        for name, key in self._unique_keys(doc):
+            self.unique[name].pop(key, None)
+        del self.docs[hashable(doc['_id'])]
+
+    def _insert(self, doc):
+        doc = copy_doc(doc)
+        if '_id' not in doc:
+            doc['_id'] = ObjectId()
+        self._index(doc)
+        return doc
+
+    def _replace(self, doc, updated):
+        if hashable(updated['_id']) != hashable(doc['_id']):
+            raise OperationFailure('the (immutable) field \'_id\' was found to have been altered')
+        self._unindex(doc)
+        try:
+            self._index(updated)
+        except DuplicateKeyError:
+            self._index(doc)
+            raise
+        return updated
+
+    # reads
+
+    def find(self, spec=None, fields=None, **kwargs):
+        """ cursor of matching documents """
+        return MemoryCursor(self, spec, kwargs.get('projection', fields), **kwargs)
+
+    def find_one(self, spec=None, fields=None, **kwargs):
+        """ future of first matching document or None """
+        if spec is not None and not isinstance(spec, dict):
+            spec = {'_id': spec}
+
+        async def find_one():
+            docs = self._matching(spec)
+            return project(docs[0], kwargs.get('projection', fields)) if docs else None
+        return self._run(find_one())
+
+    def count(self, spec=None):
+        """ future of number of matching documents """
+        async def count():
+            return len(self._matching(spec))
+        return self._run(count())
+
+    def aggregate(self, pipeline, **kwargs):
+        # pylint: disable=locally-disabled, unused-argument
+        """ cursor of pipeline results """
+        return MemoryAggregationCursor(self, pipeline)
+
+    # writes
+
+    def insert(self, doc_or_docs, **kwargs):
+        # pylint: disable=locally-disabled, unused-argument
+        """ future of _id (or list of them) of inserted document(s) """
+        async def insert():
+            if isinstance(doc_or_docs, list):
+                ids = []
+                for doc in doc_or_docs:
+                    ids.append(self._insert(doc)['_id'])
+                    doc['_id'] = ids[-1]
+                return ids
+            doc = self._insert(doc_or_docs)
+            doc_or_docs['_id'] = doc['_id']
+            return doc['_id']
+        return self._run(insert())
+
+    def save(self, doc, **kwargs):
+        # pylint: disable=locally-disabled, unused-argument
+        """ future of _id of inserted or replaced document """
+        if '_id' not in doc:
+            return self.insert(doc)
+        return gen.convert_yielded(self._save(doc))
+
+    async def _save(self, doc):
+        await self.update({'_id': doc['_id']}, doc, upsert=True)
+        return doc['_id']
+
+    def update(self, spec, document, upsert=False, multi=False, **kwargs):
+        # pylint: disable=locally-disabled, unused-argument
+        """ future of write result {'n', 'nModified', 'updatedExisting', 'ok'} """
+        async def update():
+            docs = self._matching(spec)
+            if not multi:
+                docs = docs[:1]
+            if not docs and upsert:
+                doc = self._insert(_upsert_document(spec, document))
+                return {'n': 1, 'nModified': 0, 'updatedExisting': False,
+                        'upserted': doc['_id'], 'ok': 1.0}
+            modified = 0
+            for doc in docs:
+                updated = copy_doc(doc)
+                _update_document(updated, document)
+                if updated != doc:
+                    self._replace(doc, updated)
+                    modified += 1
+            return {'n': len(docs), 'nModified': modified, 'updatedExisting': bool(docs),
+                    'ok': 1.0}
+        return self._run(update())
+
+    def remove(self, spec=None, multi=True, **kwargs):
+        # pylint: disable=locally-disabled, unused-argument
+        """ future of write result {'n', 'ok'} """
+        if spec is not None and not isinstance(spec, dict):
+            spec = {'_id': spec}
+
+        async def remove():
+            docs = self._matching(spec)
+            if not multi:
+                docs = docs[:1]
+            for doc in docs:
+                self._unindex(doc)
+            return {'n': len(docs), 'ok': 1.0}
+        return self._run(remove())
+
+    def find_and_modify(self, query=None, update=None, upsert=False, sort=None, new=False,
+                        fields=None, remove=False, **kwargs):
+        # pylint: disable=locally-disabled, unused-argument
+        """ future of the document before (or after, new) the update or removal """
+        async def find_and_modify():
+            docs = self._matching(query or {})
+            if sort:
+                sort_documents(docs, _sort_keys(sort))
+            doc = docs[0] if docs else None
+            if remove:
+                if doc is not None:
+                    self._unindex(doc)
+                return project(doc, fields) if doc is not None else None
+            if doc is None:
+                if not upsert:
+                    return None
+                doc = self._insert(_upsert_document(query or {}, update))
+                return project(doc, fields) if new else None
+            updated = copy_doc(doc)
+            _update_document(updated, update)
+            self._replace(doc, updated)
+            return project(updated if new else doc, fields)
+        return self._run(find_and_modify())
+
+    # indexes
+
+    def create_index(self, keys, **options):
+        """ future of index name. unique indexes are enforced """
+        keys = _sort_keys(keys)
+        name = options.pop('name', None) or '_'.join('%s_%s' % key for key in keys)
+
+        async def create_index():
+            info = self.indexes.get(name)
+            if info and (info['key'] != keys or
+                         bool(info.get('unique')) != bool(options.get('unique'))):
+                raise OperationFailure('index %s exists with different options' % name)
+            if not info:
+                self.indexes[name] = dict(options, key=keys)
+                if options.get('unique'):
+                    unique = self.unique[name] = {}
+                    for doc in self.docs.values():
+                        key = self._unique_key(name, doc)
+                        if key in unique:
+                            del self.indexes[name], self.unique[name]
+                            raise self._duplicate(name, key)
+                        if key is not None:
+                            unique[key] = hashable(doc['_id'])
+            return name
+        return self._run(create_index())
+
+    ensure_index = create_index
+
+    def drop_index(self, name):
+        """ drops index by name """
+        async def drop_index():
+            if name not in self.indexes or name == '_id_':
+                raise OperationFailure('index not found with name [%s]' % name)
+            del self.indexes[name]
+            self.unique.pop(name, None)
+        return self._run(drop_index())
+
+    def index_information(self):
+        """ future of {name: {'key': [(field, direction)], ...}} """
+        async def index_information():
+            return copy_doc(self.indexes)
+        return self._run(index_information())
+
+    def drop(self):
+        """ drops collection """
+        async def drop():
+            self.database.collections.pop(self.name, None)
+        return self._run(drop())
+
+    def plan(self, spec, sort=None):
+        """
+        explain()'s winning plan: index scan of the index with the longest
+        prefix of equality fields (or a range/sort field next to it),
+        SORT stage if the index order doesn't serve sort
+        """
+        spec = spec or {}
+        if set(spec) == {'_id'} and not _is_operator_dict(spec['_id']):
+            return {'stage': 'IDHACK'}
+
+        equality, ranges = set(), set()
+        for item in spec.get('$and', []) + [spec]:
+            for key, value in item.items():
+                if key.startswith('$'):
+                    continue
+                if _is_operator_dict(value) and set(value) - {'$eq', '$in'}:
+                    ranges.add(key)
+                else:
+                    equality.add(key)
+
+        best = None
+        for name, info in sorted(self.indexes.items()):
+            fields = [field for field, _ in info['key']]
+            prefix = 0
+            while prefix < len(fields) and fields[prefix] in equality:
+                prefix += 1
+            rest = [(field, direction) for field, direction in info['key'][prefix:]]
+            sorted_by = bool(sort) and len(rest) >= len(sort) and (
+                rest[:len(sort)] == list(sort) or
+                rest[:len(sort)] == [(field, -direction) for field, direction in sort])
+            usable = prefix or (rest and rest[0][0] in ranges) or sorted_by
+            score = (prefix + (1 if rest and rest[0][0] in ranges else 0), sorted_by)
+            if usable and (best is None or score > best[0]):
+                best = (score, name, sorted_by)
+
+        if best is None:
+            plan = {'stage': 'COLLSCAN'}
+            sorted_by = not sort
+        else:
+            plan = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': best[1]}}
+            sorted_by = not sort or best[2]
+        if not sorted_by:
+            plan = {'stage': 'SORT', 'inputStage': plan}
+        return plan
+
+
+class MemoryCursor(object):
+    """
+    MotorCursor. the query runs on the first fetch, results come in batches
+    as from mongod: FIRST_BATCH_SIZE documents, then the rest (or batch_size
+    at a time), every batch costs the client's latency
+    """
+    def __init__(self, collection, spec=None, fields=None, **kwargs):
+        self.collection = collection
+        self.spec = spec
+        self.fields = fields
+        self.sort_keys = None
+        self.skip_count = kwargs.get('skip', 0)
+        self.limit_count = kwargs.get('limit', 0)
+        self.batch_count = kwargs.get('batch_size', 0)
+        # documents left on the "server", None before the query, and fetched ones
+        self.results = None
+        self.batch = deque()
+
+    def sort(self, key_or_list, direction=None):
+        """ orders by [(field, direction)] """
+        self.sort_keys = _sort_keys(key_or_list, direction)
+        return self
+
+    def limit(self, limit):
+        """ at most limit documents, 0 is no limit """
+        self.limit_count = limit
+        return self
+
+    def skip(self, skip):
+        """ skips first documents """
+        self.skip_count = skip
+        return self
+
+    def batch_size(self, batch_size):
+        """ documents per batch """
+        self.batch_count = batch_size
+        return self
+
+    @property
+    def alive(self):
+        """ False once every document is fetched """
+        return bool(self.results is None or self.results or self.batch)
+
+    def _query(self):
+        docs = self.collection._matching(self.spec)
+        if self.sort_keys:
+            sort_documents(docs, self.sort_keys)
+        docs = docs[self.skip_count:]
+        if self.limit_count:
+            docs = docs[:abs(self.limit_count)]
+        return [project(doc, self.fields) for doc in docs]
+
+    async def _get_more(self):
+        await self.collection.database.client.wait()
+        if self.results is None:
+            self.results = deque(self._query())
+            size = self.batch_count or FIRST_BATCH_SIZE
+        else:
+            size = self.batch_count or len(self.results)
+        while self.results and size:
+            self.batch.append(self.results.popleft())
+            size -= 1
+
+    def to_list(self, length):
+        """ future of up to length next documents """
+        async def to_list():
+            docs = []
+            while len(docs) < length and self.alive:
+                if not self.batch:
+                    await self._get_more()
+                while self.batch and len(docs) < length:
+                    docs.append(self.batch.popleft())
+            return docs
+        return gen.convert_yielded(to_list())
+
+    @property
+    def fetch_next(self):
+        """ future of True if there's a next document """
+        async def fetch_next():
+            if not self.batch and self.alive:
+                await self._get_more()
+            return bool(self.batch)
+        return gen.convert_yielded(fetch_next())
+
+    def next_object(self):
+        """ next document, after fetch_next """
+        return self.batch.popleft() if self.batch else None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not await self.fetch_next:
+            raise StopAsyncIteration
+        return self.next_object()
+
+    def explain(self):
+        """ future of the query plan """
+        async def explain():
+            return {'queryPlanner': {
+                'namespace': '%s.%s' % (self.collection.database.name, self.collection.name),
+                'winningPlan': self.collection.plan(self.spec, self.sort_keys),
+                'rejectedPlans': []
+            }}
+        return self.collection._run(explain())
+
+    def close(self):
+        """ stops iteration """
+        self.results = deque()
+        self.batch.clear()
+
+
+class MemoryAggregationCursor(MemoryCursor):
+    """
+    cursor of an aggregation pipeline
+    """
+    def __init__(self, collection, pipeline):
+        super().__init__(collection)
+        self.pipeline = pipeline
+
+    def _query(self):
+        stages = self.pipeline
+        if stages and '$match' in stages[0]:
+            docs, stages = self.collection._matching(stages[0]['$match']), stages[1:]
+        else:
+            docs = list(self.collection.docs.values())
+        docs = [copy_doc(doc) for doc in docs]
+        for stage in stages:
+            docs = self._stage(docs, stage)
+        return docs
+
+    def _stage(self, docs, stage):
+        (operator, options), = stage.items()
+        if operator == '$match':
+            return [doc for doc in docs if match(doc, options)]
+        if operator == '$sort':
+            return sort_documents(docs, _sort_keys(options))
+        if operator == '$limit':
+            return docs[:options]
+        if operator == '$skip':
+            return docs[options:]
+        if operator == '$lookup':
+            # hash join on foreignField
+            foreign = {}
+            for other in self.collection.database[options['from']].docs.values():
+                value = get_path(other, options['foreignField'])
+                for item in (value if isinstance(value, list) else [value]):
+                    foreign.setdefault(hashable(item), []).append(other)
+            for doc in docs:
+                value = get_path(doc, options['localField'])
+                doc[options['as']] = [copy_doc(other)
+                                      for other in foreign.get(hashable(value), ())]
+            return docs
+        if operator == '$unwind':
+            path = options if isinstance(options, str) else options['path']
+            path = path[1:]
+            result = []
+            for doc in docs:
+                for item in get_path(doc, path) if get_path(doc, path) is not _MISSING else []:
+                    unwound = copy_doc(doc)
+                    set_path(unwound, path, item)
+                    result.append(unwound)
+            return result
+        if operator == '$project':
+            return [self._project(doc, options) for doc in docs]
+        raise OperationFailure('unsupported pipeline stage: %s' % operator)
+
+    @staticmethod
+    def _project(doc, options):
+        if not any(isinstance(value, str) and value.startswith('$') for value in options.values()):
+            return project(doc, options)
+        result = {}
+        if options.get('_id', 1) == 1 and '_id' in doc:
+            result['_id'] = doc['_id']
+        for field, value in options.items():
+            if isinstance(value, str) and value.startswith('$'):
+                value = get_path(doc, value[1:])
+                if value is not _MISSING:
+                    result[field] = value
+            elif value and field != '_id':
+                value = get_path(doc, field)
+                if value is not _MISSING:
+                    result[field] = value
+        return result
+
+    def explain(self):
+        """ future of the plan of leading $match and $sort """
+        stages = self.pipeline
+        spec = stages[0].get('$match') if stages else None
+        sort = _sort_keys(stages[1]['$sort']) if spec is not None and len(stages) > 1 and \
+            '$sort' in stages[1] else None
+
+        async def explain():
+            return {'queryPlanner': {'winningPlan': self.collection.plan(spec, sort)}}
+        return self.collection._run(explain())
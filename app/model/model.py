@@ -3,19 +3,543 @@
 Manage mongodb connection and model layer
 """
 
+import os
+import time
+import socket
+import threading
+
 from logging import getLogger
 
 import motor.motor_tornado
 
+from pymongo import ASCENDING
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from app.model import memory
+from app.model import profiler
+
 logger = getLogger()
 client = None
 db = None
 
+MONGO_URI = 'mongodb://localhost:27017'
+# in-memory backend (app.model.memory), for tests and benchmarks without mongod
+MEMORY_URI = memory.MEMORY_URI_SCHEME
+# MotorClient options, init() takes overrides
+CLIENT_OPTIONS = {
+    'maxPoolSize': 100,
+    'waitQueueTimeoutMS': 1000,
+    'connectTimeoutMS': 5000,
+    'socketTimeoutMS': 30000
+}
+
+# settings of init(), client is made from them once per process
+_db_name = None
+_uri = MONGO_URI
+_options = {}
+_pid = None
+
+# connection pool of current process, needs pymongo.monitoring (pymongo >= 3.9)
+pool_stats = {
+    'available': False,
+    'connections': 0,
+    'checked_out': 0,
+    'max_checked_out': 0,
+    'waiting': 0,
+    'max_waiting': 0,
+    'checkouts': 0,
+    'checkout_failures': 0,
+    'wait_seconds': 0.0,
+    'max_wait_seconds': 0.0
+}
+
+INVALIDATION_COLLECTION = 'invalidations'
+INVALIDATION_COLLECTION_SIZE = 1024 * 1024  # bytes
+INVALIDATION_TRANSPORT_CAPPED = 'capped'
+INVALIDATION_TRANSPORT_CHANGE_STREAM = 'change_stream'
+INVALIDATION_RETRY_SECONDS = 1
+
+# invalidation bus: collection -> [callback(key)]
+_subscribers = {}
+_listening = False
+invalidation_stats = {
+    'published': 0,
+    'received': 0,
+    'last_delay': None,
+    'max_delay': 0.0,
+    'total_delay': 0.0
+}
+
+# in-flight find_one operations: (collection, spec, fields) -> future
+_inflight = {}
+coalesce_stats = {
+    'calls': 0,
+    'coalesced': 0
+}
+
+
+class _PoolListener(getattr(monitoring, 'ConnectionPoolListener', object)):
+    """
+    counts pool checkouts into pool_stats. events come from driver threads
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _update(self, **deltas):
+        with self.lock:
+            for name, delta in deltas.items():
+                pool_stats[name] += delta
+            pool_stats['max_checked_out'] = max(pool_stats['max_checked_out'],
+                                                pool_stats['checked_out'])
+            pool_stats['max_waiting'] = max(pool_stats['max_waiting'], pool_stats['waiting'])
+
+    def _waited(self):
+        seconds = time.monotonic() - getattr(self.local, 'started', time.monotonic())
+        with self.lock:
+            pool_stats['wait_seconds'] += seconds
+            pool_stats['max_wait_seconds'] = max(pool_stats['max_wait_seconds'], seconds)
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.monotonic()
+        self._update(waiting=1)
+
+    def connection_checked_out(self, event):
+        self._waited()
+        self._update(waiting=-1, checked_out=1, checkouts=1)
+
+    def connection_check_out_failed(self, event):
+        self._waited()
+        self._update(waiting=-1, checkout_failures=1)
+
+    def connection_checked_in(self, event):
+        self._update(checked_out=-1)
+
+    def connection_created(self, event):
+        self._update(connections=1)
+
+    def connection_closed(self, event):
+        self._update(connections=-1)
+
+    def _ignore(self, event):
+        pass
+
+    pool_created = pool_ready = pool_cleared = pool_closed = connection_ready = _ignore
+
+
+class _Database(object):
+    """
+    database of the client of current process. a process forked after
+    init() gets its own client (and pool) on first use.
+    collections are wrapped by the profiler if it's enabled
+    """
+    def __getattr__(self, name):
+        return _profiled(name, getattr(connect()[_db_name], name))
+
+    def __getitem__(self, name):
+        return _profiled(name, connect()[_db_name][name])
+
+
+def _profiled(name, attr):
+    if (profiler.enabled and name != INVALIDATION_COLLECTION and
+            not name.startswith('_') and hasattr(attr, 'find_one')):
+        return profiler.ProfiledCollection(attr)
+    return attr
+
+
+def init(db_name, uri=MONGO_URI, **options):
+    """
+    initializes mongo db connection. options override CLIENT_OPTIONS
+    (maxPoolSize, waitQueueTimeoutMS, connectTimeoutMS, socketTimeoutMS, ...).
+    uri memory:// uses in-memory databases, latency= option simulates a remote one
+    """
+    logger.debug('init model, db_name: %s, uri: %s', db_name, uri)
+
+    global db, _db_name, _uri, _options, _pid
+    _db_name = db_name
+    _uri = uri
+    _options = dict(CLIENT_OPTIONS, **options)
+    _pid = None
+    db = _Database()
+    connect()
+
+
+def connect():
+    """
+    client of current process. made on first use after init() or fork,
+    a client (and its sockets) inherited from the parent is never used
+    """
+    global client, _pid
+    if _pid != os.getpid():
+        options = dict(_options)
+        for name, value in pool_stats.items():
+            pool_stats[name] = type(value)()
+        if _uri.startswith(MEMORY_URI):
+            # data lives in the process, a forked child keeps its copy
+            if _pid is None or not isinstance(client, memory.MemoryClient):
+                client = memory.MemoryClient(**options)
+        else:
+            pool_stats['available'] = hasattr(monitoring, 'ConnectionPoolListener')
+            if pool_stats['available']:
+                options['event_listeners'] = [_PoolListener()]
+            client = motor.motor_tornado.MotorClient(_uri, **options)
+        _pid = os.getpid()
+    return client
+
+
+class MissingIndexError(Exception):
+    """ required indexes are absent """
+
+
+def index(keys, required=True, **options):
+    """
+    declares an index: keys [(field, direction)] and create_index options
+    (unique, expireAfterSeconds, partialFilterExpression, ...).
+    without a required index lookups scan the collection
+    """
+    return {'keys': list(keys), 'required': required, 'options': options}
+
+
+# collection -> indexes the model relies on, created by ensure_indexes()
+INDEXES = {
+    'users': [
+        index([('email', ASCENDING)], unique=True)
+    ],
+    'auths': [
+        index([('access_token', ASCENDING)], unique=True),
+        index([('refresh_token', ASCENDING)], unique=True),
+        # one token pair per consumer, user and token epoch
+        index([('consumer_id', ASCENDING), ('user_id', ASCENDING), ('token_epoch', ASCENDING)],
+              unique=True),
+        # mongo deletes ended auths itself, the reaper covers for it if missing
+        index([('end_date', ASCENDING)], required=False, expireAfterSeconds=0)
+    ],
+    'consumers': [
+        index([('secret_code', ASCENDING)], unique=True),
+        # keyset pagination of lists, see find_page()
+        index([('user_id', ASCENDING), ('_id', ASCENDING)])
+    ],
+    'phrasebooks': [
+        index([('user_id', ASCENDING), ('_id', ASCENDING)])
+    ],
+    'phrasebook_phrases': [
+        index([('phrasebook_id', ASCENDING), ('_id', ASCENDING)]),
+        index([('phrasebook_id', ASCENDING), ('phrase_id', ASCENDING)], unique=True)
+    ],
+    'token_denylist': [
+        # denials of signed tokens are dropped when the tokens expire
+        index([('expire_date', ASCENDING)], expireAfterSeconds=0)
+    ]
+}
+
+# collection -> names of indexes replaced by ones in INDEXES
+OBSOLETE_INDEXES = {
+    'auths': ['consumer_id_1_user_id_1']
+}
+
+
+# options an index must have as declared, others (background, name, ...) don't matter
+INDEX_OPTIONS = ('unique', 'expireAfterSeconds', 'partialFilterExpression')
+
+
+def _key(keys):
+    return tuple((field, int(direction) if isinstance(direction, float) else direction)
+                 for field, direction in keys)
+
+
+def _index_options(options):
+    options = {name: options[name] for name in INDEX_OPTIONS if name in options}
+    if not options.get('unique'):
+        options.pop('unique', None)
+    if 'expireAfterSeconds' in options:
+        options['expireAfterSeconds'] = int(options['expireAfterSeconds'])
+    if 'partialFilterExpression' in options:
+        options['partialFilterExpression'] = dict(options['partialFilterExpression'])
+    return options
+
+
+async def _present_indexes(collection):
+    """ {key: (name, options)} of indexes in db """
+    return {_key(info['key']): (name, _index_options(info)) for name, info in
+            (await db[collection].index_information()).items()}
+
+
+async def _index_states():
+    """ [(collection, index, (name, options) of present index of its keys or None)] """
+    states = []
+    for collection, indexes in sorted(INDEXES.items()):
+        present = await _present_indexes(collection)
+        states += [(collection, spec, present.get(_key(spec['keys']))) for spec in indexes]
+    return states
+
+
+def _conflicts(spec, found):
+    return found is not None and found[1] != _index_options(spec['options'])
+
+
+async def missing_indexes():
+    """
+    [(collection, index)] of INDEXES absent in db or present with other
+    INDEX_OPTIONS (conflicting), e.g. not unique
+    """
+    return [(collection, spec) for collection, spec, found in await _index_states()
+            if found is None or _conflicts(spec, found)]
+
+
+async def _create_index(collection, spec):
+    try:
+        await db[collection].create_index(spec['keys'], background=True, **spec['options'])
+    except Exception:  # pylint: disable=locally-disabled, broad-except
+        logger.exception('index %s %s was not created', collection, spec['keys'])
+
+
+async def _rebuild_index(collection, spec, name, options):
+    """
+    replaces conflicting index name by spec. the old one is restored
+    if spec can't be built, e.g. unique over duplicates
+    """
+    logger.warning('rebuilding index %s.%s, %s -> %s', collection, name, options,
+                   _index_options(spec['options']))
+    await db[collection].drop_index(name)
+    try:
+        await db[collection].create_index(spec['keys'], background=True, **spec['options'])
+    except Exception:  # pylint: disable=locally-disabled, broad-except
+        logger.exception('index %s.%s was not rebuilt, restoring it', collection, name)
+        await db[collection].create_index(spec['keys'], name=name, background=True, **options)
+
+
+async def ensure_indexes(strict=True, rebuild=False):
+    """
+    drops obsolete and creates missing INDEXES (in the background on the server),
+    then verifies them. missing required indexes are logged as errors,
+    strict raises MissingIndexError so the app doesn't serve without them.
+
+    an index of declared keys with other options (conflicting) is only reported,
+    dropping it may leave no index at all. rebuild replaces conflicting ones:
+    a migration to run once (python -m app.model.model <db_name>), not by every worker.
+    returns [(collection, index)] of missing and conflicting ones.
+    creates the capped collection of the invalidation bus too
+    """
+    await _create_invalidation_collection()
+    for collection, names in OBSOLETE_INDEXES.items():
+        info = await db[collection].index_information()
+        for name in names:
+            if name in info:
+                logger.info('dropping obsolete index %s.%s', collection, name)
+                await db[collection].drop_index(name)
+
+    states = await _index_states()
+    absent = [(collection, spec) for collection, spec, found in states if found is None]
+    if absent:
+        logger.info('creating %d indexes', len(absent))
+        await gen.multi([_create_index(collection, spec) for collection, spec in absent])
+    if rebuild:
+        for collection, spec, found in states:
+            if _conflicts(spec, found):
+                await _rebuild_index(collection, spec, *found)
+    if absent or rebuild:
+        states = await _index_states()
+
+    missing, required = [], []
+    for collection, spec, found in states:
+        if _conflicts(spec, found):
+            logger.error('index %s.%s has options %s instead of %s, it needs a rebuild',
+                         collection, found[0], found[1], _index_options(spec['options']))
+        elif found is None:
+            log = logger.error if spec['required'] else logger.warning
+            log('index %s %s is missing', collection, spec['keys'])
+            if spec['required']:
+                required.append((collection, spec['keys']))
+        else:
+            continue
+        missing.append((collection, spec))
+    if required and strict:
+        raise MissingIndexError('required indexes are missing: %s' % required)
+    return missing
+
+
+def versioned(update):
+    """
+    adds version bump to an update document. every write of a versioned
+    document (users, phrasebooks, phrases) goes through it; inserts set version 1
+    """
+    update = dict(update)
+    update['$inc'] = dict(update.get('$inc', {}), version=1)
+    return update
+
+
+async def find_one(collection, spec, fields=None):
+    """
+    collection.find_one which coalesces concurrent identical reads into one
+    in-flight operation. every waiter gets its own (shallow) copy of the result
+    """
+    coalesce_stats['calls'] += 1
+    key = (collection.name, repr(spec), repr(fields))
+    future = _inflight.get(key)
+    if future is None:
+        future = collection.find_one(spec, fields)
+        _inflight[key] = future
+
+        def done(_):
+            if _inflight.get(key) is future:
+                del _inflight[key]
+        future.add_done_callback(done)
+    else:
+        coalesce_stats['coalesced'] += 1
+
+    doc = await future
+    return dict(doc) if doc else doc
+
+
+def find_page(collection, spec, fields=None, key='_id', after=None, limit=None):
+    """
+    cursor of documents matching spec in (key, _id) order, following the
+    document whose (key, _id) values are after. keyset instead of skip:
+    with an index on (spec fields.., key, _id) every page is one range scan
+    """
+    if after is not None:
+        if key == '_id':
+            bound = {'_id': {'$gt': after[-1]}}
+        else:
+            value, doc_id = after
+            bound = {'$or': [{key: {'$gt': value}}, {key: value, '_id': {'$gt': doc_id}}]}
+        spec = {'$and': [spec, bound]} if spec else bound
+    sort = [('_id', ASCENDING)]
+    if key != '_id':
+        sort.insert(0, (key, ASCENDING))
+    cursor = collection.find(spec, fields).sort(sort)
+    return cursor.limit(limit) if limit else cursor
+
+
+def subscribe(collection, callback):
+    """
+    registers callback(key) for invalidations of collection,
+    both local and published by other workers
+    """
+    _subscribers.setdefault(collection, []).append(callback)
+
+
+def _source():
+    """ identifies current worker process, safe after fork """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def _dispatch(collection, key):
+    for callback in _subscribers.get(collection, ()):
+        try:
+            callback(key)
+        except Exception:  # pylint: disable=locally-disabled, broad-except
+            logger.exception('invalidation callback failed, %s: %s', collection, key)
+
+
+def publish(collection, key):
+    """
+    invalidates (collection, key) in this worker and broadcasts it to others
+    """
+    _dispatch(collection, key)
+    invalidation_stats['published'] += 1
+    if db is None:
+        return
+
+    future = db[INVALIDATION_COLLECTION].insert({
+        'c': collection,
+        'k': key,
+        'src': _source(),
+        'ts': time.time()
+    })
+
+    def done(f):
+        if f.exception():
+            logger.error('invalidation publish failed, %s: %s: %s', collection, key, f.exception())
+    IOLoop.current().add_future(future, done)
+
+
+def _receive(event):
+    if event.get('src') == _source():
+        return
+    delay = max(time.time() - event['ts'], 0.0)
+    invalidation_stats['received'] += 1
+    invalidation_stats['last_delay'] = delay
+    invalidation_stats['total_delay'] += delay
+    invalidation_stats['max_delay'] = max(invalidation_stats['max_delay'], delay)
+    _dispatch(event['c'], event['k'])
+
+
+async def _tail_capped(collection):
+    """ follows capped collection by a tailable cursor """
+    last = await collection.find().sort('$natural', -1).limit(1).to_list(1)
+    spec = {'_id': {'$gt': last[0]['_id']}} if last else {}
+
+    cursor = collection.find(spec, tailable=True, await_data=True)
+    while _listening:
+        if not cursor.alive:
+            # empty collection or cursor died. reopen after the last seen event
+            await gen.sleep(INVALIDATION_RETRY_SECONDS)
+            cursor = collection.find(spec, tailable=True, await_data=True)
+            continue
+        if await cursor.fetch_next:
+            event = cursor.next_object()
+            spec = {'_id': {'$gt': event['_id']}}
+            _receive(event)
+
+
+async def _watch(collection):
+    """ follows collection by a change stream """
+    async with collection.watch([{'$match': {'operationType': 'insert'}}]) as stream:
+        async for change in stream:
+            if not _listening:
+                break
+            _receive(change['fullDocument'])
+
+
+async def _create_invalidation_collection():
+    """ the first publish() would create a plain collection, which can't be tailed """
+    try:
+        await db.create_collection(INVALIDATION_COLLECTION, capped=True,
+                                   size=INVALIDATION_COLLECTION_SIZE)
+    except CollectionInvalid:
+        pass
+
+
+async def _listen(transport):
+    await _create_invalidation_collection()
+    collection = db[INVALIDATION_COLLECTION]
+
+    while _listening:
+        try:
+            if transport == INVALIDATION_TRANSPORT_CHANGE_STREAM:
+                await _watch(collection)
+            else:
+                await _tail_capped(collection)
+        except Exception:  # pylint: disable=locally-disabled, broad-except
+            logger.exception('invalidation bus failed, reconnecting')
+            await gen.sleep(INVALIDATION_RETRY_SECONDS)
+
+
+def start_invalidation_bus(transport=INVALIDATION_TRANSPORT_CAPPED):
+    """
+    subscribes this worker to invalidations published by others.
+    call in every worker process, after fork
+    """
+    global _listening
+    logger.debug('start invalidation bus, transport: %s', transport)
+
+    _listening = True
+    IOLoop.current().spawn_callback(_listen, transport)
+
+
+def stop_invalidation_bus():
+    """ stops listening to other workers """
+    global _listening
+    _listening = False
+
 
-def init(db_name):
-    """ initializes mongo db connection """
-    logger.debug('init model, db_name: %s', db_name)
+if __name__ == "__main__":
+    # rebuilds conflicting indexes, once: python -m app.model.model <db_name>
+    import sys
 
-    global client, db
-    client = motor.motor_tornado.MotorClient()
-    db = client[db_name]
+    init(sys.argv[1] if len(sys.argv) > 1 else 'tornado-test-dev')
+    IOLoop.current().run_sync(lambda: ensure_indexes(rebuild=True))
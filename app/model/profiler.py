@@ -0,0 +1,321 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+Mongo query profiler
+
+Collections of model.db are wrapped to time every operation by
+(collection, operation, query shape) and calling handler. Slow queries
+are logged with their plan, requests issuing too many queries (or one
+shape over and over) are logged as possible N+1.
+
+With capture_plans every shape is kept with a sample query, check_plans()
+explains them and reports collection scans and in-memory sorts.
+"""
+
+import json
+import time
+
+from logging import getLogger
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+try:
+    import contextvars
+except ImportError:
+    # python < 3.7, queries are not attributed to handlers
+    contextvars = None
+
+logger = getLogger()
+
+SLOW_QUERY_SECONDS = 0.1
+# per request: more queries, or more of the same shape, is a possible N+1
+N_PLUS_ONE_QUERIES = 20
+N_PLUS_ONE_REPEATS = 10
+
+# operations of collections which are timed, others are passed through
+PROFILED_OPERATIONS = ('find_one', 'insert', 'update', 'remove', 'find_and_modify', 'count')
+CURSOR_OPERATIONS = ('find', 'aggregate')
+# methods of cursors which return the cursor itself
+CURSOR_CHAIN = ('sort', 'limit', 'skip', 'batch_size', 'hint', 'max_time_ms')
+
+# plan stages of a query which is not served by an index
+BAD_STAGES = ('COLLSCAN', 'SORT')
+
+enabled = True
+# (collection, operation, shape) -> counters
+query_stats = {}
+
+capture_plans = False
+# (collection, operation, shape, sort) -> sample (collection, spec, sort), not yet explained
+_captured = {}
+_explained = set()
+
+_request = contextvars.ContextVar('profiler_request', default=None) if contextvars else None
+
+
+def query_shape(spec):
+    """
+    spec with values replaced by 1: {'_id': {'$in': [..]}} -> '{"_id": {"$in": 1}}'.
+    operators and nesting are kept, so equal shapes use equal plans
+    """
+    def shape(value):
+        if isinstance(value, dict):
+            return {key: shape(item) for key, item in value.items()}
+        if isinstance(value, list) and value and all(isinstance(i, dict) for i in value):
+            return [shape(item) for item in value]
+        return 1
+    return json.dumps(shape(spec or {}), sort_keys=True)
+
+
+def start_request(handler):
+    """
+    starts counting queries of a request (called by Handler.prepare).
+    returns its stats, which go to finish_request
+    """
+    request = {'handler': handler, 'queries': 0, 'seconds': 0.0, 'shapes': {}}
+    if _request is not None:
+        _request.set(request)
+    return request
+
+
+def finish_request(request):
+    """ logs possible N+1 of a finished request """
+    if not request:
+        return
+    # later queries of its context, e.g. callbacks, are not the request's
+    if _request is not None and _request.get() is request:
+        _request.set(None)
+    repeats = max(request['shapes'].values()) if request['shapes'] else 0
+    if request['queries'] > N_PLUS_ONE_QUERIES or repeats > N_PLUS_ONE_REPEATS:
+        shape = max(request['shapes'], key=request['shapes'].get)
+        logger.warning('possible N+1: %s made %d queries (%.1fms), %d x %s',
+                       request['handler'], request['queries'], request['seconds'] * 1000,
+                       repeats, ' '.join(shape))
+
+
+def _record(collection, operation, spec, seconds, sort=None):
+    shape = query_shape(spec)
+    if capture_plans and operation != 'insert':
+        key = (collection.name, operation, shape, json.dumps(sort))
+        if key not in _explained:
+            _captured[key] = (collection, spec, sort)
+
+    request = _request.get() if _request is not None else None
+    handler = request['handler'] if request else None
+
+    stats = query_stats.get((collection.name, operation, shape))
+    if stats is None:
+        stats = query_stats[(collection.name, operation, shape)] = {
+            'count': 0,
+            'seconds': 0.0,
+            'max_seconds': 0.0,
+            'slow': 0,
+            'handlers': {}
+        }
+    stats['count'] += 1
+    stats['seconds'] += seconds
+    stats['max_seconds'] = max(stats['max_seconds'], seconds)
+    stats['handlers'][handler] = stats['handlers'].get(handler, 0) + 1
+
+    if request:
+        request['queries'] += 1
+        request['seconds'] += seconds
+        key = (collection.name, operation, shape)
+        request['shapes'][key] = request['shapes'].get(key, 0) + 1
+
+    if seconds >= SLOW_QUERY_SECONDS:
+        stats['slow'] += 1
+        if operation not in ('aggregate', 'insert'):
+            IOLoop.current().spawn_callback(_log_slow, collection, operation, spec, seconds,
+                                            handler)
+
+
+async def _log_slow(collection, operation, spec, seconds, handler):
+    try:
+        plan = await collection.find(spec).explain()
+        plan = plan.get('queryPlanner', {}).get('winningPlan', plan)
+    except Exception as ex:  # pylint: disable=locally-disabled, broad-except
+        plan = 'explain failed: %s' % ex
+    logger.warning('slow query %.1fms %s.%s %s by %s, plan: %s', seconds * 1000,
+                   collection.name, operation, query_shape(spec), handler, plan)
+
+
+class ProfiledCursor(object):
+    """
+    cursor which times to_list() and iteration as one query
+    """
+    def __init__(self, cursor, collection, operation, spec, sort=None):
+        self.cursor = cursor
+        self.collection = collection
+        self.operation = operation
+        self.spec = spec
+        self.sort_keys = sort
+        self.seconds = 0.0
+
+    def __getattr__(self, name):
+        attr = getattr(self.cursor, name)
+        if name in CURSOR_CHAIN:
+            def chain(*args, **kwargs):
+                attr(*args, **kwargs)
+                if name == 'sort':
+                    self.sort_keys = _sort_keys(*args, **kwargs)
+                return self
+            return chain
+        return attr
+
+    def _record(self, seconds):
+        _record(self.collection, self.operation, self.spec, seconds, self.sort_keys)
+
+    async def to_list(self, length):
+        """ MotorCursor.to_list """
+        started = time.monotonic()
+        docs = await self.cursor.to_list(length)
+        self._record(time.monotonic() - started)
+        return docs
+
+    def __aiter__(self):
+        self.seconds = 0.0
+        self.iterator = self.cursor.__aiter__()
+        return self
+
+    async def __anext__(self):
+        started = time.monotonic()
+        try:
+            doc = await self.iterator.__anext__()
+        except StopAsyncIteration:
+            self._record(self.seconds + time.monotonic() - started)
+            raise
+        self.seconds += time.monotonic() - started
+        return doc
+
+
+class ProfiledCollection(object):
+    """
+    collection which times its operations
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name in PROFILED_OPERATIONS:
+            return self._timed(name, attr)
+        if name in CURSOR_OPERATIONS:
+            def cursor(*args, **kwargs):
+                spec, sort = _spec(args, kwargs), None
+                if name == 'aggregate':
+                    # $match and $sort leading the pipeline use indexes as a query
+                    stages = spec or [{}, {}]
+                    spec = stages[0].get('$match')
+                    if spec is not None and len(stages) > 1 and '$sort' in stages[1]:
+                        sort = list(stages[1]['$sort'].items())
+                return ProfiledCursor(attr(*args, **kwargs), self.collection, name, spec, sort)
+            return cursor
+        return attr
+
+    def _timed(self, name, method):
+        async def call(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _record(self.collection, name, _spec(args, kwargs) if name != 'insert' else None,
+                        time.monotonic() - started,
+                        _sort_keys(kwargs['sort']) if kwargs.get('sort') else None)
+
+        def wrapper(*args, **kwargs):
+            # futures, as motor's: callers add callbacks to them
+            return gen.convert_yielded(call(*args, **kwargs))
+        return wrapper
+
+
+def _spec(args, kwargs):
+    """ query of a collection method call """
+    if args:
+        return args[0]
+    for name in ('spec', 'query', 'filter', 'pipeline'):
+        if name in kwargs:
+            return kwargs[name]
+    return None
+
+
+def _sort_keys(key_or_list, direction=None):
+    """ [(field, direction)] of cursor.sort() arguments """
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    return [tuple(item) for item in key_or_list]
+
+
+def _stages(plan):
+    """ stage names of an explained plan tree """
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        # mongo < 3.0
+        if plan.get('cursor') == 'BasicCursor':
+            stages.append('COLLSCAN')
+        if plan.get('scanAndOrder'):
+            stages.append('SORT')
+        for value in plan.values():
+            stages += _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += _stages(value)
+    return stages
+
+
+def suggest_index(spec, sort=None):
+    """
+    index keys serving a query: equality fields, then sort, then ranges
+    """
+    spec = spec or {}
+    fields = {}
+    for item in spec.get('$and', []) + [spec]:
+        fields.update({key: value for key, value in item.items() if not key.startswith('$')})
+
+    def is_range(value):
+        return isinstance(value, dict) and any(key.startswith('$') for key in value)
+
+    keys = [(field, 1) for field, value in fields.items() if not is_range(value)]
+    keys += [(field, direction) for field, direction in sort or ()
+             if field not in dict(keys)]
+    keys += [(field, 1) for field, value in fields.items()
+             if is_range(value) and field not in dict(keys)]
+    return keys
+
+
+async def check_plans():
+    """
+    explains queries captured since the last call, once per shape.
+    returns problems: [{collection, operation, shape, sort, stages, index}]
+    for queries which scan a collection or sort in memory
+    """
+    problems = []
+    captured = list(_captured.items())
+    _captured.clear()
+    for key, (collection, spec, sort) in captured:
+        _explained.add(key)
+        cursor = collection.find(spec)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = await cursor.explain()
+        plan = plan.get('queryPlanner', {}).get('winningPlan', plan)
+        bad = sorted(set(_stages(plan)) & set(BAD_STAGES))
+        if bad:
+            problems.append({
+                'collection': key[0],
+                'operation': key[1],
+                'shape': key[2],
+                'sort': sort,
+                'stages': bad,
+                'index': suggest_index(spec, sort)
+            })
+    return problems
+
+
+def plans_report(problems):
+    """ problems of check_plans() as text """
+    return '\n'.join('%s.%s %s sort %s: %s, index %s would serve it' % (
+        problem['collection'], problem['operation'], problem['shape'], problem['sort'],
+        '+'.join(problem['stages']), problem['index']) for problem in problems)
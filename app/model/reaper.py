@@ -0,0 +1,110 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+Deletes ended auth documents
+"""
+
+from datetime import datetime
+from logging import getLogger
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from app.model import model
+
+logger = getLogger()
+
+REAP_INTERVAL_SECONDS = 3600
+REAP_BATCH_SIZE = 1000
+REAP_BATCH_DELAY_SECONDS = 0.1
+REAP_MAX_BATCHES = 100
+
+ttl_index = False
+stats = {
+    'runs': 0,
+    'reclaimed': 0,
+    'last_reclaimed': 0,
+    'last_run': None
+}
+
+_callback = None
+_running = False
+
+
+async def check_ttl_index():
+    """
+    whether mongo deletes ended auths itself by TTL index on auths.end_date
+    (declared in model.INDEXES). the index also serves reap() queries
+    """
+    global ttl_index
+    missing = await model.missing_indexes()
+    ttl_index = not any(collection == 'auths' and spec['options'].get('expireAfterSeconds')
+                        is not None for collection, spec in missing)
+    if not ttl_index:
+        logger.warning('reaper: no TTL index on auths.end_date')
+    return ttl_index
+
+
+async def reap():
+    """
+    deletes auths past end_date in throttled batches, unless mongo does
+    it by TTL index. returns number of deleted documents
+    """
+    global _running
+    if _running or ttl_index:
+        return 0
+    _running = True
+    try:
+        now = datetime.utcnow()
+        reclaimed = 0
+        for _ in range(REAP_MAX_BATCHES):
+            cursor = model.db.auths.find({'end_date': {'$lt': now}}, {'_id': 1})
+            ids = [doc['_id'] for doc in
+                   await cursor.limit(REAP_BATCH_SIZE).to_list(REAP_BATCH_SIZE)]
+            if not ids:
+                break
+            result = await model.db.auths.remove({'_id': {'$in': ids}})
+            reclaimed += result['n']
+            if len(ids) < REAP_BATCH_SIZE:
+                break
+            await gen.sleep(REAP_BATCH_DELAY_SECONDS)
+    finally:
+        _running = False
+
+    stats['runs'] += 1
+    stats['reclaimed'] += reclaimed
+    stats['last_reclaimed'] = reclaimed
+    stats['last_run'] = now
+    logger.info('reaper: reclaimed %d auths (ttl index: %s)', reclaimed, ttl_index)
+    return reclaimed
+
+
+def start(interval=REAP_INTERVAL_SECONDS):
+    """
+    schedules reaper on current IOLoop
+    """
+    global _callback
+    logger.debug('start reaper, interval: %ds', interval)
+
+    io_loop = IOLoop.current()
+    io_loop.spawn_callback(check_ttl_index)
+
+    _callback = PeriodicCallback(lambda: io_loop.spawn_callback(reap), interval * 1000)
+    _callback.start()
+
+
+def stop():
+    """
+    stops scheduled reaper
+    """
+    global _callback
+    if _callback:
+        _callback.stop()
+        _callback = None
+
+
+if __name__ == "__main__":
+    # one-shot run as a separate process: python -m app.model.reaper <db_name>
+    import sys
+
+    model.init(sys.argv[1] if len(sys.argv) > 1 else 'tornado-test-dev')
+    IOLoop.current().run_sync(reap)
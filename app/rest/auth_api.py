@@ -3,16 +3,58 @@ Token Authorization APIs
 """
 
 from datetime import datetime, timedelta
-from bson.objectid import ObjectId
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 from app.model.model import db
-from app.rest.rest import Handler
-from app.rest.tools import auth_required, jsonify, password_hash, gen_token
+from app.rest.rest import Handler, ErrorResponse, parse_id
+from app.rest.tools import auth_required, gen_token, issued_token
+from app.rest.tools import auth_expire_date, revoke_token, user_token_epoch
 
-# TODO: scheduler (new process) deletes ended tokens
 TOKEN_ENDS_IN_SECONDS = 7776000   # 3 months
 TOKEN_EXPIRES_IN_SECONDS = 86400  # 1 day
 
+_AUTH_FIELDS = {
+    'user_id': 1,
+    'consumer_id': 1,
+    'access_token': 1,
+    'expire_date': 1,
+    'end_date': 1,
+    'token_epoch': 1
+}
+
+
+def _epoch_spec(token_epoch):
+    # auths issued before token epochs have no token_epoch, they are in epoch 0
+    return token_epoch if token_epoch else {'$in': [0, None]}
+
+
+async def _refresh_token_user(refresh_token):
+    """
+    user id of refresh token. refresh tokens start with it, older ones
+    don't and are looked up
+    """
+    user_id, _, token = refresh_token.partition('.')
+    if token and ObjectId.is_valid(user_id):
+        return ObjectId(user_id)
+    auth = await db.auths.find_one({'refresh_token': refresh_token}, {'user_id': 1})
+    return auth and auth['user_id']
+
+
+async def _issue_auth(consumer_id, user_id, token_epoch):
+    """ returns auth of consumer and user, creates new one if missing """
+    now = datetime.utcnow()
+    # the $set backfills token_epoch of auths issued before token epochs
+    return await db.auths.find_and_modify(
+        {'consumer_id': consumer_id, 'user_id': user_id, 'token_epoch': _epoch_spec(token_epoch)},
+        {'$set': {'token_epoch': token_epoch}, '$setOnInsert': {
+            'access_token': gen_token(),
+            'refresh_token': '%s.%s' % (user_id, gen_token(2)),
+            'expire_date': now + timedelta(seconds=TOKEN_EXPIRES_IN_SECONDS),
+            'end_date': now + timedelta(seconds=TOKEN_ENDS_IN_SECONDS)
+        }},
+        upsert=True, new=True)
+
 
 class AuthAPI(Handler):
     # pylint: disable=locally-disabled, abstract-method
@@ -20,72 +62,95 @@ class AuthAPI(Handler):
     APIs /auth
     """
     @auth_required(barier=False, secret=True)
-    async def get(self, user_id, _consumer_id=None):
+    async def get(self, user_id=None, _consumer_id=None):
         # pylint: disable=locally-disabled, arguments-differ
         """
-        GET /auth
+        GET /auth/<user_id>
         """
-        user_id = ObjectId(user_id)
+        if not user_id:
+            raise ErrorResponse('Missing user id')
+        user_id = parse_id(user_id)
+        token_epoch = await user_token_epoch(user_id)
+        if token_epoch is None:
+            raise ErrorResponse('User not found', 404)
 
-        auth = await db.auths.find_one({'consumer_id': _consumer_id, 'user_id': user_id})
-        if not auth:
-            auth = {
-                'user_id': user_id,
-                'consumer_id': _consumer_id,
-                'access_token': gen_token(),
-                'refresh_token': gen_token(2),
-                'expire_date': datetime.utcnow() + timedelta(seconds=token_expires_in_seconds),
-                'end_date': datetime.utcnow() + timedelta(seconds=token_ends_in_seconds)
-            }
-            await db.auths.insert(auth)
-
-        expires_in = int((auth['expire_date'] - datetime.utcnow()).total_seconds())
-
-        self.write(jsonify({
-            'access_token': auth['access_token'],
+        # one atomic upsert. unique (consumer_id, user_id, token_epoch) index
+        # makes concurrent calls return the same token pair
+        try:
+            auth = await _issue_auth(_consumer_id, user_id, token_epoch)
+        except DuplicateKeyError:
+            auth = await _issue_auth(_consumer_id, user_id, token_epoch)
+
+        expires_in = int((auth_expire_date(auth) - datetime.utcnow()).total_seconds())
+
+        self.write_doc({
+            'access_token': issued_token(auth),
             'refresh_token': auth['refresh_token'],
             'expires_in': expires_in
-        }))
-
-    # # TODO: update 'expires_in'?
-    # # TODO: add basic authorization
-
-    # @staticmethod
-    # @call_in_transaction
-    # def put(_session=None):
-    #     """
-    #     PUT /auth
-    #     """
-    #     refresh_token = request.headers.get('refresh_token')
-    #     if not refresh_token:
-    #         return access_denied('No refresh token')
-
-    #     auth = _session.query(Auth).filter(Auth.refresh_token == refresh_token).first()
-    #     if not auth:
-    #         return access_denied('Invalid refresh token')
-    #     if datetime.utcnow() < auth.expire_date:
-    #         return bad_request('Token is valid. No need to refresh')
-
-    #     auth.access_token = gen_token()
-    #     auth.expire_date = datetime.utcnow() + timedelta(seconds=TOKEN_EXPIRES_IN_SECONDS)
-    #     if auth.expire_date > auth.end_date:
-    #         auth.expire_date = auth.end_date
-    #     auth.expires_in = int((auth.expire_date - datetime.utcnow()).total_seconds())
-
-    #     return jsonify({
-    #         'access_token': auth.access_token,
-    #         'expires_in': auth.expires_in
-    #     })
-
-    # # TODO: add basic authorization
-    # @staticmethod
-    # @call_in_transaction
-    # def delete(_session=None):
-    #     """ DELETE /auth -H 'refresh_token' """
-    #     refresh_token = request.headers.get('refresh_token')
-    #     if not refresh_token:
-    #         return access_denied('No refresh token')
-
-    #     if _session.query(Auth).filter(Auth.refresh_token == refresh_token).delete() == 0:
-    #         return access_denied('Invalid refresh token')
-    #     return jsonify('OK')
+        })
+
+    async def put(self, _user_id=None):
+        # pylint: disable=locally-disabled, arguments-differ
+        """
+        PUT /auth -H 'refresh_token'
+        """
+        refresh_token = self.request.headers.get('refresh_token')
+        if not refresh_token:
+            raise ErrorResponse('No refresh token', 401)
+
+        # the epoch is checked before, a refresh is one atomic update of an auth
+        # of the current epoch. expire_date may pass end_date here,
+        # auth_expire_date() caps it. the old token has expired,
+        # so there is nothing to revoke
+        now = datetime.utcnow()
+        user_id = await _refresh_token_user(refresh_token)
+        token_epoch = user_id and await user_token_epoch(user_id)
+        if token_epoch is None:
+            raise ErrorResponse('Invalid refresh token', 401)
+
+        access_token = gen_token()
+        expire_date = now + timedelta(seconds=TOKEN_EXPIRES_IN_SECONDS)
+        auth = await db.auths.find_and_modify(
+            {
+                'refresh_token': refresh_token,
+                'user_id': user_id,
+                'token_epoch': _epoch_spec(token_epoch),
+                'expire_date': {'$lt': now},
+                'end_date': {'$gt': now}
+            },
+            {'$set': {'access_token': access_token, 'expire_date': expire_date}},
+            fields=_AUTH_FIELDS)
+        if not auth:
+            # failed refreshes only, to tell why
+            auth = await db.auths.find_one({'refresh_token': refresh_token, 'user_id': user_id},
+                                           {'end_date': 1, 'token_epoch': 1})
+            if not auth or auth.get('token_epoch', 0) != token_epoch:
+                # all tokens of the user were revoked. the auth is dead anyway
+                raise ErrorResponse('Invalid refresh token', 401)
+            if auth['end_date'] <= now:
+                raise ErrorResponse('Refresh token ended', 401)
+            raise ErrorResponse('Token is valid. No need to refresh')
+
+        auth.update({'access_token': access_token, 'expire_date': expire_date})
+
+        self.write_doc({
+            'access_token': issued_token(auth),
+            'expires_in': int((auth_expire_date(auth) - now).total_seconds())
+        })
+
+    async def delete(self, _user_id=None):
+        # pylint: disable=locally-disabled, arguments-differ
+        """
+        DELETE /auth -H 'refresh_token'
+        """
+        refresh_token = self.request.headers.get('refresh_token')
+        if not refresh_token:
+            raise ErrorResponse('No refresh token', 401)
+
+        auth = await db.auths.find_and_modify({'refresh_token': refresh_token},
+                                              remove=True, fields=_AUTH_FIELDS)
+        if not auth:
+            raise ErrorResponse('Invalid refresh token', 401)
+
+        await revoke_token(auth)
+        self.write_doc('OK')
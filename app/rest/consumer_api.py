@@ -0,0 +1,23 @@
+"""
+Consumer APIs
+"""
+from app.model.model import db
+from app.rest.rest import Handler
+from app.rest.tools import auth_required
+
+
+class ConsumerAPI(Handler):
+    # pylint: disable=locally-disabled, abstract-method
+    """
+    Manages "/consumers"
+    """
+    FIELDS = ('id', 'name')
+    DEFAULT_FIELDS = ('id', 'name')
+
+    @auth_required(basic=True)
+    async def get(self, _user_id=None):
+        # pylint: disable=locally-disabled, arguments-differ
+        """
+        GET /consumers?limit=&cursor=&fields=
+        """
+        await self.write_page(db.consumers, {'user_id': _user_id}, self.projection())
@@ -0,0 +1,121 @@
+"""
+Phrasebook APIs
+"""
+from app.model.model import db, find_one
+from app.rest.rest import Handler, ErrorResponse, parse_id
+from app.rest.tools import auth_required, jsonify, stream_ndjson
+from app.rest.serializers import serialize, serialize_cursor
+
+PHRASE_FIELDS = ('text1', 'text2', 'lang1', 'lang2')
+
+
+async def user_phrasebook(phrasebook_id, user_id, fields=None):
+    """ phrasebook of the user, 404 if there's no such """
+    phrasebook = await find_one(db.phrasebooks, {'_id': phrasebook_id, 'user_id': user_id},
+                                fields or {'_id': 1})
+    if not phrasebook:
+        raise ErrorResponse('Phrasebook not found', 404)
+    return phrasebook
+
+
+def export_pipeline(phrasebook_id):
+    """
+    phrases of a phrasebook in order of links by one aggregation.
+    $match and $sort lead, so the (phrasebook_id, _id) index drives it
+    """
+    project = {'_id': '$phrase._id'}
+    project.update({field: '$phrase.' + field for field in PHRASE_FIELDS})
+    return [
+        {'$match': {'phrasebook_id': phrasebook_id}},
+        {'$sort': {'_id': 1}},
+        {'$lookup': {
+            'from': 'phrases',
+            'localField': 'phrase_id',
+            'foreignField': '_id',
+            'as': 'phrase'
+        }},
+        {'$unwind': '$phrase'},
+        {'$project': project}
+    ]
+
+
+class PhrasebookAPI(Handler):
+    # pylint: disable=locally-disabled, abstract-method
+    """
+    Manages "/phrasebook"
+    """
+    FIELDS = ('id', 'name')
+    DEFAULT_FIELDS = ('id', 'name')
+
+    @auth_required
+    async def get(self, phrasebook_id=None, _user_id=None):
+        # pylint: disable=locally-disabled, arguments-differ
+        """
+        GET /phrasebook?limit=&cursor=&fields=
+        GET /phrasebook/<id>?fields=
+        """
+        if phrasebook_id is None:
+            return await self.write_page(db.phrasebooks, {'user_id': _user_id},
+                                         self.projection())
+
+        phrasebook_id = parse_id(phrasebook_id)
+        projection = self.projection('version')
+        if await self.check_not_modified(db.phrasebooks,
+                                         {'_id': phrasebook_id, 'user_id': _user_id}):
+            return
+        phrasebook = await user_phrasebook(phrasebook_id, _user_id, projection)
+        self.set_version_etag(phrasebook_id, phrasebook.pop('version', 0))
+        self.write_doc(serialize('phrasebooks', phrasebook))
+
+
+class PhrasebookPhrasesAPI(Handler):
+    # pylint: disable=locally-disabled, abstract-method
+    """
+    Manages "/phrasebook/<id>/phrases"
+    """
+    FIELDS = ('id',) + PHRASE_FIELDS
+    DEFAULT_FIELDS = FIELDS
+
+    @auth_required
+    async def get(self, phrasebook_id, _user_id=None):
+        # pylint: disable=locally-disabled, arguments-differ
+        """
+        GET /phrasebook/<id>/phrases?limit=&cursor=&fields=
+        pages of phrasebook-phrase links, in the order phrases were added
+        """
+        phrasebook_id = parse_id(phrasebook_id)
+        await user_phrasebook(phrasebook_id, _user_id)
+        await self.write_page(db.phrasebook_phrases, {'phrasebook_id': phrasebook_id},
+                              {'_id': 0, 'phrase_id': 1},
+                              scope='phrasebook_phrases:%s' % phrasebook_id,
+                              resolve=self.resolve_phrases)
+
+    async def resolve_phrases(self, links):
+        """ phrases of a page of links, by one batched query """
+        phrases = await self.loader(db.phrases, self.projection()).load_many(
+            [link['phrase_id'] for link in links])
+        return [serialize('phrases', phrase) for phrase in phrases if phrase]
+
+
+class PhrasebookExportAPI(Handler):
+    # pylint: disable=locally-disabled, abstract-method
+    """
+    Manages "/phrasebook/<id>/export"
+    """
+    @auth_required
+    async def get(self, phrasebook_id, _user_id=None):
+        # pylint: disable=locally-disabled, arguments-differ
+        """
+        GET /phrasebook/<id>/export
+        newline delimited json: the phrasebook, then its phrases.
+        streamed from one aggregation cursor, memory doesn't grow with the book
+        """
+        phrasebook_id = parse_id(phrasebook_id)
+        phrasebook = await user_phrasebook(phrasebook_id, _user_id, {'name': 1})
+
+        self.set_header('Content-Type', 'application/x-ndjson')
+        self.set_header('Content-Disposition',
+                        'attachment; filename="phrasebook-%s.ndjson"' % phrasebook_id)
+        self.write(jsonify(serialize('phrasebooks', phrasebook)) + '\n')
+        cursor = db.phrasebook_phrases.aggregate(export_pipeline(phrasebook_id))
+        await stream_ndjson(self, serialize_cursor('phrases', cursor))
@@ -2,14 +2,95 @@
 """ Main REST API module """
 
 import json
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
 from logging import getLogger
 
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from tornado.concurrent import Future, chain_future
+from tornado.ioloop import IOLoop
 from tornado.web import RequestHandler, Application, HTTPError
 
-from app.rest.tools import jsonify
+from app.model import profiler
+from app.model.loader import DataLoader
+from app.model.model import find_one, find_page
+from app.rest.tools import jsonify, msgpackify, decode_msgpack
+from app.rest.tools import iterate_docs, stream_json_list
+from app.rest.tools import sign_page_token, verify_page_token
+from app.rest.serializers import serialize
+from app.rest import tools
+
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_THREAD_MIN_BYTES = 256 * 1024
+COMPRESS_WORKERS = 2
+# (max IOLoop lag in seconds, gzip level). busier loop, cheaper level
+COMPRESS_LEVELS = ((0.01, 6), (0.05, 3))
+COMPRESS_BUSY_LEVEL = 1
+LAG_CHECK_SECONDS = 0.1
+
+# page size of listings, ?limit= can't exceed max
+PAGE_LIMIT = 50
+PAGE_MAX_LIMIT = 200
 
 logger = getLogger()
 
+loop_lag = 0.0
+# handler class name -> compression counters
+compression_stats = {}
+_compress_executor = None
+
+
+def start_lag_monitor(interval=LAG_CHECK_SECONDS):
+    """
+    measures how late IOLoop runs callbacks, smoothed into loop_lag
+    """
+    io_loop = IOLoop.current()
+
+    def check(expected):
+        global loop_lag
+        now = time.monotonic()
+        loop_lag = 0.8 * loop_lag + 0.2 * max(now - expected, 0.0)
+        io_loop.call_later(interval, check, now + interval)
+    io_loop.call_later(interval, check, time.monotonic() + interval)
+
+
+def compress_level():
+    """ gzip level for current IOLoop lag """
+    for max_lag, level in COMPRESS_LEVELS:
+        if loop_lag <= max_lag:
+            return level
+    return COMPRESS_BUSY_LEVEL
+
+
+def parse_quality(header):
+    """ [(value, q)] of an Accept-like header """
+    items = []
+    for item in header.split(','):
+        params = item.strip().split(';')
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        items.append((params[0].strip().lower(), quality))
+    return items
+
+
+def _gzip(data, level):
+    """ returns gzipped data and seconds spent """
+    started = time.monotonic()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    data = compressor.compress(data) + compressor.flush()
+    return data, time.monotonic() - started
+
 
 class ErrorResponse(HTTPError):
     """ represents not OK response """
@@ -19,22 +100,292 @@ class ErrorResponse(HTTPError):
         self.error_code = error_code
 
 
+def parse_id(value):
+    """ ObjectId of an url part """
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ErrorResponse('Bad id')
+
+
 class Handler(RequestHandler):
     # pylint: disable=locally-disabled, abstract-method
     """ Base API Handler """
+    # fields a client may select with ?fields=a,b and fields returned without it.
+    # 'id' stands for '_id'
+    FIELDS = ()
+    DEFAULT_FIELDS = ()
+
+    _msgpack = None
+    _fields = None  # selected fields, part of version etag
+    _queries = None  # query counters of the request, see profiler
+    _loaders = None
+    _gzip = None  # compressor of a streamed response
+    _compressing = None  # future of finish() while the body is compressed on a thread
+
+    def prepare(self):
+        self._queries = profiler.start_request(type(self).__name__)
+
+    def on_finish(self):
+        profiler.finish_request(self._queries)
+
+    def _accepts_gzip(self):
+        if 'Content-Encoding' in self._headers or self._status_code in (204, 304):
+            return False
+        # gzip;q=0 refuses it, * stands for encodings not listed
+        qualities = dict(reversed(parse_quality(self.request.headers.get('Accept-Encoding', ''))))
+        return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+    def _record_compression(self, bytes_in, bytes_out, seconds, response=True):
+        stats = compression_stats.setdefault(type(self).__name__, {
+            'responses': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+            'seconds': 0.0
+        })
+        stats['responses'] += int(response)
+        stats['bytes_in'] += bytes_in
+        stats['bytes_out'] += bytes_out
+        stats['seconds'] += seconds
+
+    def _set_gzip_headers(self):
+        self.set_header('Content-Encoding', 'gzip')
+        self.add_header('Vary', 'Accept-Encoding')
+
+    def flush(self, include_footers=False):
+        # streamed responses: gzip every chunk if the first flushed one is big enough
+        if (self._gzip is None and not self._headers_written and not include_footers and
+                sum(map(len, self._write_buffer)) >= COMPRESS_MIN_BYTES and
+                self._accepts_gzip()):
+            self._gzip = zlib.compressobj(compress_level(), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._set_gzip_headers()
+            self.clear_header('Content-Length')
+            self._record_compression(0, 0, 0.0)
+        if self._gzip is not None:
+            started = time.monotonic()
+            data = b''.join(self._write_buffer)
+            chunk = self._gzip.compress(data) + self._gzip.flush(
+                zlib.Z_FINISH if include_footers else zlib.Z_SYNC_FLUSH)
+            self._write_buffer = [chunk]
+            self._record_compression(len(data), len(chunk), time.monotonic() - started, False)
+        return super().flush(include_footers)
+
+    def finish(self, chunk=None):
+        if self._compressing is not None:
+            return self._compressing
+        if chunk is not None:
+            self.write(chunk)
+        if self._headers_written or not self._accepts_gzip():
+            return super().finish()
+
+        body = b''.join(self._write_buffer)
+        if len(body) < COMPRESS_MIN_BYTES:
+            return super().finish()
+
+        # etag of uncompressed body, it must not depend on gzip level
+        if (self._status_code == 200 and self.request.method in ('GET', 'HEAD') and
+                'Etag' not in self._headers):
+            self.set_etag_header()
+            if self.check_etag_header():
+                self._write_buffer = []
+                self.set_status(304)
+                return super().finish()
+
+        level = compress_level()
+        if len(body) < COMPRESS_THREAD_MIN_BYTES:
+            return self._finish_gzipped(len(body), *_gzip(body, level))
+
+        global _compress_executor
+        if _compress_executor is None:
+            _compress_executor = ThreadPoolExecutor(COMPRESS_WORKERS)
+        finished = self._compressing = Future()
+
+        def done(future):
+            self._compressing = None
+            try:
+                data, seconds = future.result()
+            except Exception:  # pylint: disable=locally-disabled, broad-except
+                logger.exception('compression failed, %s is sent uncompressed', self.request.uri)
+                chain_future(RequestHandler.finish(self), finished)
+            else:
+                chain_future(self._finish_gzipped(len(body), data, seconds), finished)
+        IOLoop.current().add_future(_compress_executor.submit(_gzip, body, level), done)
+        return finished
+
+    def _finish_gzipped(self, bytes_in, data, seconds):
+        self._record_compression(bytes_in, len(data), seconds)
+        self._write_buffer = [data]
+        self._set_gzip_headers()
+        return super().finish()
+
+    def accepts_msgpack(self):
+        """ True if client prefers msgpack to json (Accept header) """
+        if self._msgpack is None:
+            self._msgpack = False
+            if tools.msgpack:
+                best = 0.0
+                for content_type, quality in parse_quality(self.request.headers.get('Accept', '')):
+                    if quality > best:
+                        best, self._msgpack = quality, content_type in MSGPACK_CONTENT_TYPES
+        return self._msgpack
+
+    def write_doc(self, doc):
+        """ writes document as msgpack or json, by Accept header """
+        if tools.msgpack:
+            self.add_header('Vary', 'Accept')
+        if self.accepts_msgpack():
+            self.set_header('Content-Type', MSGPACK_CONTENT_TYPES[0])
+            self.write(msgpackify(doc))
+        else:
+            self.write(jsonify(doc))
+
+    async def write_docs(self, docs):
+        """
+        writes documents (a cursor or a list) as msgpack or json array.
+        json is streamed, msgpack needs the array length and is buffered
+        """
+        if tools.msgpack:
+            self.add_header('Vary', 'Accept')
+        if self.accepts_msgpack():
+            self.set_header('Content-Type', MSGPACK_CONTENT_TYPES[0])
+            self.write(msgpackify([doc async for doc in iterate_docs(docs)]))
+        else:
+            await stream_json_list(self, docs, tools.JSON_FLUSH_BYTES)
+
+    def selected_fields(self):
+        """
+        fields selected by ?fields= argument, validated against FIELDS.
+        DEFAULT_FIELDS without the argument
+        """
+        if self._fields is None:
+            fields = self.get_argument('fields', None)
+            if fields is None:
+                fields = self.DEFAULT_FIELDS
+            else:
+                fields = [field.strip() for field in fields.split(',') if field.strip()]
+                if not fields:
+                    raise ErrorResponse('No fields selected')
+                unknown = [field for field in fields if field not in self.FIELDS]
+                if unknown:
+                    raise ErrorResponse('Unknown fields: %s' % ', '.join(unknown))
+            self._fields = tuple(sorted(set(fields)))
+        return self._fields
+
+    def projection(self, *extra):
+        """
+        mongo projection of selected fields plus extra (not returned) fields,
+        so documents are read with only what the response needs
+        """
+        projection = {'_id': 0}
+        for field in self.selected_fields() + extra:
+            projection['_id' if field == 'id' else field] = 1
+        return projection
+
+    def set_version_etag(self, doc_id, version):
+        """ sets ETag of a versioned document """
+        etag = '%s.%s.%s' % (doc_id, version, 'msgpack' if self.accepts_msgpack() else 'json')
+        if self.FIELDS:
+            etag += '.' + ','.join(self.selected_fields())
+        self.set_header('Etag', '"%s"' % etag)
+
+    async def check_not_modified(self, collection, spec):
+        """
+        responds 304 if If-None-Match has current version of the document found by spec.
+        spec must carry the access check too, e.g. owner.
+        costs one projection-only query, nothing without If-None-Match.
+        returns True if the response is done
+        """
+        if not self.request.headers.get('If-None-Match'):
+            return False
+        doc = await find_one(collection, spec, {'version': 1})
+        if not doc:
+            return False
+        self.set_version_etag(doc['_id'], doc.get('version', 0))
+        if self.check_etag_header():
+            self.set_status(304)
+            return True
+        return False
+
+    def loader(self, collection, fields=None):
+        """
+        batching loader of documents by _id, shared by the whole request
+        """
+        if self._loaders is None:
+            self._loaders = {}
+        key = (collection.name, repr(fields))
+        if key not in self._loaders:
+            self._loaders[key] = DataLoader(collection, fields)
+        return self._loaders[key]
+
+    def page_limit(self):
+        """ page size by ?limit=, PAGE_LIMIT by default, capped by PAGE_MAX_LIMIT """
+        limit = self.get_argument('limit', None)
+        if limit is None:
+            return PAGE_LIMIT
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            raise ErrorResponse('Invalid limit')
+        return min(limit, PAGE_MAX_LIMIT)
+
+    async def write_page(self, collection, spec, fields=None, key='_id', scope=None,
+                         resolve=None):
+        """
+        writes a page of a listing: documents of spec in (key, _id) order.
+        X-Next-Cursor header has continuation token if there are more,
+        ?cursor= continues the listing and ?limit= sets page size.
+        each page is one range query of the index, page N costs as page 1.
+        resolve(docs) optionally maps the page to serialized documents
+        (e.g. links to linked documents), by default they are serialized
+        as documents of collection
+        """
+        scope = scope or '%s:%s' % (collection.name, key)
+        after = None
+        token = self.get_argument('cursor', None)
+        if token:
+            after = verify_page_token(token, scope)
+            if after is None:
+                raise ErrorResponse('Invalid cursor')
+        limit = self.page_limit()
+
+        # sort key and _id are needed for the cursor even if not selected
+        hidden = ()
+        if fields is not None:
+            hidden = tuple(field for field in sorted({key, '_id'}) if not fields.get(field))
+            fields = dict(fields, **{field: 1 for field in hidden})
+
+        docs = await find_page(collection, spec, fields, key, after, limit + 1).to_list(limit + 1)
+        if len(docs) > limit:
+            del docs[limit:]
+            last = docs[-1]
+            self.set_header('X-Next-Cursor', sign_page_token(
+                scope, [last['_id']] if key == '_id' else [last.get(key), last['_id']]))
+        for doc in docs:
+            for field in hidden:
+                doc.pop(field, None)
+
+        # the header is known (limit + 1 were read), so the page may be streamed
+        if resolve:
+            docs = await resolve(docs)
+        else:
+            docs = (serialize(collection.name, doc) for doc in docs)
+        await self.write_docs(docs)
+
     def error_response(self, message, status_code=400, error_code=-1):
-        """ writes errror response as json """
+        """ writes errror response as json or msgpack """
         self.set_header('Content-Type', 'text/json')
         self.set_status(status_code, message)
         if error_code != -1:
-            self.write(jsonify({
+            self.write_doc({
                 "message": message,
                 "error_code": error_code
-            }))
+            })
         else:
-            self.write(jsonify({
+            self.write_doc({
                 "message": message
-            }))
+            })
 
     def write_error(self, status_code, **kwargs):
         if "exc_info" in kwargs:
@@ -45,8 +396,18 @@ class Handler(RequestHandler):
                 self.error_response(str(ex), status_code, -1)
 
     def read_json(self):
-        """ reads json from request body """
-        return json.loads(self.request.body.decode('utf8'))
+        """
+        reads json (or msgpack, by Content-Type) from request body,
+        a malformed one is a bad request
+        """
+        content_type = self.request.headers.get('Content-Type', '').split(';')[0].strip()
+        try:
+            if content_type in MSGPACK_CONTENT_TYPES and tools.msgpack:
+                return decode_msgpack(self.request.body)
+            return json.loads(self.request.body.decode('utf8'))
+        except ValueError:
+            # decode errors of both are ValueErrors, e.g. JSONDecodeError, msgpack ExtraData
+            raise ErrorResponse('Invalid body')
 
 
 def init(app):
@@ -55,8 +416,19 @@ def init(app):
 
     from app.rest.user_api import UserAPI
     from app.rest.auth_api import AuthAPI
+    from app.rest.consumer_api import ConsumerAPI
+    from app.rest.phrasebook_api import PhrasebookAPI, PhrasebookPhrasesAPI
+    from app.rest.phrasebook_api import PhrasebookExportAPI
+
+    start_lag_monitor()
 
     app.add_handlers(r'.*', [
         (r'/users', UserAPI),
-        (r'/auth/([^/]+)', AuthAPI)
+        (r'/auth', AuthAPI),
+        (r'/auth/([^/]+)', AuthAPI),
+        (r'/consumers', ConsumerAPI),
+        (r'/phrasebook', PhrasebookAPI),
+        (r'/phrasebook/([^/]+)', PhrasebookAPI),
+        (r'/phrasebook/([^/]+)/phrases', PhrasebookPhrasesAPI),
+        (r'/phrasebook/([^/]+)/export', PhrasebookExportAPI)
     ])
@@ -0,0 +1,128 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+Per-collection document serializers.
+
+Each collection declares its output shape once:
+{field: OBJECT_ID | DATETIME | None | {nested shape} | [item kind]}
+and private fields to drop. register() compiles it into a converter which
+only touches the fields that need conversion. '_id' becomes 'id'.
+"""
+
+OBJECT_ID = 'object_id'
+DATETIME = 'datetime'
+
+SERIALIZERS = {}
+
+
+def _value_expression(kind, value, env):
+    """
+    returns python expression converting value of given kind, or None.
+    helper functions are put into env
+    """
+    if kind == OBJECT_ID:
+        return 'str(%s)' % value
+    if kind == DATETIME:
+        return '%s.isoformat()' % value
+    if isinstance(kind, dict):
+        name = '_shape%d' % len(env)
+        env[name] = compile_shape(kind)
+        return '%s(%s)' % (name, value)
+    if isinstance(kind, list):
+        item = _value_expression(kind[0], 'item', env)
+        return '[%s for item in %s]' % (item, value) if item else None
+    return None
+
+
+def compile_shape(shape, private=()):
+    """
+    compiles shape into a function which converts a document in place.
+    the function is generated source, so there is no per-field dispatch
+    """
+    env = {}
+    lines = ['def serialize(doc):']
+    for field in private:
+        lines.append('    doc.pop(%r, None)' % field)
+    for field, kind in shape.items():
+        expression = _value_expression(kind, 'value', env)
+        if expression and field != '_id':
+            lines.append('    value = doc.get(%r)' % field)
+            lines.append('    if value is not None:')
+            lines.append('        doc[%r] = %s' % (field, expression))
+    lines.append('    if "_id" in doc:')
+    expression = _value_expression(shape.get('_id'), 'doc.pop("_id")', env)
+    lines.append('        doc["id"] = %s' % (expression or 'doc.pop("_id")'))
+    lines.append('    return doc')
+
+    exec('\n'.join(lines), env)  # pylint: disable=locally-disabled, exec-used
+    return env['serialize']
+
+
+def register(collection, shape, private=()):
+    """ declares output shape of collection documents """
+    SERIALIZERS[collection] = compile_shape(shape, private)
+
+
+def serialize(collection, doc):
+    """ converts a document of collection to its output shape (in place) """
+    return SERIALIZERS[collection](doc)
+
+
+def serialize_cursor(collection, docs):
+    """ wraps an async iterable of documents, serializing each """
+    convert = SERIALIZERS[collection]
+
+    async def iterate():
+        async for doc in docs:
+            yield convert(doc)
+    return iterate()
+
+
+register('users', {
+    '_id': OBJECT_ID,
+    'email': None,
+    'name': None
+}, private=('password', 'token_epoch'))
+
+register('auths', {
+    '_id': OBJECT_ID,
+    'user_id': OBJECT_ID,
+    'consumer_id': OBJECT_ID,
+    'access_token': None,
+    'refresh_token': None,
+    'expire_date': DATETIME,
+    'end_date': DATETIME
+}, private=('token_epoch',))
+
+register('consumers', {
+    '_id': OBJECT_ID,
+    'user_id': OBJECT_ID,
+    'name': None,
+    'secret_code': None
+})
+
+register('phrases', {
+    '_id': OBJECT_ID,
+    'text1': None,
+    'text2': None,
+    'lang1': None,
+    'lang2': None
+})
+
+register('phrasebooks', {
+    '_id': OBJECT_ID,
+    'user_id': OBJECT_ID,
+    'name': None,
+    'phrases': [{
+        '_id': OBJECT_ID,
+        'text1': None,
+        'text2': None,
+        'lang1': None,
+        'lang2': None
+    }]
+})
+
+register('phrasebook_phrases', {
+    '_id': OBJECT_ID,
+    'phrasebook_id': OBJECT_ID,
+    'phrase_id': OBJECT_ID
+})
@@ -3,51 +3,425 @@
 Tools for REST package
 """
 
+import os
 import json
+import time
+import hmac
+import hashlib
 
-from hashlib import sha224
+from calendar import timegm
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha224, sha256
 from datetime import datetime
 from functools import wraps
 from uuid import uuid4
-from base64 import b64encode
+from base64 import b64encode, b64decode, urlsafe_b64encode, urlsafe_b64decode
 from logging import getLogger
 
+from bson import json_util
+from bson.errors import BSONError
 from bson.objectid import ObjectId
+from tornado.concurrent import Future, chain_future
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from app.model import model
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import ujson
+    ujson.dumps(None, default=str)
+except (ImportError, TypeError):
+    # missing or too old to take default=
+    ujson = None
 
 logger = getLogger()
 
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 60  # seconds
+CONSUMER_CACHE_SIZE = 1000
+CONSUMER_CACHE_TTL = 300  # seconds
+CONSUMER_CACHE_NEGATIVE_SIZE = 256
+CONSUMER_CACHE_NEGATIVE_TTL = 5  # seconds
+EPOCH_CACHE_SIZE = 10000
+EPOCH_CACHE_TTL = 60  # seconds
+DENYLIST_RELOAD_SECONDS = 60
+JSON_FLUSH_BYTES = 64 * 1024
+
+TOKEN_FORMAT_OPAQUE = 'opaque'
+TOKEN_FORMAT_SIGNED = 'signed'
+SIGNED_TOKEN_PREFIX = 's1.'
+PAGE_TOKEN_PREFIX = 'p1.'
+
+# access token settings. see init_tokens()
+token_format = TOKEN_FORMAT_OPAQUE
+token_keys = {}
+token_key_id = None
+accept_opaque_tokens = True
+
+# signs continuation tokens if no token keys are configured. see init_page_key()
+_page_key = None
+
+# revoked signed tokens: token_id -> expiration timestamp. persisted in
+# db.token_denylist, see start_token_denylist()
+token_denylist = {}
+_denylist_callback = None
+
+PASSWORD_KDF = 'pbkdf2_sha256'  # or 'scrypt'
+PASSWORD_PBKDF2_ITERATIONS = 100000
+PASSWORD_SCRYPT_N = 16384
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+PASSWORD_WORKERS = 4
+
+# password hashing runs on this pool, not on the IOLoop
+_password_executor = None
+password_stats = {
+    'pending': 0,
+    'max_pending': 0,
+    'calls': 0,
+    'seconds': 0.0
+}
+
+
+class LRUCache(object):
+    """
+    bounded in-process cache with LRU eviction and per entry TTL.
+    counts hits and misses to help sizing it.
+
+    generation is bumped by every invalidation. lookups read it before
+    querying and pass it to set(), so a value read before an invalidation
+    isn't cached after it
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """ returns cached value or None """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, deadline = entry
+        if time.monotonic() >= deadline:
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None, generation=None):
+        """
+        caches value for ttl (or default ttl) seconds.
+        skipped if invalidated since generation, as the value may be stale
+        """
+        if generation is not None and generation != self.generation:
+            return
+        if ttl is None:
+            ttl = self.ttl
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """ drops key if cached """
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """ drops all entries which predicate(key, value) is true for """
+        self.generation += 1
+        for key in [k for k, (v, _) in self._data.items() if predicate(k, v)]:
+            del self._data[key]
+
+    def clear(self):
+        """ drops all entries and resets counters """
+        self.generation += 1
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """ size and hit/miss counters """
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+# access_token -> (user_id, expire_date, token_epoch).
+# expire_date is checked on every hit, so a token is never accepted past it,
+# and expired tokens stay cached so that replays are rejected without mongo
+token_cache = LRUCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+# secret_code -> consumer_id
+consumer_cache = LRUCache(CONSUMER_CACHE_SIZE, CONSUMER_CACHE_TTL)
+
+# unknown secret codes, for a short time, so misconfigured clients don't
+# reach mongo. separate from consumer_cache: a flood of bogus codes only
+# evicts other bogus codes, never valid consumers
+consumer_negative_cache = LRUCache(CONSUMER_CACHE_NEGATIVE_SIZE, CONSUMER_CACHE_NEGATIVE_TTL)
+
+
+def invalidate_consumer(consumer_id, *secret_codes):
+    """
+    evicts cached secret codes of a consumer.
+    must be called when a consumer is deleted or its secret is rotated.
+    pass the new secret code(s) as well to drop their negative entries
+    """
+    for code in secret_codes:
+        model.publish('consumers', code)
+    model.publish('consumers', consumer_id)
+
+
+def _on_consumer_invalidated(key):
+    """ key is either a secret code or a consumer_id """
+    consumer_cache.invalidate_where(lambda code, value: key in (code, value))
+    consumer_negative_cache.invalidate(key)
+
+
+# user_id -> token epoch, False for unknown users.
+# tokens issued before the user's current epoch are invalid
+epoch_cache = LRUCache(EPOCH_CACHE_SIZE, EPOCH_CACHE_TTL)
+
+model.subscribe('auths', token_cache.invalidate)
+model.subscribe('consumers', _on_consumer_invalidated)
+model.subscribe('users', epoch_cache.invalidate)
+
+
+def _json_default(value):
+    """ encodes what json doesn't know """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('%r is not JSON serializable' % value)
+
+
+def _encode_orjson(doc, sort_keys):
+    return orjson.dumps(doc, default=_json_default,
+                        option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode('utf8')
+
+
+def _encode_ujson(doc, sort_keys):
+    return ujson.dumps(doc, default=_json_default, sort_keys=sort_keys, ensure_ascii=False)
+
+
+def _encode_json(doc, sort_keys):
+    return json.dumps(doc, default=_json_default, sort_keys=sort_keys)
+
+
+JSON_ENCODERS = {'json': _encode_json}
+if ujson:
+    JSON_ENCODERS['ujson'] = _encode_ujson
+if orjson:
+    JSON_ENCODERS['orjson'] = _encode_orjson
+
+# fastest installed encoder. see set_json_encoder()
+encode_json = JSON_ENCODERS.get('orjson') or JSON_ENCODERS.get('ujson') or _encode_json
+
+
+def set_json_encoder(name):
+    """ selects json encoder: 'orjson', 'ujson' or 'json' """
+    global encode_json
+    if name not in JSON_ENCODERS:
+        raise ValueError('JSON encoder %s is not available' % name)
+    encode_json = JSON_ENCODERS[name]
+
 
 def _prepare_doc(doc):
-    # pylint: disable=locally-disabled, unidiomatic-typecheck
-    """ prepares a doc to jsonify """
-    if '_id' in doc:
+    """ prepares a doc to jsonify. ObjectIds and datetimes are left to encoder """
+    if isinstance(doc, dict) and '_id' in doc:
         doc['id'] = doc.pop('_id')
-    for key, value in doc.items():
-        if type(value) == ObjectId:
-            doc[key] = str(value)
     return doc
 
 
-def jsonify(doc):
+def jsonify(doc, sort_keys=True):
     """ document to json. escapes '_id' """
-    doc = _prepare_doc(doc)
-    return json.dumps(doc, sort_keys=True)
+    return encode_json(_prepare_doc(doc), sort_keys)
 
 
-async def jsonify_list(docs):
+async def jsonify_list(docs, sort_keys=True):
     """ list of documents to json. escapes '_id' """
     data = []
     async for doc in docs:
-        doc = _prepare_doc(doc)
-        data.append(doc)
-    return json.dumps(data, sort_keys=True)
+        data.append(_prepare_doc(doc))
+    return encode_json(data, sort_keys)
+
+
+def msgpackify(doc):
+    """ document (or list of documents) to msgpack. escapes '_id' """
+    if isinstance(doc, list):
+        doc = [_prepare_doc(d) for d in doc]
+    return msgpack.packb(_prepare_doc(doc), default=_json_default, use_bin_type=True)
+
+
+def decode_msgpack(data):
+    """ msgpack to python objects, strings as str """
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except TypeError:
+        # msgpack < 0.5.2
+        return msgpack.unpackb(data, encoding='utf-8')
+
+
+async def iterate_docs(docs):
+    """ async iterator of a cursor or of an iterable """
+    if hasattr(docs, '__aiter__'):
+        async for doc in docs:
+            yield doc
+    else:
+        for doc in docs:
+            yield doc
+
+
+async def stream_json_list(handler, docs, flush_bytes=JSON_FLUSH_BYTES, sort_keys=True):
+    """
+    writes documents (a cursor or an iterable) to handler as json array while
+    they are drained. flushes every flush_bytes of output (never if None),
+    so memory stays flat
+    """
+    handler.write('[')
+    pending = 1
+    separator = ''
+    async for doc in iterate_docs(docs):
+        chunk = separator + encode_json(_prepare_doc(doc), sort_keys)
+        separator = ','
+        handler.write(chunk)
+        pending += len(chunk)
+        if flush_bytes and pending >= flush_bytes:
+            await handler.flush()
+            pending = 0
+    handler.write(']')
+
+
+async def stream_ndjson(handler, docs, flush_bytes=JSON_FLUSH_BYTES, sort_keys=True):
+    """
+    writes documents to handler as newline delimited json while the cursor
+    is drained. every flush is awaited, so a slow client holds the cursor
+    back instead of growing the buffer
+    """
+    pending = 0
+    async for doc in docs:
+        chunk = encode_json(_prepare_doc(doc), sort_keys) + '\n'
+        handler.write(chunk)
+        pending += len(chunk)
+        if pending >= flush_bytes:
+            await handler.flush()
+            pending = 0
+
+
+def _hash_password(password, kdf):
+    """ hashes password by given kdf. blocking """
+    salt = os.urandom(16)
+    if kdf == 'pbkdf2_sha256':
+        key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt,
+                                  PASSWORD_PBKDF2_ITERATIONS)
+        return 'pbkdf2_sha256$%d$%s$%s' % (PASSWORD_PBKDF2_ITERATIONS, salt.hex(), key.hex())
+    if kdf == 'scrypt':
+        key = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=PASSWORD_SCRYPT_N,
+                             r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P)
+        return 'scrypt$%d$%d$%d$%s$%s' % (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R,
+                                          PASSWORD_SCRYPT_P, salt.hex(), key.hex())
+    if kdf == 'sha224':
+        return sha224(password.encode('utf-8')).hexdigest()
+    raise ValueError('Unknown kdf %s' % kdf)
 
 
-def password_hash(password):
+def _check_password(password, hashed):
+    """ checks password against a hash of any supported kdf. blocking """
+    parts = hashed.split('$')
+    if len(parts) == 1:
+        key = sha224(password.encode('utf-8')).hexdigest()
+    elif parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+        key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'),
+                                  bytes.fromhex(parts[2]), int(parts[1])).hex()
+    elif parts[0] == 'scrypt' and len(parts) == 6:
+        key = hashlib.scrypt(password.encode('utf-8'), salt=bytes.fromhex(parts[4]),
+                             n=int(parts[1]), r=int(parts[2]), p=int(parts[3])).hex()
+    else:
+        return False
+    return hmac.compare_digest(key, parts[-1])
+
+
+async def _run_password_job(fun, *args):
+    """ runs fun on password executor, tracks queue depth """
+    global _password_executor
+    if _password_executor is None:
+        _password_executor = ThreadPoolExecutor(PASSWORD_WORKERS)
+
+    password_stats['calls'] += 1
+    password_stats['pending'] += 1
+    password_stats['max_pending'] = max(password_stats['max_pending'],
+                                        password_stats['pending'])
+    started = time.monotonic()
+    try:
+        future = Future()
+        chain_future(_password_executor.submit(fun, *args), future)
+        return await future
+    finally:
+        password_stats['pending'] -= 1
+        password_stats['seconds'] += time.monotonic() - started
+
+
+async def password_hash(password):
+    """
+    returns hash of given password by PASSWORD_KDF
+    """
+    return await _run_password_job(_hash_password, password, PASSWORD_KDF)
+
+
+async def verify_password(password, hashed):
+    """
+    returns True if password matches hashed.
+    legacy sha224 hashes are supported
+    """
+    return await _run_password_job(_check_password, password, hashed)
+
+
+def needs_rehash(hashed):
+    """
+    True if hash is not made by current PASSWORD_KDF (e.g. legacy sha224)
+    """
+    return not hashed.startswith(PASSWORD_KDF + '$')
+
+
+async def check_user_password(user, password):
     """
-    returns sha224 of given password
+    verifies password of a user document (with '_id' and 'password').
+    transparently rehashes legacy hashes on successful login
     """
-    return sha224(password.encode('utf-8')).hexdigest()
+    from app.model.model import db
+
+    if not await verify_password(password, user['password']):
+        return False
+    if needs_rehash(user['password']):
+        hashed = await password_hash(password)
+        await db.users.update({'_id': user['_id'], 'password': user['password']},
+                              model.versioned({'$set': {'password': hashed}}))
+        user['password'] = hashed
+    return True
 
 
 def gen_token(complexity=1):
@@ -60,6 +434,226 @@ def gen_token(complexity=1):
     return token
 
 
+def init_tokens(fmt=TOKEN_FORMAT_OPAQUE, keys=None, key_id=None, accept_opaque=True):
+    """
+    configures access token format.
+    keys is a dict of active HMAC keys {key_id: secret}, new tokens are signed
+    by key_id; other keys are only used to verify (key rotation).
+    accept_opaque keeps old opaque tokens valid during a transition window
+    """
+    global token_format, token_keys, token_key_id, accept_opaque_tokens
+
+    if fmt not in (TOKEN_FORMAT_OPAQUE, TOKEN_FORMAT_SIGNED):
+        raise ValueError('Unknown token format %s' % fmt)
+    keys = {str(k): v if isinstance(v, bytes) else v.encode('utf8')
+            for k, v in (keys or {}).items()}
+    if fmt == TOKEN_FORMAT_SIGNED and str(key_id) not in keys:
+        raise ValueError('Signing key %s is not in keys' % key_id)
+
+    token_format = fmt
+    token_keys = keys
+    token_key_id = str(key_id) if key_id is not None else None
+    accept_opaque_tokens = accept_opaque
+
+
+def init_page_key(key):
+    """
+    sets the key continuation tokens are signed by if there are no token keys.
+    it must be the same in all workers, or a cursor of one worker is rejected by another
+    """
+    global _page_key
+    _page_key = key if isinstance(key, bytes) or key is None else key.encode('utf8')
+
+
+def _b64(data):
+    return urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _unb64(data):
+    return urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _is_ascii(token):
+    """ tokens are ascii, anything else is a forgery and can't be signed """
+    try:
+        token.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _sign(key_id, payload):
+    return _b64(hmac.new(token_keys[key_id], (key_id + '.' + payload).encode('ascii'),
+                         sha256).digest())
+
+
+def sign_token(user_id, consumer_id, expire_date, token_id, token_epoch=0):
+    """
+    returns self-verifying token "s1.<key_id>.<payload>.<signature>".
+    signing is deterministic, so the same auth always gives the same token
+    """
+    payload = _b64(json.dumps({
+        'u': str(user_id),
+        'c': str(consumer_id),
+        'e': timegm(expire_date.utctimetuple()),
+        'j': token_id,
+        'g': token_epoch
+    }, sort_keys=True, separators=(',', ':')).encode('utf8'))
+    return SIGNED_TOKEN_PREFIX + token_key_id + '.' + payload + '.' + _sign(token_key_id, payload)
+
+
+def verify_signed_token(token):
+    """
+    returns claims of a signed token or None if it's malformed,
+    signed by unknown key or tampered. doesn't check expiration
+    """
+    if not _is_ascii(token):
+        return None
+    parts = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+    if len(parts) != 3 or parts[0] not in token_keys:
+        return None
+    key_id, payload, signature = parts
+    if not hmac.compare_digest(_sign(key_id, payload), signature):
+        return None
+    try:
+        return json.loads(_unb64(payload).decode('utf8'))
+    except ValueError:
+        return None
+
+
+def _page_token_key(key_id):
+    return token_keys.get(key_id) if key_id else _page_key
+
+
+def sign_page_token(scope, after):
+    """
+    returns opaque continuation token "p1.<key_id>.<payload>.<signature>"
+    of a listing. scope names the listing, after is (sort key, _id) values
+    of the last document of the page
+    """
+    key_id = token_key_id or ''
+    if not _page_token_key(key_id):
+        raise RuntimeError('continuation tokens need token keys or a page key, see init_page_key()')
+    payload = _b64(json_util.dumps({'s': scope, 'a': list(after)},
+                                   sort_keys=True, separators=(',', ':')).encode('utf8'))
+    signature = _b64(hmac.new(_page_token_key(key_id), (key_id + '.' + payload).encode('ascii'),
+                              sha256).digest())
+    return PAGE_TOKEN_PREFIX + key_id + '.' + payload + '.' + signature
+
+
+def verify_page_token(token, scope):
+    """
+    returns after values of a continuation token of given scope.
+    None if it's malformed, tampered or of another listing
+    """
+    if not token.startswith(PAGE_TOKEN_PREFIX) or not _is_ascii(token):
+        return None
+    parts = token[len(PAGE_TOKEN_PREFIX):].split('.')
+    if len(parts) != 3:
+        return None
+    key_id, payload, signature = parts
+    key = _page_token_key(key_id)
+    if not key or not hmac.compare_digest(_b64(hmac.new(
+            key, (key_id + '.' + payload).encode('ascii'), sha256).digest()), signature):
+        return None
+    try:
+        claims = json_util.loads(_unb64(payload).decode('utf8'))
+        if claims.get('s') != scope:
+            return None
+        return list(claims['a'])
+    except (ValueError, TypeError, KeyError, AttributeError, BSONError):
+        return None
+
+
+async def deny_token(token_id, expire_date):
+    """
+    revokes a signed token until its expiration. stored before it's
+    broadcast, so workers started later (or which missed the broadcast)
+    load it. mongo drops it after expire_date by TTL index
+    """
+    await model.db.token_denylist.update({'_id': token_id},
+                                         {'$set': {'expire_date': expire_date}}, upsert=True)
+    model.publish('token_denylist', [token_id, timegm(expire_date.utctimetuple())])
+
+
+def _prune_denylist():
+    now = time.time()
+    for token_id in [k for k, exp in token_denylist.items() if exp < now]:
+        del token_denylist[token_id]
+
+
+def _on_token_denied(key):
+    """ key is [token_id, expiration timestamp] """
+    _prune_denylist()
+    token_id, expires = key
+    token_denylist[token_id] = expires
+
+
+model.subscribe('token_denylist', _on_token_denied)
+
+
+async def load_token_denylist():
+    """ adds unexpired denials stored in db.token_denylist """
+    cursor = model.db.token_denylist.find({'expire_date': {'$gt': datetime.utcnow()}},
+                                          {'expire_date': 1})
+    async for doc in cursor:
+        token_denylist[doc['_id']] = timegm(doc['expire_date'].utctimetuple())
+    _prune_denylist()
+
+
+def start_token_denylist(interval=DENYLIST_RELOAD_SECONDS):
+    """
+    loads stored denials now and every interval seconds,
+    which catches up on broadcasts missed while the bus was down
+    """
+    global _denylist_callback
+    logger.debug('start token denylist, interval: %ds', interval)
+
+    io_loop = IOLoop.current()
+    io_loop.spawn_callback(load_token_denylist)
+    _denylist_callback = PeriodicCallback(lambda: io_loop.spawn_callback(load_token_denylist),
+                                          interval * 1000)
+    _denylist_callback.start()
+
+
+def stop_token_denylist():
+    """ stops reloading denials """
+    global _denylist_callback
+    if _denylist_callback:
+        _denylist_callback.stop()
+        _denylist_callback = None
+
+
+def auth_expire_date(auth):
+    """
+    when the access token of an auth expires. never later than its end_date
+    """
+    if 'end_date' in auth:
+        return min(auth['expire_date'], auth['end_date'])
+    return auth['expire_date']
+
+
+def issued_token(auth):
+    """
+    access token to hand out for an auth document.
+    in signed format auth['access_token'] is the token id
+    """
+    if token_format == TOKEN_FORMAT_SIGNED:
+        return sign_token(auth['user_id'], auth['consumer_id'], auth_expire_date(auth),
+                          auth['access_token'], auth.get('token_epoch', 0))
+    return auth['access_token']
+
+
+async def revoke_token(auth):
+    """
+    drops in-process state of the access token of an auth document
+    which was refreshed or deleted, denies its signed token
+    """
+    model.publish('auths', auth['access_token'])
+    if token_keys:
+        await deny_token(auth['access_token'], auth_expire_date(auth))
+
+
 def _get_auth_code(handler, method):
     from app.rest.rest import ErrorResponse
 
@@ -73,34 +667,122 @@ def _get_auth_code(handler, method):
     return creds[len(method) + 1:]
 
 
-def auth_required(function=None, *, barier=True, secret=False):
+async def user_token_epoch(user_id):
+    """
+    returns current token epoch of a user or None if there's no such user
+    """
+    from app.model.model import db, find_one
+
+    epoch = epoch_cache.get(user_id)
+    if epoch is None:
+        generation = epoch_cache.generation
+        user = await find_one(db.users, {'_id': user_id}, {'token_epoch': 1})
+        epoch = user.get('token_epoch', 0) if user else False
+        epoch_cache.set(user_id, epoch, generation=generation)
+    return None if epoch is False else epoch
+
+
+async def revoke_user_tokens(user_id, update=None):
+    """
+    invalidates all tokens of a user by one write, bumping the token epoch.
+    update is an optional update document to apply in the same write
+    """
+    from app.model.model import db
+
+    update = dict(update or {})
+    update['$inc'] = dict(update.get('$inc', {}), token_epoch=1)
+    await db.users.update({'_id': user_id}, model.versioned(update))
+    model.publish('users', user_id)
+
+
+async def _authorize_bearer(token):
+    """ returns user_id of a valid access token """
+    from app.model.model import db, find_one
+    from app.rest.rest import ErrorResponse
+
+    if token.startswith(SIGNED_TOKEN_PREFIX):
+        claims = verify_signed_token(token)
+        if not claims or claims['j'] in token_denylist:
+            raise ErrorResponse('Invalid token', 401)
+        if time.time() > claims['e']:
+            raise ErrorResponse('Token expired', 401)
+        user_id, token_epoch = ObjectId(claims['u']), claims.get('g', 0)
+    elif not accept_opaque_tokens:
+        raise ErrorResponse('Invalid token', 401)
+    else:
+        auth = token_cache.get(token)
+        if auth is None:
+            generation = token_cache.generation
+            doc = await find_one(db.auths, {'access_token': token},
+                                 {'user_id': 1, 'expire_date': 1, 'end_date': 1, 'token_epoch': 1})
+            if not doc:
+                raise ErrorResponse('Invalid token', 401)
+            auth = (doc['user_id'], auth_expire_date(doc), doc.get('token_epoch', 0))
+            token_cache.set(token, auth, generation=generation)
+        user_id, expire_date, token_epoch = auth
+        if datetime.utcnow() > expire_date:
+            raise ErrorResponse('Token expired', 401)
+
+    if await user_token_epoch(user_id) != token_epoch:
+        raise ErrorResponse('Invalid token', 401)
+    return user_id
+
+
+async def _authorize_secret(code):
+    """ returns consumer_id of a valid secret code """
+    from app.model.model import db, find_one
+    from app.rest.rest import ErrorResponse
+
+    consumer_id = consumer_cache.get(code)
+    if consumer_id is None and not consumer_negative_cache.get(code):
+        generations = consumer_cache.generation, consumer_negative_cache.generation
+        consumer = await find_one(db.consumers, {'secret_code': code}, {'_id': 1})
+        if consumer:
+            consumer_id = consumer['_id']
+            consumer_cache.set(code, consumer_id, generation=generations[0])
+        else:
+            consumer_negative_cache.set(code, True, generation=generations[1])
+
+    if not consumer_id:
+        raise ErrorResponse('Invalid secret code', 401)
+    return consumer_id
+
+
+async def _authorize_basic(creds):
+    """ returns user_id of valid base64 "email:password" credentials """
+    from app.model.model import db, find_one
+    from app.rest.rest import ErrorResponse
+
+    try:
+        email, _, password = b64decode(creds).decode('utf8').partition(':')
+    except ValueError:
+        raise ErrorResponse('Invalid credentials', 401)
+    user = await find_one(db.users, {'email': email}, {'password': 1})
+    if not user or not await check_user_password(user, password):
+        raise ErrorResponse('Invalid credentials', 401)
+    return user['_id']
+
+
+def auth_required(function=None, *, barier=True, secret=False, basic=False):
     """
-    decorator check barier auth and passes a "_user_id" through kwargs
+    decorator check barier auth and passes a "_user_id" through kwargs.
+    basic takes user's email and password instead of barier token
     """
     def decorator(fun):
         """ decorator """
         @wraps(fun)
         async def wrapper(self, *args, **kwargs):
             """ wrapper """
-            from app.model.model import db
-            from app.rest.rest import ErrorResponse
-
-            if barier:
+            if basic:
+                creds = _get_auth_code(self, 'Basic')
+                kwargs['_user_id'] = await _authorize_basic(creds)
+            elif barier:
                 token = _get_auth_code(self, 'Bearer')
-                auth = await db.auths.find_one({'access_token': token},
-                                               {'user_id': 1, 'expire_date': 1})
-                if not auth:
-                    raise ErrorResponse('Invalid token', 401)
-                if datetime.utcnow() > auth['expire_date']:
-                    raise ErrorResponse('Token expired', 401)
-                kwargs['_user_id'] = auth['user_id']
+                kwargs['_user_id'] = await _authorize_bearer(token)
 
             if secret:
                 code = _get_auth_code(self, 'Secret')
-                consumer = await db.consumers.find_one({'secret_code': code}, {'_id': 1})
-                if not consumer:
-                    raise ErrorResponse('Invalid secret code', 401)
-                kwargs['_consumer_id'] = consumer['_id']
+                kwargs['_consumer_id'] = await _authorize_secret(code)
 
             await fun(self, *args, **kwargs)
         return wrapper
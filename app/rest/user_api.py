@@ -3,9 +3,13 @@ User APIs
 """
 import re
 
-from app.model.model import db
+from pymongo.errors import DuplicateKeyError
+
+from app.model.model import db, find_one, versioned
 from app.rest.rest import Handler
-from app.rest.tools import auth_required, jsonify, password_hash
+from app.rest.tools import auth_required, password_hash, verify_password
+from app.rest.tools import revoke_user_tokens
+from app.rest.serializers import serialize
 
 
 class UserAPI(Handler):
@@ -13,16 +17,24 @@ class UserAPI(Handler):
     """
     Manages "/users"
     """
+    FIELDS = ('id', 'email', 'name')
+    DEFAULT_FIELDS = ('name',)
+
     @auth_required
     async def get(self, _user_id=None):
         # pylint: disable=locally-disabled, arguments-differ
         """
-        GET /users
+        GET /users?fields=id,email,name
         """
-        user = await db.users.find_one({'_id': _user_id}, {'_id': 0, 'name': 1})
+        projection = self.projection('version')
+        if await self.check_not_modified(db.users, {'_id': _user_id}):
+            return
+
+        user = await find_one(db.users, {'_id': _user_id}, projection)
         if not user:
             return self.error_response('User not found', 404)
-        self.write(jsonify(user))
+        self.set_version_etag(_user_id, user.pop('version', 0))
+        self.write_doc(serialize('users', user))
         self.finish()
 
     async def post(self):
@@ -49,62 +61,69 @@ class UserAPI(Handler):
         if name and len(name) > 120:
             return self.error_response('Too long name')
 
-        user_id = await db.users.insert({
-            'email': email,
-            'name': name,
-            'password': password_hash(password)
-        })
-        self.write(jsonify({'id': user_id}))
+        try:
+            user_id = await db.users.insert({
+                'email': email,
+                'name': name,
+                'password': await password_hash(password),
+                'version': 1
+            })
+        except DuplicateKeyError:
+            # registered by a concurrent request since the check
+            return self.error_response('Email %s already exists' % email, 400, 100)
+        self.write_doc({'id': user_id})
 
-    # @staticmethod
-    # @auth_required
-    # def put(_user_id=None):
-    #     """
-    #     PUT /user
-    #     """
-    #     data = request.get_json(silent=True)
-    #     if not data or not any(k in data for k in ('email', 'name', 'password')):
-    #         return self.error_response('Nothing to update')
-
-    #     session = Session()
-    #     try:
-    #         user = session.query(User).get(_user_id)
-    #         session.expunge(user)
-
-    #         email = data.get('email')
-    #         if email is not None:
-    #             if not re.match(r'[^@]+@[^@]+\.[^@]+', email):
-    #                 return self.error_response('Invalid email %s' % email)
-    #             if len(email) > 120:
-    #                 return self.error_response('Too long email')
-    #             user.email = email
-
-    #         name = data.get('name')
-    #         if name is not None:
-    #             if len(name) > 120:
-    #                 return self.error_response('Too long name')
-    #             user.name = name
-
-    #         password = data.get('password')
-    #         if password is not None:
-    #             if len(password) > 20:
-    #                 return self.error_response('Too long password')
-    #             old_password = data.get('old_password')
-    #             if old_password is None:
-    #                 return self.error_response('Missing required data(old_password)')
-    #             if user.password != password_hash(old_password):
-    #                 return access_denied('Invalid old password')
-    #             user.password = password_hash(password)
-
-    #             # delete all tokens
-    #             session.query(Auth).filter(Auth.user_id == _user_id).delete()
-
-    #         session.add(user)
-    #         session.commit()
-    #     finally:
-    #         session.close()
+    @auth_required
+    async def put(self, _user_id=None):
+        # pylint: disable=locally-disabled, arguments-differ
+        """
+        PUT /users
+        """
+        data = self.read_json()
+        if not data or not any(k in data for k in ('email', 'name', 'password')):
+            return self.error_response('Nothing to update')
 
-    #     return jsonify('OK')
+        update = {}
+
+        email = data.get('email')
+        if email is not None:
+            if not re.match(r'[^@]+@[^@]+\.[^@]+', email):
+                return self.error_response('Invalid email %s' % email)
+            if len(email) > 120:
+                return self.error_response('Too long email')
+            if await db.users.find_one({'email': email, '_id': {'$ne': _user_id}}, {'_id': 1}):
+                return self.error_response('Email %s already exists' % email, 400, 100)
+            update['email'] = email
+
+        name = data.get('name')
+        if name is not None:
+            if len(name) > 120:
+                return self.error_response('Too long name')
+            update['name'] = name
+
+        password = data.get('password')
+        if password is not None:
+            if len(password) > 20:
+                return self.error_response('Too long password')
+            old_password = data.get('old_password')
+            if old_password is None:
+                return self.error_response('Missing required data(old_password)')
+            user = await db.users.find_one({'_id': _user_id}, {'password': 1})
+            if not await verify_password(old_password, user['password']):
+                return self.error_response('Invalid old password', 401)
+            update['password'] = await password_hash(password)
+
+        try:
+            if password is not None:
+                # invalidates all tokens in the same write
+                await revoke_user_tokens(_user_id, {'$set': update})
+            else:
+                await db.users.update({'_id': _user_id}, versioned({'$set': update}))
+        except DuplicateKeyError:
+            # taken by a concurrent request since the check
+            return self.error_response('Email %s already exists' % email, 400, 100)
+
+        self.write_doc('OK')
 
     # @staticmethod
     # @auth_required
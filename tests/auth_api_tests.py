@@ -1,16 +1,17 @@
+# pylint: disable=locally-disabled, invalid-name
 """
 unit tests for auth_api.py
 """
 from logging import getLogger
 from datetime import datetime, timedelta
 
-from tests.main import UnitTest
-from tests.tools import create_test_auth
-from tests.tools import auth_headers
+from tornado.testing import gen_test
 
-from app.orm.models import Auth
+from tests.main import UnitTest
+from tests.tools import read_json, create_test_auth
 
-from flask import json
+from app.model import model
+from app.rest import tools
 
 logger = getLogger()
 
@@ -19,184 +20,241 @@ class AuthApiTests(UnitTest):
     """
     unit tests for AuthAPI
     """
-    def test_get(self):
+    @gen_test
+    async def test_get(self):
         """
-        GET /auth/<secret>
+        GET /auth/<user_id>
         """
         logger.debug('***** GET *****')
 
+        user, consumer, auth = await create_test_auth()
+        url = '/auth/' + str(user['id'])
+
         # no secret
         logger.debug('> no secret')
-        res = self.test_client.get('/auth')
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch(url)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 401)
-        self.assertEqual(data['message'], 'No secret')
-
-        # not authorized
-        logger.debug('> not authorized')
-        res = self.test_client.get('/auth', headers={'secret': '1'})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.code, 401)
         self.assertEqual(data['message'], 'Not authorized')
 
-        auth = create_test_auth()
-
-        # incorrect email
-        logger.debug('> incorrect email')
-        res = self.test_client.get(
-            '/auth',
-            headers={**auth_headers('brooth@gmail.co', '123'), **{'secret': '1'}})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 401)
-        self.assertEqual(data['message'], 'Invalid credentials')
-
-        # incorrect password
-        logger.debug('> incorrect password')
-        res = self.test_client.get(
-            '/auth',
-            headers={**auth_headers('brooth@gmail.co', '12'), **{'secret': '1'}})
-        data = json.loads(res.get_data(as_text=True))
+        # invalid secret
+        logger.debug('> invalid secret')
+        res = await self.fetch(url, headers={'Authorization': 'Secret 1'})
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 401)
-        self.assertEqual(data['message'], 'Invalid credentials')
-
-        # Invalid secret
-        logger.debug('> invalid secret')
+        self.assertEqual(res.code, 401)
+        self.assertEqual(data['message'], 'Invalid secret code')
 
-        res = self.test_client.get(
-            '/auth',
-            headers={**auth_headers('brooth@gmail.com', '123'), **{'secret': '1'}})
-        data = json.loads(res.get_data(as_text=True))
+        # malformed user id
+        logger.debug('> malformed user id')
+        headers = {'Authorization': 'Secret ' + consumer['secret_code']}
+        res = await self.fetch('/auth/1', headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 401)
-        self.assertEqual(data['message'], 'Invalid secret')
+        self.assertEqual(res.code, 400)
+        self.assertEqual(data['message'], 'Bad id')
 
         # returns same auth
         logger.debug('> returns same auth')
-
-        res = self.test_client.get(
-            '/auth',
-            headers={**auth_headers('brooth@gmail.com', '123'), **{'secret': auth[1].secret}})
-        data = json.loads(res.get_data(as_text=True))
+        headers = {'Authorization': 'Secret ' + consumer['secret_code']}
+        res = await self.fetch(url, headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
-        self.assertEqual(data['access_token'], auth[2].access_token)
-        self.assertEqual(data['refresh_token'], auth[2].refresh_token)
+        self.assertEqual(res.code, 200)
+        self.assertEqual(data['access_token'], auth['access_token'])
+        self.assertEqual(data['refresh_token'], auth['refresh_token'])
+
+        # the auth, issued before token epochs, is not duplicated but backfilled
+        auths = await model.db.auths.find({'consumer_id': consumer['id'],
+                                           'user_id': user['id']}).to_list(10)
+        self.assertEqual(len(auths), 1)
+        self.assertEqual(auths[0]['token_epoch'], 0)
 
         # returns new auth
         logger.debug('> returns new auth')
-        auth[3].delete(auth[2])
-        auth[3].commit()
+        await model.db.auths.remove({'_id': auth['id']})
 
-        res = self.test_client.get(
-            '/auth',
-            headers={**auth_headers('brooth@gmail.com', '123'), **{'secret': auth[1].secret}})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch(url, headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
-        self.assertNotEqual(data['access_token'], auth[2].access_token)
-        self.assertNotEqual(data['refresh_token'], auth[2].refresh_token)
+        self.assertEqual(res.code, 200)
+        self.assertNotEqual(data['access_token'], auth['access_token'])
+        self.assertNotEqual(data['refresh_token'], auth['refresh_token'])
 
-    def test_put(self):
+    @gen_test
+    async def test_put(self):
         """
-        PUT /auth/<refresh_token>
+        PUT /auth -H 'refresh_token'
         """
         logger.debug('***** PUT *****')
 
         # no refresh token
         logger.debug('> no refresh token')
-        res = self.test_client.put('/auth')
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/auth', method='PUT', body='')
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.code, 401)
         self.assertEqual(data['message'], 'No refresh token')
 
-        # Invalid refresh_token
-        logger.debug('> Invalid refresh_token')
-        res = self.test_client.put('/auth', headers={'refresh_token': '1'})
-        data = json.loads(res.get_data(as_text=True))
+        # invalid refresh token
+        logger.debug('> invalid refresh token')
+        res = await self.fetch('/auth', method='PUT', body='', headers={'refresh_token': '1'})
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.code, 401)
         self.assertEqual(data['message'], 'Invalid refresh token')
 
         # valid token
         logger.debug('> valid token')
-        _, _, auth, session = create_test_auth()
+        _, _, auth = await create_test_auth()
+        headers = {'refresh_token': auth['refresh_token']}
 
-        res = self.test_client.put('/auth', headers={'refresh_token': auth.refresh_token})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/auth', method='PUT', body='', headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.code, 400)
         self.assertEqual(data['message'], 'Token is valid. No need to refresh')
 
         # updates expired token
         logger.debug('> updates expired token')
-        auth.expire_date = datetime.utcnow() + timedelta(seconds=-10)
-        session.merge(auth)
-        session.commit()
+        await model.db.auths.update({'_id': auth['id']}, {'$set': {
+            'expire_date': datetime.utcnow() + timedelta(seconds=-10),
+            'end_date': datetime.utcnow() + timedelta(seconds=60)
+        }})
 
-        res = self.test_client.put('/auth', headers={'refresh_token': auth.refresh_token})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/auth', method='PUT', body='', headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.code, 200)
+        self.assertNotEqual(data['access_token'], auth['access_token'])
 
         # expire_date not later that end_date
         logger.debug('> expire_date not later that end_date')
+        self.assertLessEqual(int(data['expires_in']), 60)
 
-        auth.end_date = datetime.utcnow() + timedelta(seconds=60)
-        session.merge(auth)
-        session.commit()
-
-        res = self.test_client.put('/auth', headers={'refresh_token': auth.refresh_token})
-        data = json.loads(res.get_data(as_text=True))
+        # old token is invalid
+        logger.debug('> old token is invalid')
+        res = await self.fetch('/users', headers={
+            'Authorization': 'Bearer ' + auth['access_token']
+        })
+        self.assertEqual(res.code, 401)
+
+        # new token is valid
+        logger.debug('> new token is valid')
+        res = await self.fetch('/users', headers={
+            'Authorization': 'Bearer ' + data['access_token']
+        })
+        self.assertEqual(res.code, 200)
+
+    @gen_test
+    async def test_put_epoch(self):
+        """
+        PUT /auth checks the token epoch before the refresh, which is one write
+        """
+        logger.debug('***** PUT epoch *****')
+
+        user, consumer, auth = await create_test_auth()
+        await model.db.auths.remove({'_id': auth['id']})
+        res = await self.fetch('/auth/' + str(user['id']),
+                               headers={'Authorization': 'Secret ' + consumer['secret_code']})
+        auth = read_json(res)
+        self.assertTrue(auth['refresh_token'].startswith(str(user['id']) + '.'))
+        headers = {'refresh_token': auth['refresh_token']}
+        expire = {'$set': {'expire_date': datetime.utcnow() + timedelta(seconds=-10)}}
+
+        # refresh is one write, the expired token is neither broadcast nor denied
+        logger.debug('> refresh is one write')
+        await model.db.auths.update({'refresh_token': auth['refresh_token']}, expire)
+        ops = []
+        model.client.latency = lambda: ops.append(1) or 0
+        published = model.invalidation_stats['published']
+        try:
+            res = await self.fetch('/auth', method='PUT', body='', headers=headers)
+        finally:
+            model.client.latency = 0
+        self.assertEqual(res.code, 200)
+        self.assertEqual(len(ops), 1)
+        self.assertEqual(model.invalidation_stats['published'], published)
+
+        # revoked auth is not refreshed
+        logger.debug('> revoked auth is not refreshed')
+        await model.db.auths.update({'refresh_token': auth['refresh_token']}, expire)
+        doc = await model.db.auths.find_one({'refresh_token': auth['refresh_token']})
+        await tools.revoke_user_tokens(user['id'])
+
+        res = await self.fetch('/auth', method='PUT', body='', headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
-        self.assertLessEqual(int(data['expires_in']), 60)
-
-    def test_delete(self):
+        self.assertEqual(res.code, 401)
+        self.assertEqual(data['message'], 'Invalid refresh token')
+        rotated = await model.db.auths.find_one({'_id': doc['_id']})
+        self.assertEqual(rotated['access_token'], doc['access_token'])
+
+        # refresh token of another user
+        logger.debug('> refresh token of another user')
+        other_id = await model.db.users.insert({'email': 'other@gmail.com', 'token_epoch': 0})
+        forged = str(other_id) + auth['refresh_token'][len(str(user['id'])):]
+        res = await self.fetch('/auth', method='PUT', body='', headers={'refresh_token': forged})
+        self.assertEqual(res.code, 401)
+
+    @gen_test
+    async def test_delete(self):
         """
-        DELETE /auth/<refresh_token>
+        DELETE /auth -H 'refresh_token'
         """
         logger.debug('***** DELETE *****')
 
         # no refresh token
         logger.debug('> no refresh token')
-        res = self.test_client.delete('/auth')
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/auth', method='DELETE')
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.code, 401)
         self.assertEqual(data['message'], 'No refresh token')
 
-        # Invalid refresh_token
-        logger.debug('> Invalid refresh_token')
-        res = self.test_client.delete('/auth', headers={'refresh_token': '1'})
-        data = json.loads(res.get_data(as_text=True))
+        # invalid refresh token
+        logger.debug('> invalid refresh token')
+        res = await self.fetch('/auth', method='DELETE', headers={'refresh_token': '1'})
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
+        self.assertEqual(res.code, 401)
+        self.assertEqual(data['message'], 'Invalid refresh token')
+
         # deletes token
         logger.debug('> deletes token')
-        _, _, auth, session = create_test_auth()
+        _, _, auth = await create_test_auth()
+
+        # token is cached
+        res = await self.fetch('/users', headers={
+            'Authorization': 'Bearer ' + auth['access_token']
+        })
+        self.assertEqual(res.code, 200)
 
-        res = self.test_client.delete('/auth', headers={'refresh_token': auth.refresh_token})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/auth', method='DELETE',
+                               headers={'refresh_token': auth['refresh_token']})
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.code, 200)
         self.assertEqual(data, 'OK')
-        self.assertIsNone(session.query(Auth).get(auth.id))
+        self.assertIsNone(await model.db.auths.find_one({'_id': auth['id']}))
+
+        # revoked token is invalid
+        logger.debug('> revoked token is invalid')
+        res = await self.fetch('/users', headers={
+            'Authorization': 'Bearer ' + auth['access_token']
+        })
+        self.assertEqual(res.code, 401)
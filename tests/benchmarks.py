@@ -0,0 +1,201 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+Microbenchmarks
+
+python -m tests.benchmarks [name ...]
+"""
+import copy
+import timeit
+
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from tornado import gen
+
+from app.rest import tools
+from app.rest import serializers
+
+
+def sample_user():
+    """ users document """
+    return {
+        '_id': ObjectId(),
+        'email': 'brooth@gmail.com',
+        'name': 'test user',
+        'token_epoch': 0
+    }
+
+
+def sample_auth():
+    """ auths document """
+    return {
+        '_id': ObjectId(),
+        'user_id': ObjectId(),
+        'consumer_id': ObjectId(),
+        'access_token': tools.gen_token(),
+        'refresh_token': tools.gen_token(2),
+        'expire_date': datetime.utcnow() + timedelta(days=1),
+        'end_date': datetime.utcnow() + timedelta(days=90)
+    }
+
+
+def sample_phrasebook(phrases=50):
+    """ phrasebooks document with nested phrases """
+    return {
+        '_id': ObjectId(),
+        'user_id': ObjectId(),
+        'name': 'Test Phrasebook',
+        'phrases': [{
+            '_id': ObjectId(),
+            'text1': 'phrase %d' % i,
+            'text2': 'trans %d' % i,
+            'lang1': 'en',
+            'lang2': 'ru'
+        } for i in range(phrases)]
+    }
+
+
+def bench_encoders(number=2000):
+    """
+    compares json encoders on user, auth and phrasebook documents
+    """
+    docs = {
+        'user': sample_user(),
+        'auth': sample_auth(),
+        'phrasebook': sample_phrasebook()
+    }
+    print('%-12s %-8s %12s %12s' % ('doc', 'encoder', 'sorted us', 'unsorted us'))
+    for doc_name, doc in docs.items():
+        for name, encoder in sorted(tools.JSON_ENCODERS.items()):
+            results = []
+            for sort_keys in (True, False):
+                seconds = timeit.timeit(lambda: encoder(doc, sort_keys), number=number)
+                results.append(seconds / number * 1e6)
+            print('%-12s %-8s %12.2f %12.2f' % (doc_name, name, results[0], results[1]))
+
+
+def legacy_prepare_doc(doc):
+    """ _prepare_doc before the serializer registry """
+    if '_id' in doc:
+        doc['id'] = doc.pop('_id')
+    for key, value in doc.items():
+        if isinstance(value, ObjectId):
+            doc[key] = str(value)
+    return doc
+
+
+def bench_serializers(size=10000, rounds=5):
+    """
+    compiled per-collection serializers against legacy _prepare_doc
+    on lists of 10k documents: conversion only and conversion + json.
+    legacy output still needs the encoder's default hook for datetimes
+    and nested ObjectIds
+    """
+    samples = {
+        'users': sample_user,
+        'auths': sample_auth,
+        'phrasebooks': lambda: sample_phrasebook(5)
+    }
+
+    def measure(docs, convert, encode):
+        best = None
+        for _ in range(rounds):
+            batch = [copy.deepcopy(doc) for doc in docs]
+            if encode:
+                seconds = timeit.timeit(
+                    lambda: tools._encode_json([convert(doc) for doc in batch], False), number=1)
+            else:
+                seconds = timeit.timeit(lambda: [convert(doc) for doc in batch], number=1)
+            best = seconds if best is None else min(best, seconds)
+        return best * 1e3
+
+    print('%-12s %10s %10s %12s %12s' % (
+        'collection', 'legacy ms', 'compiled', 'legacy+json', 'compiled+json'))
+    for collection, sample in samples.items():
+        docs = [sample() for _ in range(size)]
+        compiled = serializers.SERIALIZERS[collection]
+        print('%-12s %10.2f %10.2f %12.2f %12.2f' % (
+            collection,
+            measure(docs, legacy_prepare_doc, False),
+            measure(docs, compiled, False),
+            measure(docs, legacy_prepare_doc, True),
+            measure(docs, compiled, True)))
+
+
+def bench_api(requests=500, concurrency=20, phrases=50):
+    """
+    GET /phrasebook/<id>/phrases under concurrent load on the in-memory
+    backend, no mongod needed. each database round trip waits for the
+    simulated latency (ms): 0 is local, then a remote database
+    """
+    import tornado.web
+
+    from tornado.httpclient import AsyncHTTPClient
+    from tornado.httpserver import HTTPServer
+    from tornado.ioloop import IOLoop
+    from tornado.testing import bind_unused_port
+
+    from app.model import model
+    from app.rest import rest
+    from tests.tools import create_test_auth
+
+    app = tornado.web.Application()
+    model.init('benchmarks', model.MEMORY_URI)
+    rest.init(app)
+    tools.init_page_key('benchmarks')
+    sock, port = bind_unused_port()
+    server = HTTPServer(app)
+    server.add_sockets([sock])
+
+    async def setup():
+        await model.ensure_indexes()
+        user, _, auth = await create_test_auth()
+        phrasebook_id = await model.db.phrasebooks.insert({'name': 'p', 'user_id': user['id']})
+        phrase_ids = await model.db.phrases.insert([{'text1': str(i), 'text2': str(i)}
+                                                    for i in range(phrases)])
+        await model.db.phrasebook_phrases.insert([{'phrasebook_id': phrasebook_id,
+                                                   'phrase_id': phrase_id}
+                                                  for phrase_id in phrase_ids])
+        return auth['access_token'], phrasebook_id
+
+    async def load(url, headers):
+        client = AsyncHTTPClient(max_clients=concurrency)
+        times = []
+
+        async def worker(count):
+            for _ in range(count):
+                started = timeit.default_timer()
+                await client.fetch(url, headers=headers)
+                times.append(timeit.default_timer() - started)
+
+        started = timeit.default_timer()
+        await gen.multi([worker(requests // concurrency) for _ in range(concurrency)])
+        return timeit.default_timer() - started, sorted(times)
+
+    token, phrasebook_id = IOLoop.current().run_sync(setup)
+    url = 'http://127.0.0.1:%d/phrasebook/%s/phrases?limit=%d' % (port, phrasebook_id, phrases)
+    headers = {'Authorization': 'Bearer ' + token}
+
+    print('%-12s %10s %10s %10s' % ('latency ms', 'req/s', 'p50 ms', 'p99 ms'))
+    for latency in (0, 1, 5):
+        model.client.latency = latency / 1000
+        seconds, times = IOLoop.current().run_sync(lambda: load(url, headers))
+        print('%-12s %10.0f %10.2f %10.2f' % (latency, len(times) / seconds,
+                                              times[len(times) // 2] * 1e3,
+                                              times[len(times) * 99 // 100] * 1e3))
+    server.stop()
+
+
+BENCHMARKS = {
+    'api': bench_api,
+    'encoders': bench_encoders,
+    'serializers': bench_serializers
+}
+
+
+if __name__ == '__main__':
+    import sys
+
+    for bench in sys.argv[1:] or sorted(BENCHMARKS):
+        print('*** %s ***' % bench)
+        BENCHMARKS[bench]()
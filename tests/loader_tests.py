@@ -0,0 +1,69 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+tests for model/loader.py
+"""
+from logging import getLogger
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from app.model import memory
+from app.model.loader import DataLoader
+
+logger = getLogger()
+
+
+async def create_phrases(count):
+    """ in-memory collection of count phrases, its queries are recorded in .queries """
+    collection = memory.MemoryClient()['test'].phrases
+    await collection.insert([{'_id': i, 'text1': 'phrase %d' % i} for i in range(count)])
+    collection.queries = []
+    find = collection.find
+
+    def recorded_find(spec, fields=None):
+        collection.queries.append((spec['_id']['$in'], fields))
+        return find(spec, fields)
+    collection.find = recorded_find
+    return collection
+
+
+class DataLoaderTests(AsyncTestCase):
+    """
+    Tests for DataLoader
+    """
+    @gen_test
+    async def test_batch(self):
+        """
+        loads of one iteration share a query, results are cached
+        """
+        collection = await create_phrases(500)
+        loader = DataLoader(collection)
+
+        ids = list(range(500)) + [1000]
+        docs = await loader.load_many(ids)
+        self.assertEqual(len(collection.queries), 1)
+        self.assertEqual([doc['_id'] for doc in docs[:-1]], ids[:-1])
+        self.assertIsNone(docs[-1])
+
+        # separate loads started together
+        first, second = await gen.multi([loader.load(1), loader.load(2)])
+        self.assertEqual(first['text1'], 'phrase 1')
+        self.assertEqual(len(collection.queries), 1)
+        self.assertEqual(loader.stats['cached'], 2)
+
+        # copies
+        first['text1'] = 'changed'
+        self.assertEqual((await loader.load(1))['text1'], 'phrase 1')
+
+    @gen_test
+    async def test_batch_size(self):
+        """
+        big batches are split, projection without _id still matches
+        """
+        collection = await create_phrases(10)
+        loader = DataLoader(collection, {'_id': 0, 'text1': 1}, max_batch=4)
+
+        docs = await loader.load_many(range(10))
+        self.assertEqual([len(ids) for ids, _ in collection.queries], [4, 4, 2])
+        self.assertEqual(collection.queries[0][1], {'_id': 1, 'text1': 1})
+        self.assertEqual(docs[3], {'text1': 'phrase 3'})
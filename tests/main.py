@@ -19,6 +19,11 @@ parse_command_line()
 logger = logging.getLogger()
 app = None
 
+# mongodb://... runs the tests against a real mongod
+TEST_MONGO_URI = os.environ.get('TEST_MONGO_URI', 'memory://')
+TEST_DB_NAME = 'tornado-test-test'
+TEST_PAGE_KEY = 'tornado-test-page-key'
+
 
 class UnitTest(tornado.testing.AsyncHTTPTestCase):
     """
@@ -40,12 +45,24 @@ class UnitTest(tornado.testing.AsyncHTTPTestCase):
     def setUp(self):
         logger.debug('setUp()')
         super().setUp()
+        from app.model import model
+        # other tests may reset the model
+        if model.db is None:
+            model.init(TEST_DB_NAME, TEST_MONGO_URI)
+        from app.rest import tools
+        tools.init_page_key(TEST_PAGE_KEY)
+        self.io_loop.run_sync(model.ensure_indexes)
 
     def tearDown(self):
         logger.debug('tearDown()')
-        from app.model import model
-        model.client.drop_database('tornado-test-test')
+        from app.model import model, profiler
+
+        # every query shape of the test must be served by an index
+        problems = self.io_loop.run_sync(profiler.check_plans)
+        self.io_loop.run_sync(lambda: model.client.drop_database(TEST_DB_NAME))
         super().tearDown()
+        if problems:
+            self.fail('queries not served by indexes:\n' + profiler.plans_report(problems))
 
     def create_auth_and_check(self, method: str, endpoint: str):
         pass
@@ -102,8 +119,9 @@ def create_app():
     app = tornado.web.Application(debug=True)
 
     # init mongodb
-    from app.model import model
-    model.init('tornado-test-test')
+    from app.model import model, profiler
+    model.init(TEST_DB_NAME, TEST_MONGO_URI)
+    profiler.capture_plans = True
 
     # init rest
     from app.rest import rest
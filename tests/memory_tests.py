@@ -0,0 +1,210 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+tests for model/memory.py
+"""
+import time
+
+from logging import getLogger
+
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+from tornado.testing import AsyncTestCase, gen_test
+
+from app.model import memory
+from app.model import model
+
+logger = getLogger()
+
+
+class MemoryTests(AsyncTestCase):
+    """
+    Tests for in-memory backend
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = memory.MemoryClient()
+        self.db = self.client['test']
+
+    @gen_test
+    async def test_crud(self):
+        """
+        insert, find_one with projection, update operators, upsert, remove
+        """
+        user_id = await self.db.users.insert({'email': 'a@b.c', 'name': 'a', 'tags': ['x']})
+        doc = await self.db.users.find_one({'_id': user_id}, {'name': 1})
+        self.assertEqual(doc, {'_id': user_id, 'name': 'a'})
+        doc = await self.db.users.find_one({'tags': 'x'}, {'_id': 0, 'tags': 0})
+        self.assertEqual(doc, {'email': 'a@b.c', 'name': 'a'})
+        self.assertIsNone(await self.db.users.find_one({'tags': 'y'}))
+
+        res = await self.db.users.update({'_id': user_id},
+                                         {'$set': {'name': 'b'}, '$inc': {'token_epoch': 1}})
+        self.assertEqual(res['n'], 1)
+        self.assertTrue(res['updatedExisting'])
+        doc = await self.db.users.find_one(user_id)
+        self.assertEqual((doc['name'], doc['token_epoch']), ('b', 1))
+
+        res = await self.db.users.update({'email': 'c@d.e'}, {'$set': {'name': 'c'}}, upsert=True)
+        self.assertFalse(res['updatedExisting'])
+        doc = await self.db.users.find_one({'_id': res['upserted']})
+        self.assertEqual((doc['email'], doc['name']), ('c@d.e', 'c'))
+
+        doc = await self.db.users.find_and_modify({'email': 'a@b.c'}, {'$unset': {'tags': 1}},
+                                                  new=True, fields={'tags': 1})
+        self.assertEqual(doc, {'_id': user_id})
+
+        res = await self.db.users.remove({'name': {'$in': ['b', 'c']}})
+        self.assertEqual(res['n'], 2)
+        self.assertEqual(await self.db.users.count(), 0)
+
+    @gen_test
+    async def test_unique(self):
+        """
+        unique indexes reject duplicates on insert, update and creation
+        """
+        await self.db.users.create_index([('email', 1)], unique=True)
+        await self.db.users.insert({'email': 'a'})
+        user_id = await self.db.users.insert({'email': 'b'})
+        with self.assertRaises(DuplicateKeyError):
+            await self.db.users.insert({'email': 'a'})
+        with self.assertRaises(DuplicateKeyError):
+            await self.db.users.update({'_id': user_id}, {'$set': {'email': 'a'}})
+        self.assertEqual((await self.db.users.find_one(user_id))['email'], 'b')
+
+        # freed by update and remove
+        await self.db.users.update({'_id': user_id}, {'$set': {'email': 'c'}})
+        await self.db.users.insert({'email': 'b'})
+        await self.db.users.remove({'email': 'a'})
+        await self.db.users.insert({'email': 'a'})
+
+        await self.db.users.insert({'name': 'x'})
+        with self.assertRaises(DuplicateKeyError):
+            await self.db.users.create_index([('name', 1)], unique=True)
+        self.assertNotIn('name_1', await self.db.users.index_information())
+
+        # upserts racing for one key
+        await self.db.auths.create_index([('user_id', 1)], unique=True)
+        await self.db.auths.find_and_modify({'user_id': 1}, {'$setOnInsert': {'t': 1}},
+                                            upsert=True, new=True)
+        doc = await self.db.auths.find_and_modify({'user_id': 1}, {'$setOnInsert': {'t': 2}},
+                                                  upsert=True, new=True)
+        self.assertEqual(doc['t'], 1)
+
+        await self.db.create_collection('events', capped=True, size=100)
+        with self.assertRaises(CollectionInvalid):
+            await self.db.create_collection('events')
+
+    @gen_test
+    async def test_cursor(self):
+        """
+        sort, skip, limit, ranges, to_list and iteration in batches
+        """
+        await self.db.phrases.insert([{'n': i % 10, 'text': str(i)} for i in range(300)])
+
+        docs = await self.db.phrases.find({'n': {'$gte': 8}}, {'_id': 0}) \
+            .sort([('n', -1), ('text', 1)]).skip(1).limit(3).to_list(10)
+        self.assertEqual(docs, [{'n': 9, 'text': '119'}, {'n': 9, 'text': '129'},
+                                {'n': 9, 'text': '139'}])
+
+        cursor = self.db.phrases.find({'$or': [{'n': 1}, {'text': '2'}]})
+        docs = [doc async for doc in cursor]
+        self.assertEqual(len(docs), 31)
+        self.assertFalse(cursor.alive)
+
+        cursor = self.db.phrases.find()
+        self.assertEqual(len(await cursor.to_list(100)), 100)
+        self.assertTrue(cursor.alive)
+        self.assertEqual(len(await cursor.to_list(1000)), 200)
+        self.assertFalse(cursor.alive)
+
+        # mixed types sort by bson order
+        await self.db.mixed.insert([{'v': 'a'}, {'v': 2}, {'v': None}, {}])
+        docs = await self.db.mixed.find({}, {'_id': 0}).sort('v').to_list(10)
+        self.assertEqual(docs, [{'v': None}, {}, {'v': 2}, {'v': 'a'}])
+        self.assertEqual(await self.db.mixed.count({'v': {'$gt': 1}}), 1)
+
+    @gen_test
+    async def test_aggregate(self):
+        """
+        $match, $sort, $lookup, $unwind and $project of the export pipeline
+        """
+        phrase_ids = await self.db.phrases.insert([{'text1': str(i)} for i in range(3)])
+        await self.db.links.insert([{'book': 1, 'phrase_id': phrase_id}
+                                    for phrase_id in reversed(phrase_ids)])
+        await self.db.links.insert({'book': 2, 'phrase_id': phrase_ids[0]})
+
+        docs = await self.db.links.aggregate([
+            {'$match': {'book': 1}},
+            {'$sort': {'_id': -1}},
+            {'$lookup': {'from': 'phrases', 'localField': 'phrase_id', 'foreignField': '_id',
+                         'as': 'phrase'}},
+            {'$unwind': '$phrase'},
+            {'$project': {'_id': '$phrase._id', 'text1': '$phrase.text1'}}
+        ]).to_list(10)
+        self.assertEqual(docs, [{'_id': phrase_ids[i], 'text1': str(i)} for i in range(3)])
+
+    @gen_test
+    async def test_explain(self):
+        """
+        plans by declared indexes, sorts not served by them
+        """
+        await self.db.links.create_index([('book', 1), ('_id', 1)])
+
+        async def stages(cursor):
+            plan = (await cursor.explain())['queryPlanner']['winningPlan']
+            names = []
+            while plan:
+                names.append(plan['stage'])
+                plan = plan.get('inputStage')
+            return names
+
+        self.assertEqual(await stages(self.db.links.find({'_id': 1})), ['IDHACK'])
+        self.assertEqual(await stages(self.db.links.find({'book': 1}).sort('_id')),
+                         ['FETCH', 'IXSCAN'])
+        self.assertEqual(await stages(self.db.links.find({'book': 1}).sort('text')),
+                         ['SORT', 'FETCH', 'IXSCAN'])
+        self.assertEqual(await stages(self.db.links.find({'text': 1})), ['COLLSCAN'])
+
+    @gen_test
+    async def test_latency(self):
+        """
+        every operation and cursor batch waits for latency
+        """
+        self.client.latency = 0.02
+        await self.db.phrases.insert([{'n': i} for i in range(150)])
+
+        started = time.monotonic()
+        await self.db.phrases.find_one({'n': 1})
+        await self.db.phrases.find().to_list(150)
+        # one operation, two batches (101 + 49)
+        self.assertGreaterEqual(time.monotonic() - started, 0.06)
+
+        calls = []
+        self.client.latency = lambda: calls.append(1) or 0
+        await self.db.phrases.find().batch_size(50).to_list(150)
+        self.assertEqual(len(calls), 3)
+
+
+class MemoryModelTests(AsyncTestCase):
+    """
+    model on in-memory backend
+    """
+    def tearDown(self):
+        model.db = model.client = model._pid = None
+        super().tearDown()
+
+    @gen_test
+    async def test_init(self):
+        """
+        memory:// uri selects the backend, indexes are created and verified
+        """
+        model.init('test', model.MEMORY_URI, latency=0)
+        self.assertIsInstance(model.client, memory.MemoryClient)
+        self.assertFalse(model.pool_stats['available'])
+
+        self.assertEqual(await model.ensure_indexes(), [])
+        self.assertEqual(await model.missing_indexes(), [])
+
+        await model.db.users.insert({'email': 'a'})
+        with self.assertRaises(DuplicateKeyError):
+            await model.db.users.insert({'email': 'a'})
+        self.assertEqual((await model.find_one(model.db.users, {'email': 'a'}))['email'], 'a')
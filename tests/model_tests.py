@@ -0,0 +1,288 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+tests for model/model.py
+"""
+import time
+
+from logging import getLogger
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from app.model import memory
+from app.model import model
+
+logger = getLogger()
+
+
+class FindOneTests(AsyncTestCase):
+    """
+    Tests for model.find_one
+    """
+    @gen_test
+    async def test_coalesce(self):
+        """
+        concurrent identical reads share one operation
+        """
+        client = memory.MemoryClient()
+        collection = client['test'].fake
+        await collection.insert([{'_id': i, 'name': 'test'} for i in (1, 2)])
+        calls = []
+        client.latency = lambda: calls.append(1) or 0
+        waiters = [gen.convert_yielded(model.find_one(collection, {'_id': i}, {'_id': 0}))
+                   for i in (1, 1, 2)]
+        first, second, other = await gen.multi(waiters)
+        self.assertEqual(len(calls), 2)
+
+        self.assertEqual(first, {'name': 'test'})
+        self.assertEqual(other, {'name': 'test'})
+        self.assertIsNot(first, second)
+        self.assertEqual(model._inflight, {})
+
+
+class InvalidationBusTests(AsyncTestCase):
+    """
+    Tests for invalidation bus
+    """
+    def test_dispatch(self):
+        """
+        local publish and events of other workers reach subscribers
+        """
+        keys = []
+        model.subscribe('test', keys.append)
+
+        model.publish('test', 'a')
+        self.assertEqual(keys, ['a'])
+
+        # own events are skipped
+        model._receive({'c': 'test', 'k': 'b', 'src': model._source(), 'ts': time.time()})
+        self.assertEqual(keys, ['a'])
+
+        model._receive({'c': 'test', 'k': 'c', 'src': 'other:1', 'ts': time.time() - 1})
+        self.assertEqual(keys, ['a', 'c'])
+        self.assertGreaterEqual(model.invalidation_stats['last_delay'], 1)
+
+
+class ChangeStream(object):
+    """ change stream of inserted events """
+    def __init__(self, events):
+        self.events = list(events)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.events:
+            raise StopAsyncIteration
+        return {'operationType': 'insert', 'fullDocument': self.events.pop(0)}
+
+
+class WatchedCollection(object):
+    """ collection of a change stream """
+    def __init__(self, events):
+        self.events = events
+        self.pipeline = None
+
+    def watch(self, pipeline):
+        self.pipeline = pipeline
+        return ChangeStream(self.events)
+
+
+def _event(key, src='other:1'):
+    return {'c': 'bus', 'k': key, 'src': src, 'ts': time.time()}
+
+
+class InvalidationTransportTests(AsyncTestCase):
+    """
+    Tests for transports of invalidation bus
+    """
+    def setUp(self):
+        super().setUp()
+        self.keys = []
+        model.subscribe('bus', self.keys.append)
+        self.retry_seconds = model.INVALIDATION_RETRY_SECONDS
+        model.INVALIDATION_RETRY_SECONDS = 0.01
+
+    def tearDown(self):
+        model.stop_invalidation_bus()
+        model.INVALIDATION_RETRY_SECONDS = self.retry_seconds
+        del model._subscribers['bus']
+        model.db = model.client = model._pid = None
+        super().tearDown()
+
+    @gen_test
+    async def test_tail_capped(self):
+        """
+        events of other workers, published after the start, are tailed
+        """
+        model.init('tornado-test-test', model.MEMORY_URI)
+        await model.ensure_indexes()
+        collection = model.db[model.INVALIDATION_COLLECTION]
+        self.assertTrue(collection.options['capped'])
+
+        await collection.insert(_event('old'))
+        model._listening = True
+        tail = gen.convert_yielded(model._tail_capped(collection))
+        await gen.sleep(0.05)
+
+        model.publish('bus', 'own')
+        await collection.insert(_event('a'))
+        while len(self.keys) < 2:
+            await gen.sleep(0.01)
+
+        # the cursor is reopened after the last seen event
+        await collection.insert([_event('b'), _event('c', model._source()), _event('d')])
+        while len(self.keys) < 4:
+            await gen.sleep(0.01)
+        self.assertEqual(self.keys, ['own', 'a', 'b', 'd'])
+
+        model.stop_invalidation_bus()
+        await tail
+        self.assertTrue(collection.options['capped'])
+
+    @gen_test
+    async def test_watch(self):
+        """
+        inserted events of other workers are watched until the bus stops
+        """
+        model._listening = True
+        collection = WatchedCollection([_event('a'), _event('b', model._source()), _event('c')])
+        await model._watch(collection)
+        self.assertEqual(collection.pipeline, [{'$match': {'operationType': 'insert'}}])
+        self.assertEqual(self.keys, ['a', 'c'])
+
+        model.stop_invalidation_bus()
+        await model._watch(WatchedCollection([_event('d')]))
+        self.assertEqual(self.keys, ['a', 'c'])
+
+
+class ClientTests(AsyncTestCase):
+    """
+    Tests for per process client and pool stats
+    """
+    def tearDown(self):
+        model.db = model.client = model._pid = None
+        super().tearDown()
+
+    def test_per_process(self):
+        """
+        a client inherited from another process is replaced on first use
+        """
+        model.init('tornado-test-test', maxPoolSize=10)
+        client = model.client
+        self.assertIs(model.connect(), client)
+        self.assertEqual(model.db.users.name, 'users')
+
+        model._pid = -1  # as if forked
+        self.assertIsNot(model.db['users'].database.client, client)
+        self.assertIsNot(model.client, client)
+
+    def test_pool_stats(self):
+        """
+        checkouts, waits and failures are counted
+        """
+        model.init('tornado-test-test')
+        listener = model._PoolListener()
+        listener.connection_created(None)
+        listener.connection_check_out_started(None)
+        self.assertEqual(model.pool_stats['waiting'], 1)
+        listener.connection_checked_out(None)
+        listener.connection_check_out_started(None)
+        listener.connection_check_out_failed(None)
+        listener.connection_checked_in(None)
+
+        stats = model.pool_stats
+        self.assertEqual((stats['connections'], stats['checked_out'], stats['waiting']), (1, 0, 0))
+        self.assertEqual((stats['checkouts'], stats['checkout_failures']), (1, 1))
+        self.assertEqual((stats['max_checked_out'], stats['max_waiting']), (1, 1))
+        self.assertGreater(stats['wait_seconds'], 0.0)
+
+
+class IndexTests(AsyncTestCase):
+    """
+    Tests for index registry
+    """
+    def setUp(self):
+        super().setUp()
+        model.init('test', model.MEMORY_URI)
+
+    def tearDown(self):
+        model.db = model.client = model._pid = None
+        super().tearDown()
+
+    @gen_test
+    async def test_ensure(self):
+        """
+        creates missing, drops obsolete
+        """
+        await model.db.auths.create_index([('consumer_id', 1), ('user_id', 1)])
+        self.assertEqual(await model.ensure_indexes(), [])
+        self.assertEqual(await model.missing_indexes(), [])
+
+        auths = await model.db.auths.index_information()
+        self.assertNotIn('consumer_id_1_user_id_1', auths)
+        self.assertEqual(auths['end_date_1']['expireAfterSeconds'], 0)
+        self.assertTrue(auths['access_token_1']['background'])
+
+        # nothing to do
+        self.assertEqual(await model.ensure_indexes(), [])
+
+    @gen_test
+    async def test_missing(self):
+        """
+        missing required index stops the app, unless not strict
+        """
+        # unique index can't be built over duplicates
+        await model.db.users.insert([{'email': 'a'}, {'email': 'a'}])
+        with self.assertRaises(model.MissingIndexError):
+            await model.ensure_indexes()
+
+        missing = await model.ensure_indexes(strict=False)
+        self.assertEqual([(collection, spec['keys']) for collection, spec in missing],
+                         [('users', [('email', 1)])])
+
+    @gen_test
+    async def test_conflict(self):
+        """
+        index of declared keys with other options is reported, replaced by rebuild only
+        """
+        self.assertEqual(await model.ensure_indexes(), [])
+        await model.db.users.drop_index('email_1')
+        await model.db.users.create_index([('email', 1)], background=True)
+        await model.db.auths.drop_index('end_date_1')
+        await model.db.auths.create_index([('end_date', 1)], expireAfterSeconds=60.0)
+
+        conflicts = [('auths', [('end_date', 1)]), ('users', [('email', 1)])]
+        missing = await model.missing_indexes()
+        self.assertEqual([(collection, spec['keys']) for collection, spec in missing], conflicts)
+
+        # kept on start
+        with self.assertLogs(level='ERROR'):
+            missing = await model.ensure_indexes()
+        self.assertEqual([(collection, spec['keys']) for collection, spec in missing], conflicts)
+        self.assertNotIn('unique', (await model.db.users.index_information())['email_1'])
+
+        self.assertEqual(await model.ensure_indexes(rebuild=True), [])
+        self.assertTrue((await model.db.users.index_information())['email_1']['unique'])
+        auths = await model.db.auths.index_information()
+        self.assertEqual(auths['end_date_1']['expireAfterSeconds'], 0)
+
+    @gen_test
+    async def test_rebuild_failed(self):
+        """
+        conflicting index is restored if the declared one can't be built
+        """
+        await model.db.users.create_index([('email', 1)])
+        await model.db.users.insert([{'email': 'a'}, {'email': 'a'}])
+
+        missing = await model.ensure_indexes(rebuild=True)
+        self.assertEqual([(collection, spec['keys']) for collection, spec in missing],
+                         [('users', [('email', 1)])])
+        info = (await model.db.users.index_information())['email_1']
+        self.assertEqual((info['key'], info.get('unique')), ([('email', 1)], None))
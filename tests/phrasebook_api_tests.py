@@ -1,13 +1,18 @@
+# pylint: disable=locally-disabled, invalid-name
 """
 unit tests for phrasebook_api.py
 """
+import json
+
 from logging import getLogger
 
-from tests.main import UnitTest
+from bson.objectid import ObjectId
+from tornado.testing import gen_test
 
-from app.orm.models import Phrasebook, User
+from tests.main import UnitTest
+from tests.tools import read_json, create_test_auth
 
-from flask import json
+from app.model import model
 
 logger = getLogger()
 
@@ -16,359 +21,503 @@ class PhrasebookApiTests(UnitTest):
     """
     unit tests for PhrasebookAPI
     """
-    def test_get_all(self):
+    @gen_test
+    async def test_get_all(self):
         """
         GET /phrasebook
         """
         logger.debug('***** GET ALL *****')
 
-        user, _, auth, session = self.create_auth_and_check('GET', '/phrasebook')
+        user, _, auth = await create_test_auth()
+        headers = {'Authorization': 'Bearer ' + auth['access_token']}
+
+        # not authorized
+        logger.debug('> not authorized')
+        res = await self.fetch('/phrasebook')
+        self.assertEqual(res.code, 401)
 
         # no data
         logger.debug('> no data')
 
-        res = self.test_client.get('/phrasebook', headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/phrasebook', headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.code, 200)
         self.assertEqual(len(data), 0)
+        self.assertNotIn('X-Next-Cursor', res.headers)
 
         # returns new phrasebook
         logger.debug('> returns new phrasebook')
 
-        p = Phrasebook()
-        p.gen_id()
-        p.name = 'new p'
-        p.user_id = user.id
-        session.add(p)
-        session.commit()
+        phrasebook_id = await model.db.phrasebooks.insert({
+            'name': 'new p',
+            'user_id': user['id'],
+            'version': 1
+        })
 
-        res = self.test_client.get('/phrasebook', headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/phrasebook', headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.code, 200)
         self.assertEqual(len(data), 1)
-        self.assertEqual(data[0]['name'], 'new p')
+        self.assertEqual(data[0], {'id': str(phrasebook_id), 'name': 'new p'})
 
         # doesn't return removed phraseboook
         logger.debug('> doesn\'t return removed phraseboook')
 
-        session.delete(p)
-        session.commit()
+        await model.db.phrasebooks.remove({'_id': phrasebook_id})
 
-        res = self.test_client.get('/phrasebook', headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/phrasebook', headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.code, 200)
         self.assertEqual(len(data), 0)
 
-    def test_get(self):
+        # returns pages
+        logger.debug('> returns pages')
+
+        for i in range(5):
+            await model.db.phrasebooks.insert({'name': 'p%d' % i, 'user_id': user['id']})
+        await model.db.phrasebooks.insert({'name': 'others', 'user_id': ObjectId()})
+
+        names = []
+        url = '/phrasebook?limit=2&fields=name'
+        while url:
+            res = await self.fetch(url, headers=headers)
+            data = read_json(res)
+            logger.debug('< ' + str(data))
+
+            self.assertEqual(res.code, 200)
+            self.assertLessEqual(len(data), 2)
+            names += [item['name'] for item in data]
+            cursor = res.headers.get('X-Next-Cursor')
+            url = '/phrasebook?limit=2&fields=name&cursor=' + cursor if cursor else None
+        self.assertEqual(names, ['p0', 'p1', 'p2', 'p3', 'p4'])
+
+        # invalid cursor
+        logger.debug('> invalid cursor')
+
+        for cursor in ('1', 'p1..%C3%A9.x'):
+            res = await self.fetch('/phrasebook?cursor=' + cursor, headers=headers)
+            data = read_json(res)
+
+            self.assertEqual(res.code, 400)
+            self.assertEqual(data['message'], 'Invalid cursor')
+
+    @gen_test
+    async def test_get(self):
         """
-        GET /phrasebook/<uuid>
+        GET /phrasebook/<id>
         """
         logger.debug('***** GET *****')
 
-        user, _, auth, session = self.create_auth_and_check('GET', '/phrasebook/1')
+        user, _, auth = await create_test_auth()
+        headers = {'Authorization': 'Bearer ' + auth['access_token']}
 
-        # Invalid UUID
-        logger.debug('> invalid uuid')
-        res = self.test_client.get('/phrasebook/1', headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
+        # invalid id
+        logger.debug('> invalid id')
+        res = await self.fetch('/phrasebook/1', headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'Bad UUID')
+        self.assertEqual(res.code, 400)
+        self.assertEqual(data['message'], 'Bad id')
 
         # phrasebook not found
         logger.debug('> phrasebook not found')
 
-        res = self.test_client.get('/phrasebook/' + str(user.id),
-                                   headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/phrasebook/' + str(user['id']), headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.code, 404)
         self.assertEqual(data['message'], 'Phrasebook not found')
 
         # doesn return others phrasebook
         logger.debug('> doesn return others phrasebook')
 
-        user2 = User()
-        user2.gen_id()
-        user2.email = 'u2'
-        user2.password = 'u2'
-        user2.name = 'u2'
-        session.add(user2)
-        session.flush()
-
-        p = Phrasebook()
-        p.gen_id()
-        p.name = 'new p'
-        p.user_id = user2.id
-        session.add(p)
-        session.commit()
-
-        res = self.test_client.get('/phrasebook/' + str(p.id),
-                                   headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
+        phrasebook_id = await model.db.phrasebooks.insert({
+            'name': 'new p',
+            'user_id': ObjectId(),
+            'version': 1
+        })
+
+        res = await self.fetch('/phrasebook/' + str(phrasebook_id), headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.code, 404)
         self.assertEqual(data['message'], 'Phrasebook not found')
 
         # returns new phrasebook
         logger.debug('> returns new phrasebook')
 
-        p.user_id = user.id
-        session.merge(p)
-        session.commit()
+        await model.db.phrasebooks.update({'_id': phrasebook_id},
+                                          model.versioned({'$set': {'user_id': user['id']}}))
 
-        res = self.test_client.get('/phrasebook/' + str(p.id),
-                                   headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/phrasebook/' + str(phrasebook_id), headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.code, 200)
         self.assertEqual(data['name'], 'new p')
 
-    def test_post(self):
-        """
-        POST /phrasebook
-        """
-        logger.debug('***** POST *****')
-
-        _, _, auth, _ = self.create_auth_and_check('POST', '/phrasebook')
-
-        # no data
-        logger.debug('> no data')
-
-        res = self.test_client.post('/phrasebook', headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'No data')
-
-        # no empty names
-        logger.debug('> no empty names')
-
-        res = self.test_client.post('/phrasebook',
-                                    headers={'access_token': auth.access_token},
-                                    data=json.dumps({'name': ''}),
-                                    content_type='application/json')
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
+        # not modified
+        logger.debug('> not modified')
 
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'Name must be in range 1..100')
+        headers['If-None-Match'] = res.headers['Etag']
+        res = await self.fetch('/phrasebook/' + str(phrasebook_id), headers=headers)
+        self.assertEqual(res.code, 304)
 
-        # too long name
-        logger.debug('> too long name')
+        # others phrasebook isn't confirmed by its etag
+        logger.debug('> others phrasebook isn\'t confirmed by its etag')
 
-        res = self.test_client.post('/phrasebook',
-                                    headers={'access_token': auth.access_token},
-                                    data=json.dumps({'name': ('N' * 101)}),
-                                    content_type='application/json')
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'Name must be in range 1..100')
-
-        # returns new phrasebook
-        logger.debug('> returns new phrasebook')
+        await model.db.phrasebooks.update({'_id': phrasebook_id},
+                                          {'$set': {'user_id': ObjectId()}})
 
-        res = self.test_client.post('/phrasebook',
-                                    headers={'access_token': auth.access_token},
-                                    data=json.dumps({'name': 'phrasybook 1'}),
-                                    content_type='application/json')
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch('/phrasebook/' + str(phrasebook_id), headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
-        self.assertIsNotNone(data['id'])
-        self.assertEqual(data['name'], 'phrasybook 1')
+        self.assertEqual(res.code, 404)
+        self.assertEqual(data['message'], 'Phrasebook not found')
 
-    def test_put(self):
+    @gen_test
+    async def test_get_phrases(self):
         """
-        PUT /phrasebook/<uuid>
+        GET /phrasebook/<id>/phrases
         """
-        logger.debug('***** PUT *****')
+        logger.debug('***** GET PHRASES *****')
 
-        user, _, auth, session = self.create_auth_and_check('PUT', '/phrasebook/1')
-
-        # Invalid UUID
-        logger.debug('> invalid uuid')
-        res = self.test_client.put('/phrasebook/1', headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'Bad UUID')
-
-        # no data
-        logger.debug('> no data')
-
-        res = self.test_client.put('/phrasebook/' + str(user.id),
-                                   headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'No data')
-
-        # no empty names
-        logger.debug('> no empty names')
-
-        res = self.test_client.put('/phrasebook/' + str(user.id),
-                                   headers={'access_token': auth.access_token},
-                                   data=json.dumps({'name': ''}),
-                                   content_type='application/json')
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'Name must be in range 1..100')
-
-        # too long name
-        logger.debug('> too long name')
-
-        res = self.test_client.put('/phrasebook/' + str(user.id),
-                                   headers={'access_token': auth.access_token},
-                                   data=json.dumps({'name': ('N' * 101)}),
-                                   content_type='application/json')
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'Name must be in range 1..100')
+        user, _, auth = await create_test_auth()
+        headers = {'Authorization': 'Bearer ' + auth['access_token']}
 
         # phrasebook not found
         logger.debug('> phrasebook not found')
 
-        res = self.test_client.put('/phrasebook/' + str(user.id),
-                                   headers={'access_token': auth.access_token},
-                                   data=json.dumps({'name': 'n1'}),
-                                   content_type='application/json')
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
+        res = await self.fetch('/phrasebook/%s/phrases' % user['id'], headers=headers)
+        data = read_json(res)
 
-        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.code, 404)
         self.assertEqual(data['message'], 'Phrasebook not found')
 
-        # doesn allow others phrasebook
-        logger.debug('> doesn allow others phrasebook')
-
-        user2 = User()
-        user2.gen_id()
-        user2.email = 'u2'
-        user2.password = 'u2'
-        user2.name = 'u2'
-        session.add(user2)
-        session.flush()
-
-        p = Phrasebook()
-        p.gen_id()
-        p.name = 'new p'
-        p.user_id = user2.id
-        session.add(p)
-        session.commit()
-
-        res = self.test_client.put('/phrasebook/' + str(p.id),
-                                   headers={'access_token': auth.access_token},
-                                   data=json.dumps({'name': 'n1'}),
-                                   content_type='application/json')
-        data = json.loads(res.get_data(as_text=True))
+        # returns phrases by pages, in order of links
+        logger.debug('> returns phrases by pages')
+
+        phrasebook_id = await model.db.phrasebooks.insert({'name': 'p', 'user_id': user['id']})
+        for i in reversed(range(3)):
+            phrase_id = await model.db.phrases.insert({
+                'text1': 'phrase %d' % i,
+                'text2': 'trans %d' % i,
+                'lang1': 'en',
+                'lang2': 'ru'
+            })
+            await model.db.phrasebook_phrases.insert({
+                'phrasebook_id': phrasebook_id,
+                'phrase_id': phrase_id
+            })
+
+        url = '/phrasebook/%s/phrases?limit=2&fields=text1' % phrasebook_id
+        res = await self.fetch(url, headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 404)
-        self.assertEqual(data['message'], 'Phrasebook not found')
-
-        # updates new phrasebook
-        logger.debug('> updates new phrasebook')
+        self.assertEqual(res.code, 200)
+        self.assertEqual(data, [{'text1': 'phrase 2'}, {'text1': 'phrase 1'}])
 
-        p.user_id = user.id
-        session.merge(p)
-        session.commit()
-
-        res = self.test_client.put('/phrasebook/' + str(p.id),
-                                   headers={'access_token': auth.access_token},
-                                   data=json.dumps({'name': 'n1'}),
-                                   content_type='application/json')
-        data = json.loads(res.get_data(as_text=True))
+        res = await self.fetch(url + '&cursor=' + res.headers['X-Next-Cursor'], headers=headers)
+        data = read_json(res)
         logger.debug('< ' + str(data))
 
-        self.assertEqual(res.status_code, 200)
-        self.assertEqual(data, 'OK')
+        self.assertEqual(res.code, 200)
+        self.assertEqual(data, [{'text1': 'phrase 0'}])
+        self.assertNotIn('X-Next-Cursor', res.headers)
 
-    def test_delete(self):
+    @gen_test
+    async def test_export(self):
         """
-        DELETE /phrasebook/<uuid>
+        GET /phrasebook/<id>/export
         """
-        logger.debug('***** DELETE *****')
-
-        user, _, auth, session = self.create_auth_and_check('DELETE', '/phrasebook/1')
+        logger.debug('***** EXPORT *****')
 
-        # Invalid UUID
-        logger.debug('> invalid uuid')
-        res = self.test_client.delete('/phrasebook/1', headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data['message'], 'Bad UUID')
+        user, _, auth = await create_test_auth()
+        headers = {'Authorization': 'Bearer ' + auth['access_token']}
 
         # phrasebook not found
         logger.debug('> phrasebook not found')
 
-        res = self.test_client.delete('/phrasebook/' + str(user.id),
-                                      headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
+        res = await self.fetch('/phrasebook/%s/export' % user['id'], headers=headers)
+        data = read_json(res)
 
-        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.code, 404)
         self.assertEqual(data['message'], 'Phrasebook not found')
 
-        # doesn delete others phrasebook
-        logger.debug('> doesn delete others phrasebook')
-
-        user2 = User()
-        user2.gen_id()
-        user2.email = 'u2'
-        user2.password = 'u2'
-        user2.name = 'u2'
-        session.add(user2)
-        session.flush()
-
-        p = Phrasebook()
-        p.gen_id()
-        p.name = 'new p'
-        p.user_id = user2.id
-        session.add(p)
-        session.commit()
-
-        res = self.test_client.delete('/phrasebook/' + str(p.id),
-                                      headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 404)
-        self.assertEqual(data['message'], 'Phrasebook not found')
-
-        # delete new phrasebook
-        logger.debug('> delete new phrasebook')
-
-        p.user_id = user.id
-        session.merge(p)
-        session.commit()
-
-        res = self.test_client.delete('/phrasebook/' + str(p.id),
-                                      headers={'access_token': auth.access_token})
-        data = json.loads(res.get_data(as_text=True))
-        logger.debug('< ' + str(data))
-
-        self.assertEqual(res.status_code, 200)
-        self.assertEqual(data, 'OK')
+        # phrasebook, then phrases in order of links
+        logger.debug('> exports phrasebook')
+
+        phrasebook_id = await model.db.phrasebooks.insert({'name': 'p', 'user_id': user['id']})
+        count = 3000
+        phrase_ids = await model.db.phrases.insert([{
+            'text1': 'phrase %d' % i,
+            'text2': 'trans %d' % i,
+            'lang1': 'en',
+            'lang2': 'ru'
+        } for i in range(count)])
+        await model.db.phrasebook_phrases.insert([{
+            'phrasebook_id': phrasebook_id,
+            'phrase_id': phrase_id
+        } for phrase_id in phrase_ids])
+
+        res = await self.fetch('/phrasebook/%s/export' % phrasebook_id, headers=headers)
+        lines = res.body.decode('utf8').splitlines()
+
+        self.assertEqual(res.code, 200)
+        self.assertEqual(res.headers['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(json.loads(lines[0]), {'id': str(phrasebook_id), 'name': 'p'})
+        self.assertEqual(len(lines), count + 1)
+        phrase = json.loads(lines[-1])
+        self.assertEqual(phrase['id'], str(phrase_ids[-1]))
+        self.assertEqual(phrase['text1'], 'phrase %d' % (count - 1))
+
+    # def test_post(self):
+        # """
+        # POST /phrasebook
+        # """
+        # logger.debug('***** POST *****')
+
+        # _, _, auth, _ = self.create_auth_and_check('POST', '/phrasebook')
+
+        # # no data
+        # logger.debug('> no data')
+
+        # res = self.test_client.post('/phrasebook', headers={'access_token': auth.access_token})
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 400)
+        # self.assertEqual(data['message'], 'No data')
+
+        # # no empty names
+        # logger.debug('> no empty names')
+
+        # res = self.test_client.post('/phrasebook',
+        #                             headers={'access_token': auth.access_token},
+        #                             data=json.dumps({'name': ''}),
+        #                             content_type='application/json')
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 400)
+        # self.assertEqual(data['message'], 'Name must be in range 1..100')
+
+        # # too long name
+        # logger.debug('> too long name')
+
+        # res = self.test_client.post('/phrasebook',
+        #                             headers={'access_token': auth.access_token},
+        #                             data=json.dumps({'name': ('N' * 101)}),
+        #                             content_type='application/json')
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 400)
+        # self.assertEqual(data['message'], 'Name must be in range 1..100')
+
+        # # returns new phrasebook
+        # logger.debug('> returns new phrasebook')
+
+        # res = self.test_client.post('/phrasebook',
+        #                             headers={'access_token': auth.access_token},
+        #                             data=json.dumps({'name': 'phrasybook 1'}),
+        #                             content_type='application/json')
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 200)
+        # self.assertIsNotNone(data['id'])
+        # self.assertEqual(data['name'], 'phrasybook 1')
+
+    # def test_put(self):
+        # """
+        # PUT /phrasebook/<uuid>
+        # """
+        # logger.debug('***** PUT *****')
+
+        # user, _, auth, session = self.create_auth_and_check('PUT', '/phrasebook/1')
+
+        # # Invalid UUID
+        # logger.debug('> invalid uuid')
+        # res = self.test_client.put('/phrasebook/1', headers={'access_token': auth.access_token})
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 400)
+        # self.assertEqual(data['message'], 'Bad UUID')
+
+        # # no data
+        # logger.debug('> no data')
+
+        # res = self.test_client.put('/phrasebook/' + str(user.id),
+        #                            headers={'access_token': auth.access_token})
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 400)
+        # self.assertEqual(data['message'], 'No data')
+
+        # # no empty names
+        # logger.debug('> no empty names')
+
+        # res = self.test_client.put('/phrasebook/' + str(user.id),
+        #                            headers={'access_token': auth.access_token},
+        #                            data=json.dumps({'name': ''}),
+        #                            content_type='application/json')
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 400)
+        # self.assertEqual(data['message'], 'Name must be in range 1..100')
+
+        # # too long name
+        # logger.debug('> too long name')
+
+        # res = self.test_client.put('/phrasebook/' + str(user.id),
+        #                            headers={'access_token': auth.access_token},
+        #                            data=json.dumps({'name': ('N' * 101)}),
+        #                            content_type='application/json')
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 400)
+        # self.assertEqual(data['message'], 'Name must be in range 1..100')
+
+        # # phrasebook not found
+        # logger.debug('> phrasebook not found')
+
+        # res = self.test_client.put('/phrasebook/' + str(user.id),
+        #                            headers={'access_token': auth.access_token},
+        #                            data=json.dumps({'name': 'n1'}),
+        #                            content_type='application/json')
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 404)
+        # self.assertEqual(data['message'], 'Phrasebook not found')
+
+        # # doesn allow others phrasebook
+        # logger.debug('> doesn allow others phrasebook')
+
+        # user2 = User()
+        # user2.gen_id()
+        # user2.email = 'u2'
+        # user2.password = 'u2'
+        # user2.name = 'u2'
+        # session.add(user2)
+        # session.flush()
+
+        # p = Phrasebook()
+        # p.gen_id()
+        # p.name = 'new p'
+        # p.user_id = user2.id
+        # session.add(p)
+        # session.commit()
+
+        # res = self.test_client.put('/phrasebook/' + str(p.id),
+        #                            headers={'access_token': auth.access_token},
+        #                            data=json.dumps({'name': 'n1'}),
+        #                            content_type='application/json')
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 404)
+        # self.assertEqual(data['message'], 'Phrasebook not found')
+
+        # # updates new phrasebook
+        # logger.debug('> updates new phrasebook')
+
+        # p.user_id = user.id
+        # session.merge(p)
+        # session.commit()
+
+        # res = self.test_client.put('/phrasebook/' + str(p.id),
+        #                            headers={'access_token': auth.access_token},
+        #                            data=json.dumps({'name': 'n1'}),
+        #                            content_type='application/json')
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 200)
+        # self.assertEqual(data, 'OK')
+
+    # def test_delete(self):
+        # """
+        # DELETE /phrasebook/<uuid>
+        # """
+        # logger.debug('***** DELETE *****')
+
+        # user, _, auth, session = self.create_auth_and_check('DELETE', '/phrasebook/1')
+
+        # # Invalid UUID
+        # logger.debug('> invalid uuid')
+        # res = self.test_client.delete('/phrasebook/1',
+        #                               headers={'access_token': auth.access_token})
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 400)
+        # self.assertEqual(data['message'], 'Bad UUID')
+
+        # # phrasebook not found
+        # logger.debug('> phrasebook not found')
+
+        # res = self.test_client.delete('/phrasebook/' + str(user.id),
+        #                               headers={'access_token': auth.access_token})
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 404)
+        # self.assertEqual(data['message'], 'Phrasebook not found')
+
+        # # doesn delete others phrasebook
+        # logger.debug('> doesn delete others phrasebook')
+
+        # user2 = User()
+        # user2.gen_id()
+        # user2.email = 'u2'
+        # user2.password = 'u2'
+        # user2.name = 'u2'
+        # session.add(user2)
+        # session.flush()
+
+        # p = Phrasebook()
+        # p.gen_id()
+        # p.name = 'new p'
+        # p.user_id = user2.id
+        # session.add(p)
+        # session.commit()
+
+        # res = self.test_client.delete('/phrasebook/' + str(p.id),
+        #                               headers={'access_token': auth.access_token})
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 404)
+        # self.assertEqual(data['message'], 'Phrasebook not found')
+
+        # # delete new phrasebook
+        # logger.debug('> delete new phrasebook')
+
+        # p.user_id = user.id
+        # session.merge(p)
+        # session.commit()
+
+        # res = self.test_client.delete('/phrasebook/' + str(p.id),
+        #                               headers={'access_token': auth.access_token})
+        # data = json.loads(res.get_data(as_text=True))
+        # logger.debug('< ' + str(data))
+
+        # self.assertEqual(res.status_code, 200)
+        # self.assertEqual(data, 'OK')
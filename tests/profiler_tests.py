@@ -0,0 +1,137 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+tests for model/profiler.py
+"""
+from logging import getLogger
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from app.model import memory
+from app.model import profiler
+
+logger = getLogger()
+
+
+async def create_collection():
+    """ in-memory collection of two docs, (user_id, _id) is indexed """
+    collection = memory.MemoryClient()['test'].fake
+    await collection.create_index([('user_id', 1), ('_id', 1)])
+    await collection.insert([{'_id': 1, 'user_id': 1}, {'_id': 2, 'user_id': 1}])
+    return collection
+
+
+class ProfilerTests(AsyncTestCase):
+    """
+    Tests for query profiler
+    """
+    def setUp(self):
+        super().setUp()
+        profiler.query_stats.clear()
+
+    def tearDown(self):
+        profiler.capture_plans = False
+        profiler._captured.clear()
+        profiler._explained.clear()
+        super().tearDown()
+
+    def test_shape(self):
+        """
+        values are dropped, operators and nesting are kept
+        """
+        self.assertEqual(profiler.query_shape({'user_id': 1, '_id': {'$in': [1, 2]}}),
+                         '{"_id": {"$in": 1}, "user_id": 1}')
+        self.assertEqual(profiler.query_shape({'$or': [{'a': 'x'}, {'b': {'$gt': 2}}]}),
+                         '{"$or": [{"a": 1}, {"b": {"$gt": 1}}]}')
+        self.assertEqual(profiler.query_shape(None), '{}')
+
+    @gen_test
+    async def test_profile(self):
+        """
+        operations and cursors are timed by shape and handler
+        """
+        collection = profiler.ProfiledCollection(await create_collection())
+        request = profiler.start_request('TestHandler')
+
+        future = collection.find_one({'_id': 1})
+        future.add_done_callback(lambda _: None)
+        self.assertEqual(await future, {'_id': 1, 'user_id': 1})
+        await collection.find_one({'_id': 2})
+
+        cursor = collection.find({'user_id': 1}).sort([('_id', -1)])
+        self.assertEqual([doc['_id'] for doc in await cursor.to_list(10)], [2, 1])
+        self.assertEqual([doc async for doc in collection.find({'user_id': 1}, {'user_id': 0})],
+                         [{'_id': 1}, {'_id': 2}])
+
+        stats = profiler.query_stats[('fake', 'find_one', '{"_id": 1}')]
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['handlers'], {'TestHandler': 2})
+        self.assertEqual(profiler.query_stats[('fake', 'find', '{"user_id": 1}')]['count'], 2)
+        self.assertEqual(request['queries'], 4)
+
+    @gen_test
+    async def test_n_plus_one(self):
+        """
+        many queries of a shape in a request are logged
+        """
+        collection = profiler.ProfiledCollection(await create_collection())
+        request = profiler.start_request('TestHandler')
+        for i in range(profiler.N_PLUS_ONE_REPEATS):
+            await collection.find_one({'_id': i})
+        with self.assertRaises(AssertionError):
+            with self.assertLogs(level='WARNING'):
+                profiler.finish_request(request)
+
+        request = profiler.start_request('TestHandler')
+        for i in range(profiler.N_PLUS_ONE_REPEATS + 1):
+            await collection.find_one({'_id': i})
+        with self.assertLogs(level='WARNING') as logs:
+            profiler.finish_request(request)
+        self.assertIn('possible N+1: TestHandler', logs.output[0])
+
+    @gen_test
+    async def test_finish(self):
+        """
+        queries after a request finished are not counted to it
+        """
+        collection = profiler.ProfiledCollection(await create_collection())
+        request = profiler.start_request('TestHandler')
+        await collection.find_one({'_id': 1})
+        profiler.finish_request(request)
+        self.assertIsNone(profiler._request.get())
+
+        await collection.find_one({'_id': 1})
+        self.assertEqual(request['queries'], 1)
+
+    def test_suggest_index(self):
+        """
+        equality, sort, range
+        """
+        spec = {'$and': [{'user_id': 1}, {'date': {'$gt': 1}}], 'name': 'a'}
+        self.assertEqual(profiler.suggest_index(spec, [('rank', -1)]),
+                         [('user_id', 1), ('name', 1), ('rank', -1), ('date', 1)])
+
+    @gen_test
+    async def test_check_plans(self):
+        """
+        collection scans and in-memory sorts are reported once per shape
+        """
+        profiler.capture_plans = True
+        collection = profiler.ProfiledCollection(await create_collection())
+
+        await collection.find({'user_id': 1}).sort('_id').to_list(10)
+        await collection.find({'user_id': 2}).sort('_id').to_list(10)
+        await collection.find({'name': 'a'}).to_list(10)
+        await collection.find({'name': 'b'}).sort([('rank', -1)]).to_list(10)
+        await collection.find_one({'name': 'c'})
+
+        problems = await profiler.check_plans()
+        self.assertEqual([(p['operation'], p['stages'], p['index']) for p in problems], [
+            ('find', ['COLLSCAN'], [('name', 1)]),
+            ('find', ['COLLSCAN', 'SORT'], [('name', 1), ('rank', -1)]),
+            ('find_one', ['COLLSCAN'], [('name', 1)])
+        ])
+        self.assertIn('fake.find {"name": 1}', profiler.plans_report(problems))
+
+        # explained shapes are not captured again
+        await collection.find({'name': 'd'}).to_list(10)
+        self.assertEqual(await profiler.check_plans(), [])
@@ -0,0 +1,83 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+tests for model/reaper.py
+"""
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from bson.objectid import ObjectId
+from tornado.testing import AsyncTestCase, gen_test
+
+from app.model import model
+from app.model import reaper
+
+logger = getLogger()
+
+
+class ReaperTests(AsyncTestCase):
+    """
+    Tests for batched reaper
+    """
+    def setUp(self):
+        super().setUp()
+        model.init('reaper-tests', model.MEMORY_URI)
+        self.settings = (reaper.REAP_BATCH_SIZE, reaper.REAP_BATCH_DELAY_SECONDS,
+                         reaper.REAP_MAX_BATCHES)
+        reaper.REAP_BATCH_SIZE = 10
+        reaper.REAP_BATCH_DELAY_SECONDS = 0
+
+    def tearDown(self):
+        (reaper.REAP_BATCH_SIZE, reaper.REAP_BATCH_DELAY_SECONDS,
+         reaper.REAP_MAX_BATCHES) = self.settings
+        reaper.ttl_index = False
+        model.db = model.client = model._pid = None
+        super().tearDown()
+
+    async def seed(self, ended, live):
+        """ ended and live auths """
+        now = datetime.utcnow()
+        end_dates = [now - timedelta(seconds=i + 1) for i in range(ended)]
+        end_dates += [now + timedelta(seconds=60)] * live
+        await model.db.auths.insert([{
+            'access_token': str(ObjectId()),
+            'refresh_token': str(ObjectId()),
+            'consumer_id': ObjectId(),
+            'end_date': end_date,
+            'live': end_date > now
+        } for end_date in end_dates])
+
+    @gen_test
+    async def test_reap(self):
+        """
+        deletes ended auths only, across batches, up to REAP_MAX_BATCHES
+        """
+        await self.seed(25, 5)
+        reaper.REAP_MAX_BATCHES = 2
+        self.assertEqual(await reaper.reap(), 20)
+        self.assertEqual(await model.db.auths.count({'live': False}), 5)
+
+        # a short batch is the last one
+        reaper.REAP_MAX_BATCHES = 100
+        self.assertEqual(await reaper.reap(), 5)
+        self.assertEqual(await reaper.reap(), 0)
+        self.assertEqual(await model.db.auths.count(), 5)
+        self.assertEqual(await model.db.auths.count({'live': True}), 5)
+        self.assertEqual(reaper.stats['last_reclaimed'], 0)
+
+        # exact multiple of the batch size
+        await self.seed(20, 0)
+        self.assertEqual(await reaper.reap(), 20)
+        self.assertEqual(await model.db.auths.count(), 5)
+
+    @gen_test
+    async def test_ttl_index(self):
+        """
+        no scans when mongo deletes ended auths by TTL index
+        """
+        await self.seed(5, 5)
+        self.assertFalse(await reaper.check_ttl_index())
+
+        await model.ensure_indexes()
+        self.assertTrue(await reaper.check_ttl_index())
+        self.assertEqual(await reaper.reap(), 0)
+        self.assertEqual(await model.db.auths.count(), 10)
@@ -0,0 +1,299 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+tests for rest/rest.py
+"""
+import gzip
+import json
+import zlib
+
+from logging import getLogger
+
+import tornado.web
+
+from bson.objectid import ObjectId
+from tornado.testing import AsyncHTTPTestCase, ExpectLog, gen_test
+
+from app.model import memory
+from app.rest import tools
+from app.rest import rest
+from app.rest.rest import Handler
+
+logger = getLogger()
+
+DOC_ID = ObjectId()
+
+
+class EchoHandler(Handler):
+    # pylint: disable=locally-disabled, abstract-method
+    """ returns posted document """
+    def get(self):
+        self.write_doc({'_id': DOC_ID, 'name': 'test'})
+
+    def post(self):
+        self.write_doc(self.read_json())
+
+    def put(self):
+        self.error_response('Bad document', 400, 7)
+
+
+class BigHandler(Handler):
+    # pylint: disable=locally-disabled, abstract-method
+    """
+    returns ?size bytes of json, ?stream=n flushes in chunks of n bytes,
+    ?finish=1 awaits finish()
+    """
+    async def get(self):
+        size = int(self.get_argument('size'))
+        chunk = int(self.get_argument('stream', 0))
+        if chunk:
+            for _ in range(0, size, chunk):
+                self.write('a' * chunk)
+                await self.flush()
+        elif self.get_argument('finish', None):
+            await self.finish('a' * size)
+        else:
+            self.write('a' * size)
+
+
+class FieldsHandler(Handler):
+    # pylint: disable=locally-disabled, abstract-method
+    """ returns projection of ?fields= (_id is written as id) """
+    FIELDS = ('id', 'name', 'email')
+    DEFAULT_FIELDS = ('name',)
+
+    def get(self):
+        self.set_version_etag(DOC_ID, 1)
+        self.write_doc(self.projection('version'))
+
+
+PAGE_DOCS = [{'_id': ObjectId(), 'name': 'p%02d' % (i % 7), 'user_id': 1} for i in range(25)]
+
+
+class PageHandler(Handler):
+    # pylint: disable=locally-disabled, abstract-method
+    """ pages of PAGE_DOCS, ?key= sorts by another field """
+    FIELDS = ('id', 'name')
+    DEFAULT_FIELDS = ('name',)
+
+    async def get(self):
+        await self.write_page(self.settings['phrasebooks'], {'user_id': 1}, self.projection(),
+                              key=self.get_argument('key', '_id'))
+
+
+class HandlerTests(AsyncHTTPTestCase):
+    """
+    Tests for base Handler
+    """
+    def setUp(self):
+        super().setUp()
+        tools.init_page_key('secret')
+
+    def tearDown(self):
+        tools.init_page_key(None)
+        super().tearDown()
+
+    def get_app(self):
+        self.phrasebooks = memory.MemoryClient()['test'].phrasebooks
+        return tornado.web.Application([(r'/echo', EchoHandler), (r'/big', BigHandler),
+                                        (r'/fields', FieldsHandler),
+                                        (r'/page', PageHandler)],
+                                       phrasebooks=self.phrasebooks)
+
+    async def fetch(self, uri, **kwargs):
+        # pylint: disable=locally-disabled, arguments-differ
+        kwargs['raise_error'] = False
+        return await self.http_client.fetch(self.get_url(uri), **kwargs)
+
+    @gen_test
+    async def test_json(self):
+        """
+        json by default
+        """
+        res = await self.fetch('/echo')
+        self.assertEqual(res.code, 200)
+        self.assertEqual(json.loads(res.body.decode('utf8')), {'id': str(DOC_ID), 'name': 'test'})
+
+        res = await self.fetch('/echo', method='PUT', body='')
+        self.assertEqual(res.code, 400)
+        self.assertEqual(json.loads(res.body.decode('utf8')),
+                         {'message': 'Bad document', 'error_code': 7})
+
+        for body in (b'{"name":', b'\xff'):
+            res = await self.fetch('/echo', method='POST', body=body)
+            self.assertEqual(res.code, 400)
+            self.assertEqual(json.loads(res.body.decode('utf8'))['message'], 'Invalid body')
+
+    @gen_test
+    async def test_msgpack(self):
+        """
+        msgpack by Accept and Content-Type
+        """
+        if not tools.msgpack:
+            self.skipTest('msgpack is not installed')
+
+        headers = {'Accept': 'application/json;q=0.5, application/msgpack'}
+        res = await self.fetch('/echo', headers=headers)
+        self.assertEqual(res.headers['Content-Type'], 'application/msgpack')
+        self.assertEqual(tools.decode_msgpack(res.body), {'id': str(DOC_ID), 'name': 'test'})
+
+        headers['Content-Type'] = 'application/msgpack'
+        res = await self.fetch('/echo', method='POST', headers=headers,
+                               body=tools.msgpackify({'name': 'posted'}))
+        self.assertEqual(tools.decode_msgpack(res.body), {'name': 'posted'})
+
+        for body in (b'\xc1', b'\x92\x01', b'\x01\x02', b'\xa2\xff\xfe'):
+            res = await self.fetch('/echo', method='POST', headers=headers, body=body)
+            self.assertEqual(res.code, 400)
+            self.assertEqual(tools.decode_msgpack(res.body)['message'], 'Invalid body')
+
+        res = await self.fetch('/echo', method='PUT', body='', headers=headers)
+        self.assertEqual(res.code, 400)
+        self.assertEqual(tools.decode_msgpack(res.body)['message'], 'Bad document')
+
+        # json is preferred
+        res = await self.fetch('/echo', headers={
+            'Accept': 'application/json, application/msgpack;q=0.5'
+        })
+        self.assertEqual(json.loads(res.body.decode('utf8'))['name'], 'test')
+
+    @gen_test
+    async def test_gzip(self):
+        """
+        compresses big responses only, on a thread for very big ones
+        """
+        headers = {'Accept-Encoding': 'gzip'}
+        sizes = (100, rest.COMPRESS_MIN_BYTES * 2, rest.COMPRESS_THREAD_MIN_BYTES * 2)
+        for size in sizes:
+            for chunk in (0, 2000):
+                res = await self.fetch('/big?size=%d&stream=%d' % (size, chunk), headers=headers,
+                                       decompress_response=False)
+                self.assertEqual(res.code, 200)
+                body = res.body
+                written = size if not chunk else -(-size // chunk) * chunk
+                if written >= rest.COMPRESS_MIN_BYTES:
+                    self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+                    body = gzip.decompress(body)
+                else:
+                    self.assertNotIn('Content-Encoding', res.headers)
+                self.assertEqual(len(body), written)
+
+        # streamed, first flushed chunk is too small to be worth it
+        res = await self.fetch('/big?size=%d&stream=100' % sizes[1], headers=headers,
+                               decompress_response=False)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(len(res.body), -(-sizes[1] // 100) * 100)
+
+        stats = rest.compression_stats['BigHandler']
+        self.assertGreater(stats['bytes_in'], stats['bytes_out'])
+
+        # not without Accept-Encoding
+        res = await self.fetch('/big?size=%d' % sizes[1], decompress_response=False)
+        self.assertNotIn('Content-Encoding', res.headers)
+
+        # nor when refused by quality
+        for encoding in ('gzip;q=0', 'gzip; q=0.0, deflate', '*;q=0', 'identity, gzip;q=0'):
+            for chunk in (0, 2000):
+                res = await self.fetch('/big?size=%d&stream=%d' % (sizes[1], chunk),
+                                       headers={'Accept-Encoding': encoding},
+                                       decompress_response=False)
+                self.assertNotIn('Content-Encoding', res.headers)
+        res = await self.fetch('/big?size=%d' % sizes[1], decompress_response=False,
+                               headers={'Accept-Encoding': 'br;q=1, gzip;q=0.5'})
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+
+    @gen_test
+    async def test_gzip_thread(self):
+        """
+        finish() of a body compressed on a thread can be awaited,
+        the body is sent uncompressed if compression fails
+        """
+        url = '/big?size=%d&finish=1' % (rest.COMPRESS_THREAD_MIN_BYTES * 2)
+        headers = {'Accept-Encoding': 'gzip'}
+        res = await self.fetch(url, headers=headers, decompress_response=False)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(res.body)), rest.COMPRESS_THREAD_MIN_BYTES * 2)
+
+        def fail(*_):
+            raise zlib.error('failed')
+
+        compress, rest._gzip = rest._gzip, fail
+        try:
+            with ExpectLog(logger, 'compression failed'):
+                res = await self.fetch(url, headers=headers, decompress_response=False)
+        finally:
+            rest._gzip = compress
+        self.assertEqual(res.code, 200)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(len(res.body), rest.COMPRESS_THREAD_MIN_BYTES * 2)
+
+    @gen_test
+    async def test_fields(self):
+        """
+        ?fields= is validated and turned into a projection
+        """
+        res = await self.fetch('/fields')
+        self.assertEqual(json.loads(res.body.decode('utf8')),
+                         {'id': 0, 'name': 1, 'version': 1})
+        etag = res.headers['Etag']
+
+        res = await self.fetch('/fields?fields=name,id')
+        self.assertEqual(json.loads(res.body.decode('utf8')),
+                         {'id': 1, 'name': 1, 'version': 1})
+        self.assertNotEqual(res.headers['Etag'], etag)
+
+        res = await self.fetch('/fields?fields=name,password')
+        self.assertEqual(res.code, 400)
+        self.assertEqual(json.loads(res.body.decode('utf8'))['message'],
+                         'Unknown fields: password')
+
+        res = await self.fetch('/fields?fields=')
+        self.assertEqual(res.code, 400)
+
+    @gen_test
+    async def test_page(self):
+        """
+        listing by pages with continuation tokens, by _id and by another key
+        """
+        await self.phrasebooks.insert([dict(doc) for doc in PAGE_DOCS])
+        for key in ('_id', 'name'):
+            names = []
+            url = '/page?limit=10&key=' + key
+            pages = 0
+            while url:
+                res = await self.fetch(url)
+                self.assertEqual(res.code, 200)
+                page = json.loads(res.body.decode('utf8'))
+                self.assertLessEqual(len(page), 10)
+                self.assertEqual(set(page[0]), {'name'})
+                names += [doc['name'] for doc in page]
+                pages += 1
+                cursor = res.headers.get('X-Next-Cursor')
+                url = '/page?limit=10&key=%s&cursor=%s' % (key, cursor) if cursor else None
+            self.assertEqual(pages, 3)
+            docs = sorted(PAGE_DOCS, key=lambda doc: (doc[key], doc['_id']))
+            self.assertEqual(names, [doc['name'] for doc in docs])
+
+        # pages are streamed
+        flush_bytes, tools.JSON_FLUSH_BYTES = tools.JSON_FLUSH_BYTES, 50
+        try:
+            res = await self.fetch('/page?limit=10&fields=id,name')
+        finally:
+            tools.JSON_FLUSH_BYTES = flush_bytes
+        self.assertEqual(res.headers.get('Transfer-Encoding'), 'chunked')
+        self.assertIn('X-Next-Cursor', res.headers)
+        self.assertEqual([doc['id'] for doc in json.loads(res.body.decode('utf8'))],
+                         [str(doc['_id']) for doc in PAGE_DOCS[:10]])
+
+        # limit is capped
+        res = await self.fetch('/page?limit=100000')
+        self.assertEqual(res.code, 200)
+        self.assertEqual(len(json.loads(res.body.decode('utf8'))), 25)
+
+        res = await self.fetch('/page?limit=0')
+        self.assertEqual(res.code, 400)
+
+        # cursor of another listing
+        res = await self.fetch('/page?limit=10&key=name')
+        res = await self.fetch('/page?cursor=' + res.headers['X-Next-Cursor'])
+        self.assertEqual(res.code, 400)
+        self.assertEqual(json.loads(res.body.decode('utf8'))['message'], 'Invalid cursor')
@@ -0,0 +1,62 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+tests for rest/serializers.py
+"""
+import unittest
+
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from app.rest import serializers
+
+
+class SerializerTests(unittest.TestCase):
+    """
+    Tests for compiled serializers
+    """
+    def test_shape(self):
+        """
+        converts declared fields, nested ones too, drops private fields
+        """
+        convert = serializers.compile_shape({
+            '_id': serializers.OBJECT_ID,
+            'date': serializers.DATETIME,
+            'name': None,
+            'items': [{'_id': serializers.OBJECT_ID}],
+            'ids': [serializers.OBJECT_ID]
+        }, private=('password',))
+
+        oid, date = ObjectId(), datetime(2016, 10, 1)
+        doc = convert({
+            '_id': oid,
+            'date': date,
+            'name': 'n',
+            'password': 'p',
+            'items': [{'_id': oid}],
+            'ids': [oid],
+            'other': 1
+        })
+        self.assertEqual(doc, {
+            'id': str(oid),
+            'date': date.isoformat(),
+            'name': 'n',
+            'items': [{'id': str(oid)}],
+            'ids': [str(oid)],
+            'other': 1
+        })
+
+        # missing fields are skipped
+        self.assertEqual(convert({'name': 'n', 'date': None}), {'name': 'n', 'date': None})
+
+    def test_registry(self):
+        """
+        users drop password
+        """
+        oid = ObjectId()
+        self.assertEqual(serializers.serialize('users', {
+            '_id': oid,
+            'name': 'test user',
+            'password': 'hash',
+            'token_epoch': 1
+        }), {'id': str(oid), 'name': 'test user'})
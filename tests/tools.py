@@ -21,7 +21,7 @@ async def create_test_auth():
     """
     user = {
         'email': 'brooth@gmail.com',
-        'password': password_hash('123'),
+        'password': await password_hash('123'),
         'name': 'test user'
     }
     user['id'] = await model.db.users.insert(user)
@@ -35,7 +35,7 @@ async def create_test_auth():
 async def create_consumer(user_id):
     """ sample consumer """
     consumer = {
-        'secret': gen_token(2),
+        'secret_code': gen_token(2),
         'user_id': user_id,
         'name': 'test consumer'
     }
@@ -0,0 +1,477 @@
+# pylint: disable=locally-disabled, invalid-name
+"""
+tests for rest/tools.py
+"""
+import hashlib
+import hmac
+import json
+import time
+import unittest
+
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from bson.objectid import ObjectId
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from app.model import memory
+from app.model import model
+from app.rest import tools
+from app.rest.rest import ErrorResponse
+from app.rest.tools import LRUCache, consumer_cache, consumer_negative_cache
+from app.rest.tools import invalidate_consumer
+
+logger = getLogger()
+
+
+class LRUCacheTests(unittest.TestCase):
+    """
+    Tests for LRUCache
+    """
+    def test_get_set(self):
+        """
+        hits and misses
+        """
+        cache = LRUCache(10, 60)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_eviction(self):
+        """
+        least recently used entry goes first
+        """
+        cache = LRUCache(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_ttl(self):
+        """
+        entries expire
+        """
+        cache = LRUCache(10, 60)
+        cache.set('a', 1, ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+        cache.set('b', 2)
+        cache.invalidate('b')
+        self.assertIsNone(cache.get('b'))
+
+    def test_generation(self):
+        """
+        values read before an invalidation are not cached
+        """
+        cache = LRUCache(10, 60)
+        generation = cache.generation
+        cache.invalidate('a')
+        cache.set('a', 'stale', generation=generation)
+        self.assertIsNone(cache.get('a'))
+
+        cache.set('a', 'fresh', generation=cache.generation)
+        self.assertEqual(cache.get('a'), 'fresh')
+
+    def test_invalidate_consumer(self):
+        """
+        drops all codes of a consumer and given negative entries
+        """
+        consumer_cache.set('old', 1)
+        consumer_cache.set('other', 2)
+        consumer_negative_cache.set('new', True)
+
+        invalidate_consumer(1, 'new')
+        self.assertIsNone(consumer_cache.get('old'))
+        self.assertIsNone(consumer_negative_cache.get('new'))
+        self.assertEqual(consumer_cache.get('other'), 2)
+        consumer_cache.clear()
+
+
+class AuthCacheTests(AsyncTestCase):
+    """
+    Tests for token cache of auth_required
+    """
+    def setUp(self):
+        super().setUp()
+        model.init('tools-tests', model.MEMORY_URI)
+
+    def tearDown(self):
+        tools.token_cache.clear()
+        tools.epoch_cache.clear()
+        consumer_cache.clear()
+        consumer_negative_cache.clear()
+        model.db = model.client = model._pid = None
+        super().tearDown()
+
+    async def create_auth(self, expires_in=60):
+        """ user and auth, returns (user_id, access_token) """
+        user_id = await model.db.users.insert({'email': 'a@b.c', 'token_epoch': 0})
+        token = tools.gen_token()
+        await model.db.auths.insert({
+            'access_token': token,
+            'user_id': user_id,
+            'token_epoch': 0,
+            'expire_date': datetime.utcnow() + timedelta(seconds=expires_in)
+        })
+        return user_id, token
+
+    @gen_test
+    async def test_hit_miss(self):
+        """
+        miss populates the cache, hit doesn't query mongo
+        """
+        user_id, token = await self.create_auth()
+        self.assertEqual(await tools._authorize_bearer(token), user_id)
+        self.assertEqual(tools.token_cache.stats()['misses'], 1)
+        self.assertEqual(tools.token_cache.get(token)[0], user_id)
+
+        # gone from mongo, still served by the cache
+        await model.db.auths.remove({'access_token': token})
+        self.assertEqual(await tools._authorize_bearer(token), user_id)
+        self.assertEqual(tools.token_cache.stats()['hits'], 2)
+
+        # dropped, queried again
+        tools.token_cache.invalidate(token)
+        with self.assertRaises(ErrorResponse) as ctx:
+            await tools._authorize_bearer(token)
+        self.assertEqual(ctx.exception.message, 'Invalid token')
+
+    @gen_test
+    async def test_expiry(self):
+        """
+        expired entries are queried again, expired tokens rejected on hits
+        """
+        user_id, token = await self.create_auth()
+        tools.token_cache.ttl = 0.01
+        try:
+            self.assertEqual(await tools._authorize_bearer(token), user_id)
+            await model.db.auths.update({'access_token': token}, {'$set': {
+                'expire_date': datetime.utcnow() - timedelta(seconds=1)
+            }})
+            await gen.sleep(0.02)
+            with self.assertRaises(ErrorResponse) as ctx:
+                await tools._authorize_bearer(token)
+            self.assertEqual(ctx.exception.message, 'Token expired')
+            self.assertEqual(tools.token_cache.stats()['misses'], 2)
+        finally:
+            tools.token_cache.ttl = tools.TOKEN_CACHE_TTL
+
+        # cached, but past expire_date
+        _, token = await self.create_auth(expires_in=0.01)
+        await tools._authorize_bearer(token)
+        await gen.sleep(0.02)
+        with self.assertRaises(ErrorResponse) as ctx:
+            await tools._authorize_bearer(token)
+        self.assertEqual(ctx.exception.message, 'Token expired')
+
+    @gen_test
+    async def test_invalidated_lookup(self):
+        """
+        epoch read before a revocation isn't cached after it
+        """
+        user_id = await model.db.users.insert({'email': 'a@b.c', 'token_epoch': 0})
+        user = await model.db.users.find_one(user_id)
+
+        # the query has read epoch 0, its reply is on the way
+        reply = Future()
+        find_one, model.find_one = model.find_one, lambda *args: reply
+        try:
+            lookup = gen.convert_yielded(tools.user_token_epoch(user_id))
+            await tools.revoke_user_tokens(user_id)
+            reply.set_result(user)
+            self.assertEqual(await lookup, 0)
+        finally:
+            model.find_one = find_one
+        self.assertIsNone(tools.epoch_cache.get(user_id))
+        self.assertEqual(await tools.user_token_epoch(user_id), 1)
+
+    @gen_test
+    async def test_consumer_flood(self):
+        """
+        bogus secret codes don't evict valid consumers
+        """
+        consumer_id = await model.db.consumers.insert({'secret_code': 'valid'})
+        self.assertEqual(await tools._authorize_secret('valid'), consumer_id)
+
+        for i in range(tools.CONSUMER_CACHE_SIZE + 10):
+            with self.assertRaises(ErrorResponse):
+                await tools._authorize_secret('bogus%d' % i)
+        self.assertEqual(len(consumer_negative_cache), tools.CONSUMER_CACHE_NEGATIVE_SIZE)
+        self.assertEqual(consumer_cache.get('valid'), consumer_id)
+
+        # negative entries don't reach mongo
+        await model.db.consumers.insert({'secret_code': 'bogus%d' % tools.CONSUMER_CACHE_SIZE})
+        with self.assertRaises(ErrorResponse):
+            await tools._authorize_secret('bogus%d' % tools.CONSUMER_CACHE_SIZE)
+
+
+class SignedTokenTests(AsyncTestCase):
+    """
+    Tests for signed access tokens
+    """
+    def setUp(self):
+        super().setUp()
+        tools.init_tokens(tools.TOKEN_FORMAT_SIGNED, {'k1': 'secret1', 'k2': 'secret2'}, 'k2')
+        model.init('tools-tests', model.MEMORY_URI)
+
+    def tearDown(self):
+        tools.init_tokens()
+        tools.token_denylist.clear()
+        model.db = model.client = model._pid = None
+        super().tearDown()
+
+    def test_sign_verify(self):
+        """
+        round trip, tampering and key rotation
+        """
+        user_id = ObjectId()
+        expire_date = datetime.utcnow() + timedelta(seconds=60)
+        token = tools.sign_token(user_id, ObjectId(), expire_date, 'jti')
+
+        claims = tools.verify_signed_token(token)
+        self.assertEqual(claims['u'], str(user_id))
+        self.assertEqual(claims['j'], 'jti')
+        self.assertEqual(token, tools.sign_token(
+            user_id, ObjectId(claims['c']), expire_date, 'jti'))
+
+        self.assertIsNone(tools.verify_signed_token(token[:-2]))
+        self.assertIsNone(tools.verify_signed_token('s1.k2.e30'))
+        self.assertIsNone(tools.verify_signed_token('s1.k2.\xe9.x'))
+
+        # old key still verifies, removed key doesn't
+        tools.init_tokens(tools.TOKEN_FORMAT_SIGNED, {'k2': 'secret2', 'k3': 'secret3'}, 'k3')
+        self.assertIsNotNone(tools.verify_signed_token(token))
+        tools.init_tokens(tools.TOKEN_FORMAT_SIGNED, {'k3': 'secret3'}, 'k3')
+        self.assertIsNone(tools.verify_signed_token(token))
+
+    @gen_test
+    async def test_deny(self):
+        """
+        deny list drops expired entries
+        """
+        await tools.deny_token('old', datetime.utcnow() - timedelta(seconds=10))
+        await tools.deny_token('new', datetime.utcnow() + timedelta(seconds=10))
+        self.assertNotIn('old', tools.token_denylist)
+        self.assertIn('new', tools.token_denylist)
+
+    @gen_test
+    async def test_deny_persisted(self):
+        """
+        revoked token stays rejected after the deny list is rebuilt
+        """
+        await model.ensure_indexes()
+        expire_date = datetime.utcnow() + timedelta(seconds=60)
+        token = tools.sign_token(ObjectId(), ObjectId(), expire_date, 'jti')
+        await tools.deny_token('jti', expire_date)
+        await tools.deny_token('gone', datetime.utcnow() - timedelta(seconds=10))
+
+        # restarted worker
+        tools.token_denylist.clear()
+        await tools.load_token_denylist()
+        self.assertEqual(set(tools.token_denylist), {'jti'})
+        with self.assertRaises(ErrorResponse) as ctx:
+            await tools._authorize_bearer(token)
+        self.assertEqual(ctx.exception.message, 'Invalid token')
+
+    @gen_test
+    async def test_non_ascii(self):
+        """
+        non-ascii bearer token is rejected, not a server error
+        """
+        with self.assertRaises(ErrorResponse) as ctx:
+            await tools._authorize_bearer('s1.k2.\xe9.x')
+        self.assertEqual((ctx.exception.message, ctx.exception.status_code),
+                         ('Invalid token', 401))
+
+
+class PageTokenTests(unittest.TestCase):
+    """
+    Tests for continuation tokens of listings
+    """
+    def setUp(self):
+        super().setUp()
+        tools.init_page_key('secret')
+
+    def tearDown(self):
+        tools.init_tokens()
+        tools.init_page_key(None)
+        super().tearDown()
+
+    def test_sign_verify(self):
+        """
+        round trip of typed values, tampering and scope
+        """
+        after = [datetime(2017, 1, 2, 3, 4, 5), ObjectId()]
+        token = tools.sign_page_token('phrasebooks:name', after)
+        self.assertTrue(token.startswith(tools.PAGE_TOKEN_PREFIX))
+
+        restored = tools.verify_page_token(token, 'phrasebooks:name')
+        self.assertEqual(restored[0].replace(tzinfo=None), after[0])
+        self.assertEqual(restored[1], after[1])
+
+        self.assertIsNone(tools.verify_page_token(token, 'consumers:_id'))
+        self.assertIsNone(tools.verify_page_token(token[:-2], 'phrasebooks:name'))
+        self.assertIsNone(tools.verify_page_token('p1..e30.', 'phrasebooks:name'))
+        self.assertIsNone(tools.verify_page_token('1', 'phrasebooks:name'))
+        self.assertIsNone(tools.verify_page_token('p1..\xe9.x', 'phrasebooks:name'))
+
+        # signed, but not claims of a listing
+        for payload in (b'{"s": "phrasebooks:name"}', b'{"a": 1, "s": "phrasebooks:name"}',
+                        b'[]', b'{"$oid": "x"}'):
+            payload = tools._b64(payload)
+            signature = tools._b64(hmac.new(tools._page_key, ('.' + payload).encode('ascii'),
+                                            hashlib.sha256).digest())
+            self.assertIsNone(tools.verify_page_token('p1..%s.%s' % (payload, signature),
+                                                      'phrasebooks:name'))
+
+    def test_token_keys(self):
+        """
+        signed by current token key when configured
+        """
+        tools.init_tokens(tools.TOKEN_FORMAT_SIGNED, {'k1': 'secret1'}, 'k1')
+        token = tools.sign_page_token('consumers:_id', [ObjectId()])
+        self.assertTrue(token.startswith(tools.PAGE_TOKEN_PREFIX + 'k1.'))
+        self.assertIsNotNone(tools.verify_page_token(token, 'consumers:_id'))
+
+        tools.init_tokens(tools.TOKEN_FORMAT_SIGNED, {'k2': 'secret2'}, 'k2')
+        self.assertIsNone(tools.verify_page_token(token, 'consumers:_id'))
+
+    def test_page_key(self):
+        """
+        workers with the same page key accept each other's tokens, no key no tokens
+        """
+        token = tools.sign_page_token('consumers:_id', [ObjectId()])
+        tools.init_page_key(b'secret')
+        self.assertIsNotNone(tools.verify_page_token(token, 'consumers:_id'))
+        tools.init_page_key('other')
+        self.assertIsNone(tools.verify_page_token(token, 'consumers:_id'))
+
+        tools.init_page_key(None)
+        self.assertIsNone(tools.verify_page_token(token, 'consumers:_id'))
+        with self.assertRaises(RuntimeError):
+            tools.sign_page_token('consumers:_id', [ObjectId()])
+
+
+class PasswordTests(AsyncTestCase):
+    """
+    Tests for password hashing
+    """
+    @gen_test
+    async def test_hash_verify(self):
+        """
+        current and legacy hashes
+        """
+        hashed = await tools.password_hash('123')
+        self.assertTrue(hashed.startswith(tools.PASSWORD_KDF + '$'))
+        self.assertFalse(tools.needs_rehash(hashed))
+        self.assertTrue(await tools.verify_password('123', hashed))
+        self.assertFalse(await tools.verify_password('12', hashed))
+
+        legacy = tools._hash_password('123', 'sha224')
+        self.assertTrue(tools.needs_rehash(legacy))
+        self.assertTrue(await tools.verify_password('123', legacy))
+        self.assertFalse(await tools.verify_password('12', legacy))
+
+        self.assertEqual(tools.password_stats['pending'], 0)
+
+
+class JsonEncoderTests(unittest.TestCase):
+    """
+    Tests for json encoders
+    """
+    def test_encoders(self):
+        """
+        every encoder handles nested ObjectIds and datetimes
+        """
+        oid = ObjectId()
+        date = datetime(2016, 10, 1, 12, 30, 15, 500)
+        doc = {'b': oid, 'a': [{'date': date}]}
+        for name, encoder in tools.JSON_ENCODERS.items():
+            data = json.loads(encoder(doc, True))
+            self.assertEqual(data, {'b': str(oid), 'a': [{'date': date.isoformat()}]}, name)
+
+        data = json.loads(tools.jsonify({'_id': oid}))
+        self.assertEqual(data, {'id': str(oid)})
+
+
+class FakeHandler(object):
+    """
+    collects written chunks and flushes
+    """
+    def __init__(self):
+        self.chunks = []
+        self.flushes = 0
+
+    def write(self, chunk):
+        """ RequestHandler.write """
+        self.chunks.append(chunk)
+
+    async def flush(self):
+        """ RequestHandler.flush """
+        self.flushes += 1
+
+
+class StreamJsonListTests(AsyncTestCase):
+    """
+    Tests for stream_json_list
+    """
+    @gen_test
+    async def test_stream(self):
+        """
+        writes valid json of a cursor or a list, flushes by threshold
+        """
+        docs = [{'_id': ObjectId(), 'name': 'n%d' % i} for i in range(10)]
+        ids = [str(doc['_id']) for doc in docs]
+        collection = memory.MemoryClient()['test'].phrases
+        await collection.insert([dict(doc) for doc in docs])
+        handler = FakeHandler()
+        await tools.stream_json_list(handler, collection.find(), flush_bytes=100)
+
+        data = json.loads(''.join(handler.chunks))
+        self.assertEqual([doc['id'] for doc in data], ids)
+        self.assertGreater(handler.flushes, 2)
+
+        handler = FakeHandler()
+        await tools.stream_json_list(handler, docs, flush_bytes=None)
+        self.assertEqual([doc['id'] for doc in json.loads(''.join(handler.chunks))], ids)
+        self.assertEqual(handler.flushes, 0)
+
+        handler = FakeHandler()
+        await tools.stream_json_list(handler, [])
+        self.assertEqual(''.join(handler.chunks), '[]')
+
+
+class StreamNdjsonTests(AsyncTestCase):
+    """
+    Tests for stream_ndjson
+    """
+    @gen_test
+    async def test_stream(self):
+        """
+        one document per line, flushes by threshold
+        """
+        docs = [{'_id': ObjectId(), 'name': 'n%d' % i} for i in range(10)]
+        ids = [str(doc['_id']) for doc in docs]
+        collection = memory.MemoryClient()['test'].phrases
+        await collection.insert(docs)
+        handler = FakeHandler()
+        await tools.stream_ndjson(handler, collection.find(), flush_bytes=100)
+
+        lines = ''.join(handler.chunks).split('\n')
+        self.assertEqual(lines[-1], '')
+        self.assertEqual([json.loads(line)['id'] for line in lines[:-1]], ids)
+        self.assertGreater(handler.flushes, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,17 @@
 """
 tests for user_id.py
 """
+import json
+
 from logging import getLogger
 
+from tornado import gen
 from tornado.testing import gen_test
 
 from tests.main import UnitTest
-from tests.tools import read_json, create_test_auth
+from tests.tools import read_json, create_test_auth, create_auth
+
+from app.model import model
 
 logger = getLogger()
 
@@ -47,6 +52,46 @@ class UserApiTests(UnitTest):
         self.assertEqual(res.code, 200)
         self.assertEqual(data['name'], 'test user')
 
+        # not modified
+        logger.debug('> not modified')
+
+        headers = {
+            'Authorization': 'Bearer ' + auth['access_token'],
+            'If-None-Match': res.headers['Etag']
+        }
+        res = await self.fetch('/users', headers=headers)
+
+        self.assertEqual(res.code, 304)
+        self.assertEqual(len(res.body), 0)
+
+        # modified
+        logger.debug('> modified')
+
+        await model.db.users.update({'_id': auth['user_id']},
+                                    model.versioned({'$set': {'name': 'new name'}}))
+        res = await self.fetch('/users', headers=headers)
+        data = read_json(res)
+
+        self.assertEqual(res.code, 200)
+        self.assertEqual(data['name'], 'new name')
+        self.assertNotEqual(res.headers['Etag'], headers['If-None-Match'])
+
+        # selected fields
+        logger.debug('> selected fields')
+
+        res = await self.fetch('/users?fields=id,email', headers={
+            'Authorization': 'Bearer ' + auth['access_token']
+        })
+        data = read_json(res)
+
+        self.assertEqual(res.code, 200)
+        self.assertEqual(data, {'id': str(auth['user_id']), 'email': 'brooth@gmail.com'})
+
+        res = await self.fetch('/users?fields=password', headers={
+            'Authorization': 'Bearer ' + auth['access_token']
+        })
+        self.assertEqual(res.code, 400)
+
     # def test_post(self):
         # """
         # POST /user
@@ -199,191 +244,104 @@ class UserApiTests(UnitTest):
         # self.assertEqual(res.status_code, 400)
         # self.assertEqual(data['message'], 'Email brooth@gmail.com already exists')
 
-    # def test_put(self):
-        # """
-        # PUT /user
-        # """
-        # logger.debug('=== test_put() ===')
-
-        # # not authorized
-        # logger.debug('> not authorized')
-        # res = self.test_client.put('/user')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
-
-        # self.assertEqual(res.status_code, 401)
-        # self.assertEqual(data['message'], 'Not authorized')
-
-        # # nothing to put
-        # logger.debug('> nothing to put')
-
-        # auth = create_test_auth()
-        # session = auth[3]
-
-        # res = self.test_client.put('/user', headers={'access_token': auth[2].access_token})
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
-
-        # self.assertEqual(res.status_code, 400)
-        # self.assertEqual(data['message'], 'Nothing to update')
-
-        # # can't clear email
-        # logger.debug('> can\'t clear email')
-
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'email': ''}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
-
-        # self.assertEqual(res.status_code, 400)
-        # self.assertEqual(data['message'], 'Invalid email ')
-
-        # # name is too long
-        # name = ('N' * 121)
-        # logger.debug('> too long name %s', name)
-
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'name': name}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
-
-        # self.assertEqual(res.status_code, 400)
-        # self.assertEqual(data['message'], 'Too long name')
-
-        # # too long password
-        # password = 'P' * 21
-        # logger.debug('> too long password %s', password)
-
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'password': password}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
-
-        # self.assertEqual(res.status_code, 400)
-        # self.assertEqual(data['message'], 'Too long password')
-
-        # # no old password
-        # logger.debug('> no old password')
-
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'password': '123'}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
-
-        # self.assertEqual(res.status_code, 400)
-        # self.assertEqual(data['message'], 'Missing required data(old_password)')
+    @gen_test
+    async def test_email_race(self):
+        """
+        concurrent POST/PUT of one email: one wins, others get 'already exists'
+        """
+        body = json.dumps({'email': 'race@gmail.com', 'password': '123'})
+        responses = await gen.multi([self.fetch('/users', method='POST', body=body)
+                                     for _ in range(3)])
+        self.assertEqual(sorted(res.code for res in responses), [200, 400, 400])
+        for res in responses:
+            if res.code == 400:
+                self.assertEqual(read_json(res), {
+                    'message': 'Email race@gmail.com already exists',
+                    'error_code': 100
+                })
+
+        # two users take the same email
+        _, consumer, first = await create_test_auth()
+        user_id = await model.db.users.insert({'email': 'other@gmail.com'})
+        second = await create_auth(user_id, consumer['id'])
+        body = json.dumps({'email': 'new@gmail.com'})
+        responses = await gen.multi([
+            self.fetch('/users', method='PUT', body=body,
+                       headers={'Authorization': 'Bearer ' + auth['access_token']})
+            for auth in (first, second)])
+        self.assertEqual(sorted(res.code for res in responses), [200, 400])
+        self.assertEqual(await model.db.users.count({'email': 'new@gmail.com'}), 1)
 
-        # # incorrect old password
-        # logger.debug('> invalid old password')
+    @gen_test
+    async def test_put(self):
+        """
+        PUT /users
+        """
+        logger.debug('=== test_put() ===')
 
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'password': '123', 'old_password': '1'}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
+        # not authorized
+        logger.debug('> not authorized')
+        res = await self.fetch('/users', method='PUT', body='{}')
+        data = read_json(res)
+        logger.debug('< ' + str(data))
 
-        # self.assertEqual(res.status_code, 401)
-        # self.assertEqual(data['message'], 'Invalid old password')
+        self.assertEqual(res.code, 401)
+        self.assertEqual(data['message'], 'Not authorized')
 
-        # # changes password. deletes tokens
-        # logger.debug('> changes password')
+        # nothing to put
+        logger.debug('> nothing to put')
 
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'password': '111', 'old_password': '123'}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
+        user, _, auth = await create_test_auth()
+        headers = {'Authorization': 'Bearer ' + auth['access_token']}
 
-        # self.assertEqual(res.status_code, 200)
-        # self.assertEqual(data, 'OK')
-        # self.assertEqual(session.query(User).get(
-        #     auth[0].id).password, password_hash('111'))
-        # self.assertIsNone(session.query(Auth).filter(
-        #     Auth.user_id == auth[0].id).first())
+        res = await self.fetch('/users', method='PUT', body='{}', headers=headers)
+        data = read_json(res)
+        logger.debug('< ' + str(data))
 
-        # # restore token
-        # session.merge(auth[2])
-        # session.commit()
+        self.assertEqual(res.code, 400)
+        self.assertEqual(data['message'], 'Nothing to update')
 
-        # # allows clear password
-        # logger.debug('> allows clear password')
+        # changes name
+        logger.debug('> changes name')
 
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'password': '', 'old_password': '111'}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
+        res = await self.fetch('/users', method='PUT', headers=headers,
+                               body=json.dumps({'name': 'test put user'}))
+        data = read_json(res)
+        logger.debug('< ' + str(data))
 
-        # self.assertEqual(res.status_code, 200)
-        # self.assertEqual(data, 'OK')
-        # self.assertEqual(session.query(User).get(auth[0].id).password, password_hash(''))
+        self.assertEqual(res.code, 200)
+        self.assertEqual(data, 'OK')
+        self.assertEqual((await model.db.users.find_one({'_id': user['id']}))['name'],
+                         'test put user')
 
-        # # restore token
-        # session.merge(auth[2])
-        # session.commit()
+        # incorrect old password
+        logger.debug('> invalid old password')
 
-        # # changes email
-        # logger.debug('> changes email')
+        res = await self.fetch('/users', method='PUT', headers=headers,
+                               body=json.dumps({'password': '111', 'old_password': '1'}))
+        data = read_json(res)
+        logger.debug('< ' + str(data))
 
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'email': 'brooth@mail.ru'}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
+        self.assertEqual(res.code, 401)
+        self.assertEqual(data['message'], 'Invalid old password')
 
-        # self.assertEqual(res.status_code, 200)
-        # self.assertEqual(data, 'OK')
-        # self.assertEqual(session.query(User).get(auth[0].id).email, 'brooth@mail.ru')
+        # changes password. revokes tokens
+        logger.debug('> changes password')
 
-        # # changes name
-        # logger.debug('> changes name')
+        res = await self.fetch('/users', method='PUT', headers=headers,
+                               body=json.dumps({'password': '111', 'old_password': '123'}))
+        data = read_json(res)
+        logger.debug('< ' + str(data))
 
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps({'name': 'test put user'}),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
+        self.assertEqual(res.code, 200)
+        self.assertEqual(data, 'OK')
 
-        # self.assertEqual(res.status_code, 200)
-        # self.assertEqual(data, 'OK')
-        # self.assertEqual(session.query(User).get(auth[0].id).name, 'test put user')
-
-        # # changes all
-        # logger.debug('> changes all')
-
-        # data = {
-        #     'email': 'usr1@mail.ru',
-        #     'name': 'name1',
-        #     'password': 'pwd1',
-        #     'old_password': ''
-        # }
-
-        # res = self.test_client.put('/user',
-        #                            headers={'access_token': auth[2].access_token},
-        #                            data=json.dumps(data),
-        #                            content_type='application/json')
-        # data = json.loads(res.get_data(as_text=True))
-        # logger.debug('< ' + str(data))
+        res = await self.fetch('/users', headers=headers)
+        data = read_json(res)
+        logger.debug('< ' + str(data))
 
-        # self.assertEqual(res.status_code, 200)
-        # self.assertEqual(data, 'OK')
-        # user = session.query(User).get(auth[0].id)
-        # self.assertEqual(user.email, 'usr1@mail.ru')
-        # self.assertEqual(user.name, 'name1')
-        # self.assertEqual(user.password, password_hash('pwd1'))
+        self.assertEqual(res.code, 401)
+        self.assertEqual(data['message'], 'Invalid token')
 
     # def test_delete(self):
         # """